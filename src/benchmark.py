@@ -0,0 +1,496 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from memcache import Client
+from utils import metrics
+from utils.base_storage import AWSS3, FileSystem, Mem
+from utils.complex_storage import Auto_tiering, Replica, Tiering, TwoLevelCaching
+from utils.cost_model import CostModel
+from utils.fake_s3 import FakeS3Client
+from utils.memcached_server import MemcachedServer
+from utils.serializer import Serializer, msgpack
+from utils.workloads import DISTRIBUTIONS, READ, WRITE, Workload, parse_sizes, presets
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger("benchmark")
+
+STORAGES = (
+    "mem",
+    "fs",
+    "aws",
+    "replica",
+    "tiering",
+    "tiering-cost-model",
+    "two-level-caching",
+    "auto-tiering",
+)
+
+
+class Backends:
+    """Local stand-ins of the backends: a memcached server, a fake S3 and a directory
+
+    Each run gets an empty memcached, its own bucket and its own directory.
+
+    Args:
+        s3_latency (float, optional): seconds added to each S3 request. Defaults to 0.002.
+        mem_latency (float, optional): seconds added to each memcached response. Defaults to 0.
+    """
+
+    def __init__(self, s3_latency: float = 0.002, mem_latency: float = 0.0) -> None:
+        self.server = MemcachedServer(latency=mem_latency).start()
+        self.s3 = FakeS3Client(latency=s3_latency)
+        self.directory = tempfile.TemporaryDirectory(prefix="benchmark-")
+        self.__runs = itertools.count()
+        self.run = 0
+
+    def reset(self) -> None:
+        self.run = next(self.__runs)
+        self.client().flush_all()
+
+    def client(self) -> Client:
+        return Client([self.server.address])
+
+    def mem(self) -> Mem:
+        return Mem(self.client())
+
+    def root(self, name: str = "fs") -> str:
+        return os.path.join(self.directory.name, str(self.run), name)
+
+    def fs(self) -> FileSystem:
+        return FileSystem(root=self.root())
+
+    def aws(self) -> AWSS3:
+        return AWSS3(client=self.s3, bucket=f"benchmark-{self.run}")
+
+    def close(self) -> None:
+        self.server.stop()
+        self.directory.cleanup()
+
+
+class Target:
+    """Storage under benchmark, with the operations of a workload on its key indexes"""
+
+    def __init__(
+        self,
+        storage,
+        read: Callable[[int], bytes | None],
+        create: Callable[[int, bytes], None],
+    ) -> None:
+        self.storage = storage
+        self.read = read
+        self.create = create
+
+    def flush(self) -> None:
+        """Wait for the background work of the storage, e.g. the migrations"""
+        flush = getattr(self.storage, "flush", None)
+        if flush is not None:
+            flush()
+
+    def close(self) -> None:
+        close = getattr(self.storage, "close", None)
+        if close is not None:
+            close()
+
+
+def target(name: str, backends: Backends, workload: Workload) -> Target:
+    keys = workload.keys
+    total = sum(workload.sizes)
+
+    def simple(storage) -> Target:
+        return Target(
+            storage,
+            lambda index: storage.read(keys[index]),
+            lambda index, data: storage.create(keys[index], data),
+        )
+
+    def with_cost(storage) -> Target:
+        rate = workload.rate
+        return Target(
+            storage,
+            lambda index: storage.read(keys[index], rate(index)),
+            lambda index, data: storage.create(keys[index], data, rate(index)),
+        )
+
+    if name in ("mem", "fs", "aws"):
+        return simple(metrics.instrument(getattr(backends, name)(), name))
+    if name == "replica":
+        return simple(Replica(backends.fs(), backends.aws()))
+    if name == "tiering":
+        return with_cost(Tiering(backends.fs(), backends.aws(), backends.mem()))
+    if name == "tiering-cost-model":
+        model = CostModel({"fs": total // 4, "mem": total // 10})
+        return with_cost(Tiering(backends.fs(), backends.aws(), backends.mem(), model))
+    if name == "two-level-caching":
+        return simple(
+            TwoLevelCaching(
+                backends.client(),
+                fs_lru_capacity=max(len(keys) // 4, 2),
+                mem_lru_capacity=max(len(keys) // 20, 1),
+                fs_root=backends.root(),
+                aws=backends.aws(),
+            )
+        )
+    if name == "auto-tiering":
+        return simple(
+            Auto_tiering(
+                backends.fs(),
+                backends.aws(),
+                backends.mem(),
+                half_life=60.0,
+                sweep_interval=1.0,
+            )
+        )
+    raise ValueError(f"Unknown storage {name}, expected one of {STORAGES}")
+
+
+def latencies(seconds: List[float]) -> Dict[str, float]:
+    seconds = sorted(seconds)
+    count = len(seconds)
+    if not count:
+        return {"count": 0}
+    return {
+        "count": count,
+        "mean": sum(seconds) / count,
+        "p50": seconds[min(int(0.5 * count), count - 1)],
+        "p99": seconds[min(int(0.99 * count), count - 1)],
+        "max": seconds[-1],
+    }
+
+
+def tier_counters() -> Dict[str, Dict[str, int]]:
+    return {name: dict(tier.counters) for name, tier in metrics.METRICS.items()}
+
+
+def run(name: str, workload: Workload, backends: Backends) -> Dict[str, Any]:
+    """Load the keys of the workload in the storage, then time its operations"""
+    backends.reset()
+    metrics.METRICS.clear()
+    enabled = metrics.METRICS_ENABLED
+    # the composite storages instrument their tiers when they are created
+    metrics.METRICS_ENABLED = True
+    try:
+        storage = target(name, backends, workload)
+    finally:
+        metrics.METRICS_ENABLED = enabled
+    try:
+        for index in range(len(workload.keys)):
+            storage.create(index, workload.value(index))
+        storage.flush()
+        before = tier_counters()
+
+        seconds: Dict[str, List[float]] = {READ: [], WRITE: []}
+        written = errors = misses = 0
+        start = time.perf_counter()
+        for operation, index in workload:
+            begin = time.perf_counter()
+            try:
+                if operation == READ:
+                    value = storage.read(index)
+                    misses += value is None
+                else:
+                    data = workload.value(index)
+                    storage.create(index, data)
+                    written += len(data)
+            except Exception as e:
+                log.debug("%s %s - %s", operation, workload.keys[index], e)
+                errors += 1
+            seconds[operation].append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - start
+        storage.flush()
+        after = tier_counters()
+    finally:
+        storage.close()
+
+    tiers = {}
+    for tier, counters in after.items():
+        delta = {
+            counter: value - before.get(tier, {}).get(counter, 0)
+            for counter, value in counters.items()
+        }
+        lookups = delta["hits"] + delta["misses"]
+        delta["hit_ratio"] = delta["hits"] / lookups if lookups else None
+        tiers[tier] = delta
+    return {
+        "storage": name,
+        "workload": workload.name,
+        "operations": workload.operations,
+        "seconds": elapsed,
+        "throughput": workload.operations / elapsed if elapsed else None,
+        "latency": {
+            operation: latencies(values) for operation, values in seconds.items()
+        },
+        "errors": errors,
+        "misses": misses,
+        "tiers": tiers,
+        "bytes_written": written,
+        # replicas, cache fills and migrations
+        "bytes_moved": sum(tier["bytes_in"] for tier in tiers.values()) - written,
+    }
+
+
+def benchmark(
+    storages: Iterable[str],
+    workloads: Iterable[Workload],
+    s3_latency: float = 0.002,
+    mem_latency: float = 0.0,
+) -> Dict[str, Any]:
+    """Run every workload on every storage, with the environment of the results
+
+    Args:
+        storages (Iterable[str]): names of the storages, see `STORAGES`
+        workloads (Iterable[Workload]): workloads to run
+        s3_latency (float, optional): seconds added to each S3 request. Defaults to 0.002.
+        mem_latency (float, optional): seconds added to each memcached response. Defaults to 0.
+    """
+    workloads = list(workloads)
+    backends = Backends(s3_latency, mem_latency)
+    results = []
+    try:
+        for workload in workloads:
+            for name in storages:
+                log.info("running %s on %s", workload.name, name)
+                results.append(run(name, workload, backends))
+    finally:
+        backends.close()
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "s3_latency": s3_latency,
+            "mem_latency": mem_latency,
+            "workloads": [workload.config() for workload in workloads],
+        },
+        "results": results,
+    }
+
+
+class ClientPickle:
+    """Serialization of the values by the memcache client, pickle protocol 0 by default
+
+    The type of the value is kept in the flags of the item, next to the value.
+    """
+
+    BYTES, STR, PICKLE = range(3)
+
+    def dumps(self, value: Any) -> Tuple[int, bytes]:
+        if isinstance(value, bytes):
+            return self.BYTES, value
+        if isinstance(value, str):
+            return self.STR, value.encode("utf-8")
+        return self.PICKLE, pickle.dumps(value, protocol=0)
+
+    def loads(self, item: Tuple[int, bytes]) -> Any:
+        flags, data = item
+        if flags == self.BYTES:
+            return data
+        if flags == self.STR:
+            return data.decode("utf-8")
+        return pickle.loads(data)
+
+
+def payloads(size: int) -> Dict[str, Any]:
+    """Values of about `size` bytes of each kind"""
+    rng = random.Random(size)
+    values = {
+        "bytes": rng.randbytes(size),
+        "str": "x" * size,
+        "records": [
+            {"id": index, "name": f"item-{index}", "score": index / 2}
+            for index in range(max(size // 48, 1))
+        ],
+        "binary-record": {"id": 1, "name": "blob", "data": bytearray(size)},
+    }
+    if numpy is not None:
+        # pickled out-of-band by `Serializer` from 64KB
+        data = rng.randbytes(size - size % 8)
+        values["array"] = numpy.frombuffer(data, dtype=numpy.float64)
+    return values
+
+
+def time_per_call(function: Callable[[], Any], min_seconds: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while calls < 3 or elapsed < min_seconds:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / calls
+
+
+def serializers(sizes: Iterable[int], min_seconds: float = 0.05) -> Dict[str, Any]:
+    """Size and time of the serialization of each kind of payload, by serializer
+
+    Args:
+        sizes (Iterable[int]): approximate sizes of the payloads in bytes
+        min_seconds (float, optional): minimum time measured per operation. Defaults to 0.05.
+    """
+    candidates = {"client-pickle": ClientPickle(), "serializer": Serializer()}
+    if msgpack is not None:
+        candidates["serializer-msgpack"] = Serializer(use_msgpack=True)
+    results = []
+    for size in sizes:
+        for kind, value in payloads(size).items():
+            for name, serializer in candidates.items():
+                data = serializer.dumps(value)
+                stored = data[1] if isinstance(data, tuple) else data
+                results.append(
+                    {
+                        "serializer": name,
+                        "payload": kind,
+                        "size": size,
+                        "bytes": len(stored),
+                        "dumps": time_per_call(
+                            lambda: serializer.dumps(value), min_seconds
+                        ),
+                        "loads": time_per_call(
+                            lambda: serializer.loads(data), min_seconds
+                        ),
+                    }
+                )
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Changes of throughput and p99 latency of the results found in the baseline"""
+    previous = {
+        (result["storage"], result["workload"]): result
+        for result in baseline["results"]
+    }
+    lines = []
+    for result in report["results"]:
+        old = previous.get((result["storage"], result["workload"]))
+        if old is None or not old["throughput"]:
+            continue
+        line = f"{result['storage']} / {result['workload']}: throughput "
+        line += f"{result['throughput'] / old['throughput'] - 1:+.1%}"
+        for operation, latency in result["latency"].items():
+            old_p99 = old["latency"].get(operation, {}).get("p99")
+            if latency.get("p99") is not None and old_p99:
+                line += f", {operation} p99 {latency['p99'] / old_p99 - 1:+.1%}"
+        lines.append(line)
+    return lines
+
+
+def write(report: Dict[str, Any], path: str | None) -> Dict[str, Any]:
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+
+def main(argv: List[str] | None = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the storages against local stand-ins of their backends"
+    )
+    parser.add_argument("--storages", default=",".join(STORAGES))
+    parser.add_argument(
+        "--workloads", default=None, help="names of preset workloads, all by default"
+    )
+    parser.add_argument("--keys", type=int, default=200)
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--distribution",
+        choices=sorted(DISTRIBUTIONS),
+        help="run a custom workload with this key distribution instead of the presets",
+    )
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument(
+        "--sizes",
+        default="fixed:4096",
+        help="fixed:SIZE, uniform:LOW:HIGH or lognormal:MEDIAN[:SIGMA[:MAX]]",
+    )
+    parser.add_argument("--s3-latency", type=float, default=0.002)
+    parser.add_argument("--mem-latency", type=float, default=0.0)
+    parser.add_argument(
+        "--serializers",
+        action="store_true",
+        help="compare the serializers of the memcached values instead",
+    )
+    parser.add_argument(
+        "--payload-sizes",
+        default="1024,65536,1048576",
+        help="sizes of the payloads of the serializers, in bytes",
+    )
+    parser.add_argument("--output", help="JSON file of the results, stdout by default")
+    parser.add_argument("--baseline", help="JSON results to compare the results with")
+    args = parser.parse_args(argv)
+
+    if args.serializers:
+        sizes = [int(size) for size in args.payload_sizes.split(",")]
+        return write(serializers(sizes), args.output)
+
+    if args.distribution is not None:
+        workloads = [
+            Workload(
+                "custom",
+                DISTRIBUTIONS[args.distribution](args.keys),
+                parse_sizes(args.sizes),
+                args.operations,
+                args.read_ratio,
+                args.seed,
+            )
+        ]
+    else:
+        workloads = presets(args.keys, args.operations, args.seed)
+        if args.workloads is not None:
+            names = args.workloads.split(",")
+            workloads = [workload for workload in workloads if workload.name in names]
+    storages = args.storages.split(",")
+    for name in storages:
+        if name not in STORAGES:
+            parser.error(f"unknown storage {name}, expected one of {STORAGES}")
+
+    report = write(
+        benchmark(storages, workloads, args.s3_latency, args.mem_latency), args.output
+    )
+    if args.baseline:
+        with open(args.baseline) as file:
+            for line in compare(report, json.load(file)):
+                print(line, file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    main()
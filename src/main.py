@@ -1,5 +1,6 @@
 import logging
 import os
+from itertools import islice
 
 from memcache import Client
 from utils.image import show_image
@@ -58,9 +59,9 @@ def memcached(filename: str | None = None, img: bool = False):
 
 def aws_program(filename: str | None = None, img: bool = False):
     log.info("AWS program")
-    log.info("list: %s", AWS.list())
+    log.info("first keys: %s", list(islice(AWS.list(page_size=10), 10)))
     if not filename:
-        filename = AWS.list()[0]
+        filename = next(AWS.list(page_size=1))
     log.info("filename: %s", filename)
     T = AWS.read(filename)
     log.info("read file: %s", T[:10])
@@ -4,6 +4,7 @@ import time
 
 # from pymemcache.client.base import Client
 from memcache import Client
+from utils.memoize import memcached_memoize
 
 client = Client(["localhost"], debug=0)  # for memcache
 # client = Client("localhost")  # for pymemcache
@@ -17,13 +18,8 @@ def f(x):
     return x * x
 
 
-def fc(x):
-    cached_value = client.get(f"{x}")
-    if cached_value is None:
-        value = f(x)
-        client.set(f"{x}", value)
-        return value
-    return cached_value
+# keyed by the function and its arguments, computed once across threads and processes
+fc = memcached_memoize(client, ttl=3600, namespace="tp_memcached.f")(f)
 
 
 if __name__ == "__main__":
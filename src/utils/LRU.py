@@ -1,108 +1,466 @@
-from typing import Dict, Optional
+import threading
+import time
+from abc import abstractmethod
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from utils.timer_wheel import TimerWheel
 
 
 class Node:
     """Node class for doubly linked list
 
+    The node stores its own key so the cache only needs a single key → node index.
+
     Args:
-        value (str): value of the node
-        prev (Optional["Node"], optional): previous node. Defaults to None.
-        next (Optional["Node"], optional): next node. Defaults to None.
+        key (str): key of the node
+        value (Any): value of the node
+        size (int, optional): size of the entry, used for the byte budget. Defaults to 1.
+        expires (float, optional): expiry time of the entry, 0 if it never expires. Defaults to 0.
     """
 
-    def __init__(
-        self, value: str, prev: Optional["Node"] = None, next: Optional["Node"] = None
-    ) -> None:
+    __slots__ = ("key", "value", "size", "expires", "prev", "next")
+
+    def __init__(self, key: str, value: Any, size: int = 1, expires: float = 0) -> None:
+        self.key = key
         self.value = value
-        self.prev = prev
-        self.next = next
+        self.size = size
+        self.expires = expires
+        self.prev: Optional["Node"] = None
+        self.next: Optional["Node"] = None
+
+
+class EvictionPolicy:
+    """Eviction policy interface for the caches of the storages
+
+    A policy is a bounded key-value cache with the following methods:
+    - create: to insert or update an item, returning the value of the last evicted item
+    - read: to read an item, updating its recency/frequency
+    - peek: to read an item without updating anything
+    - delete: to remove an item
+    - expire: to reclaim the expired items, for the policies supporting a `ttl` in `create`
+    - load: to insert items in bulk, e.g. to restore a cache
+
+    `on_evict(key, value)` is called for each item evicted or expired by the policy.
+    The policies without `supports_ttl` raise ValueError on a `ttl` in `create`.
+    """
+
+    on_evict: Callable[[str, Any], None] | None = None
+    supports_ttl = False
 
+    @abstractmethod
+    def create(
+        self, key: str, value: Any, size: int | None = None, ttl: float | None = None
+    ) -> Any | None:
+        pass
 
-class LRU:
+    @abstractmethod
+    def read(self, key: str) -> Any | None:
+        pass
+
+    @abstractmethod
+    def peek(self, key: str) -> Any | None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool:
+        pass
+
+    def expire(self) -> int:
+        """Reclaim the expired items and return their number"""
+        return 0
+
+    def load(self, items: Iterable[Tuple[str, Any, int, float | None]]) -> None:
+        """Insert `(key, value, size, ttl)` items from the least to the most recently used"""
+        for key, value, size, ttl in items:
+            self.create(key, value, size, ttl)
+
+
+class LRU(EvictionPolicy):
     """Least Recently Used Cache
 
     This class represents a Least Recently Used (LRU) cache implementation.
     It provides methods for creating, reading, and deleting key-value pairs.
-    The cache has a specified capacity, and when the capacity is exceeded,
-    the least recently used item is evicted from the cache.
+
+    The cache is bounded by a number of items (`capacity`) and/or by a total size
+    (`max_bytes`). The size of an entry is given by `sizeof(value)` or by the `size`
+    argument of `create`. When a bound is exceeded, the least recently used items are
+    evicted from the cache and `on_evict(key, value)` is called for each of them.
+
+    An item created with a `ttl` (in seconds) expires: it is reclaimed lazily when it is
+    read, and in bulk by a `TimerWheel` advanced on each `create` or `expire` call.
+
+    Args:
+        capacity (int | None, optional): maximum number of items. Defaults to 10.
+        max_bytes (int | None, optional): maximum total size of the items. Defaults to None.
+        sizeof (Callable[[Any], int] | None, optional): size of a value. Defaults to `len` when `max_bytes` is set.
+        on_evict (Callable[[str, Any], None] | None, optional): called for each evicted or expired item. Defaults to None.
+        clock (Callable[[], float], optional): current time in seconds. Defaults to `time.monotonic`.
     """
 
-    def __init__(self, capacity: int = 10) -> None:
-        self.__head: Node | None = None
-        self.__tail: Node | None = None
+    supports_ttl = True
+
+    def __init__(
+        self,
+        capacity: int | None = 10,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] | None = None,
+        on_evict: Callable[[str, Any], None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        assert capacity is None or capacity > 0, "capacity must be greater than 0"
+        assert max_bytes is None or max_bytes > 0, "max_bytes must be greater than 0"
         self.__capacity = capacity
+        self.__max_bytes = max_bytes
+        self.__sizeof = sizeof if sizeof is not None else (len if max_bytes else None)
+        self.on_evict = on_evict
+        self.__clock = clock
+        self.__wheel: TimerWheel | None = None
         self.__length = 0
+        self.__bytes = 0
         self.__lookup: Dict[str, Node] = {}
-        self.__reverseLookup: Dict[Node, str] = {}
+        # sentinels: head.next is the most recently used, tail.prev the least recently used
+        self.__head = Node("", None, 0)
+        self.__tail = Node("", None, 0)
+        self.__head.next = self.__tail
+        self.__tail.prev = self.__head
 
-    def create(self, key: str, value: str) -> str | None:
-        # does it exist ?
+    def __len__(self) -> int:
+        return self.__length
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__lookup
+
+    @property
+    def size(self) -> int:
+        """Total size of the items currently in the cache"""
+        return self.__bytes
+
+    def create(
+        self, key: str, value: Any, size: int | None = None, ttl: float | None = None
+    ) -> Any | None:
+        """Insert or update an item and return the value of the last evicted item, if any"""
+        if size is None:
+            size = self.__sizeof(value) if self.__sizeof is not None else 1
+        if self.__wheel is not None:
+            self.expire()
+        expires = 0
+        if ttl is not None:
+            now = self.__clock()
+            expires = now + ttl
+            if self.__wheel is None:
+                self.__wheel = TimerWheel(now=now)
+            self.__wheel.schedule(key, expires)
+        elif self.__wheel is not None:
+            self.__wheel.cancel(key)
         node = self.__lookup.get(key)
         if node is None:
-            node = self.__createNode(value)
-            self.__length += 1
-            self.__prepend(node)
-            del_value = self.__trimCache()
-
+            node = Node(key, value, size, expires)
             self.__lookup[key] = node
-            self.__reverseLookup[node] = key
-            return del_value
+            self.__length += 1
         else:
             self.__detach(node)
-            self.__prepend(node)
+            self.__bytes -= node.size
             node.value = value
+            node.size = size
+            node.expires = expires
+        self.__bytes += size
+        self.__prepend(node)
+        return self.__trimCache()
 
     def read(self, key: str):
         node = self.__lookup.get(key)
         if node is None:
             return
+        if node.expires and node.expires <= self.__clock():
+            self.__remove(node)
+            return
 
         self.__detach(node)
         self.__prepend(node)
 
         return node.value
 
-    def delete(self, key: str):
+    def peek(self, key: str):
+        """Read an item without updating its recency"""
         node = self.__lookup.get(key)
+        if node is None:
+            return
+        if node.expires and node.expires <= self.__clock():
+            return
+        return node.value
+
+    def delete(self, key: str):
+        node = self.__lookup.pop(key, None)
         if node is None:
             return
 
         self.__detach(node)
         self.__length -= 1
-        del self.__lookup[key]
-        del self.__reverseLookup[node]
+        self.__bytes -= node.size
+        if node.expires and self.__wheel is not None:
+            self.__wheel.cancel(key)
 
-    def __detach(self, node: Node):
-        if node.prev:
-            node.prev.next = node.next
-        if node.next:
-            node.next.prev = node.prev
+    def expire(self) -> int:
+        """Reclaim the items whose deadline has passed, using the timing wheel"""
+        if self.__wheel is None:
+            return 0
+        now = self.__clock()
+        count = 0
+        for key in self.__wheel.advance(now):
+            node = self.__lookup.get(key)
+            # the wheel ticks are rounded up, the deadline is checked again
+            if node is not None and node.expires and node.expires <= now:
+                self.__remove(node)
+                count += 1
+        return count
+
+    def load(self, items: Iterable[Tuple[str, Any, int, float | None]]) -> None:
+        """Insert items in bulk, from the least to the most recently used
+
+        The new items without ttl are linked directly, and the cache is trimmed once at the
+        end, which makes restoring a large cache several times faster than `create`.
+        """
+        lookup = self.__lookup
+        head = self.__head
+        count = 0
+        total = 0
+        for key, value, size, ttl in items:
+            if ttl is not None or key in lookup:
+                self.create(key, value, size, ttl)
+                continue
+            node = Node(key, value, size)
+            lookup[key] = node
+            first = head.next
+            node.prev = head
+            node.next = first
+            first.prev = node
+            head.next = node
+            count += 1
+            total += size
+        self.__length += count
+        self.__bytes += total
+        self.__trimCache()
 
-        if self.__head == node:
-            self.__head = self.__head.next
-        if self.__tail == node:
-            self.__tail = self.__tail.prev
+    def keys(self) -> Iterator[str]:
+        """Iterate over the keys from the most to the least recently used"""
+        node = self.__head.next
+        while node is not self.__tail:
+            yield node.key
+            node = node.next
 
+    def __detach(self, node: Node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
         node.next = None
         node.prev = None
 
     def __prepend(self, node: Node):
-        if not self.__head:
-            self.__head = self.__tail = node
-            return
-        node.next = self.__head
-        self.__head.prev = node
-        self.__head = node
+        first = self.__head.next
+        node.prev = self.__head
+        node.next = first
+        first.prev = node
+        self.__head.next = node
 
-    def __trimCache(self) -> str | None:
-        if self.__length <= self.__capacity:
-            return
-        tail = self.__tail
-        self.__detach(tail)
-        del self.__lookup[self.__reverseLookup[tail]]
-        del self.__reverseLookup[tail]
+    def __overflow(self) -> bool:
+        if self.__capacity is not None and self.__length > self.__capacity:
+            return True
+        return self.__max_bytes is not None and self.__bytes > self.__max_bytes
+
+    def __remove(self, node: Node) -> None:
+        self.__detach(node)
+        del self.__lookup[node.key]
         self.__length -= 1
-        return tail.value
+        self.__bytes -= node.size
+        if node.expires and self.__wheel is not None:
+            self.__wheel.cancel(node.key)
+        if self.on_evict is not None:
+            self.on_evict(node.key, node.value)
+
+    def __trimCache(self) -> Any | None:
+        evicted = None
+        while self.__length and self.__overflow():
+            tail = self.__tail.prev
+            self.__remove(tail)
+            evicted = tail.value
+        return evicted
+
+    def _check_invariants(self) -> None:
+        """Check the consistency of the linked list with the index (used by the tests)"""
+        forward = []
+        node = self.__head.next
+        while node is not self.__tail:
+            assert node.next.prev is node, "broken backward link"
+            forward.append(node)
+            node = node.next
+        assert len(forward) == self.__length == len(self.__lookup), "length mismatch"
+        assert all(self.__lookup[n.key] is n for n in forward), "index mismatch"
+        assert sum(n.size for n in forward) == self.__bytes, "size mismatch"
+
+
+class Shard:
+    """Shard of a `ShardedLRU`: an LRU cache, its lock and its buffer of pending hits"""
+
+    __slots__ = ("lru", "lock", "hits")
+
+    def __init__(self, lru: LRU) -> None:
+        self.lru = lru
+        self.lock = threading.Lock()
+        self.hits: Deque[str] = deque()
+
+
+class ShardedLRU(EvictionPolicy):
+    """Thread-safe LRU cache split into independently locked shards
+
+    Keys are spread over `shards` LRU caches by hash, each one with its own slice of the
+    capacity and of the byte budget. Writes take the lock of their shard only.
+
+    Reads do not take the lock: the hit is recorded in a buffer of the shard and the
+    recency updates are applied in batch, by the next writer or by the reader that fills
+    the buffer if the lock is free. The eviction order is therefore approximately LRU.
+
+    Expired items are reclaimed lazily by `read` and in bulk by `expire`, which can be
+    called from an `ExpiryReaper` thread.
+
+    Args:
+        capacity (int | None, optional): maximum number of items. Defaults to 10.
+        max_bytes (int | None, optional): maximum total size of the items. Defaults to None.
+        shards (int, optional): number of shards. Defaults to 8.
+        sizeof (Callable[[Any], int] | None, optional): size of a value. Defaults to None.
+        on_evict (Callable[[str, Any], None] | None, optional): called for each evicted item. Defaults to None.
+        buffer_size (int, optional): number of pending hits that triggers a batch update. Defaults to 64.
+    """
+
+    supports_ttl = True
+
+    def __init__(
+        self,
+        capacity: int | None = 10,
+        max_bytes: int | None = None,
+        shards: int = 8,
+        sizeof: Callable[[Any], int] | None = None,
+        on_evict: Callable[[str, Any], None] | None = None,
+        buffer_size: int = 64,
+    ) -> None:
+        assert shards > 0, "shards must be greater than 0"
+        self.on_evict = on_evict
+        self.__buffer_size = buffer_size
+        shard_capacity = -(-capacity // shards) if capacity is not None else None
+        shard_max_bytes = -(-max_bytes // shards) if max_bytes is not None else None
+        self.__shards: List[Shard] = [
+            Shard(LRU(shard_capacity, shard_max_bytes, sizeof, self.__evict))
+            for _ in range(shards)
+        ]
+
+    def __len__(self) -> int:
+        return sum(len(shard.lru) for shard in self.__shards)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__shard(key).lru
+
+    @property
+    def size(self) -> int:
+        """Total size of the items currently in the cache"""
+        return sum(shard.lru.size for shard in self.__shards)
+
+    def create(
+        self, key: str, value: Any, size: int | None = None, ttl: float | None = None
+    ) -> Any | None:
+        shard = self.__shard(key)
+        with shard.lock:
+            self.__drain(shard)
+            return shard.lru.create(key, value, size, ttl)
+
+    def read(self, key: str):
+        shard = self.__shard(key)
+        value = shard.lru.peek(key)
+        if value is None:
+            if key in shard.lru:
+                # expired: reclaim it under the lock
+                with shard.lock:
+                    return shard.lru.read(key)
+            return
+        shard.hits.append(key)
+        if len(shard.hits) >= self.__buffer_size and shard.lock.acquire(blocking=False):
+            try:
+                self.__drain(shard)
+            finally:
+                shard.lock.release()
+        return value
+
+    def peek(self, key: str):
+        return self.__shard(key).lru.peek(key)
+
+    def delete(self, key: str):
+        shard = self.__shard(key)
+        with shard.lock:
+            self.__drain(shard)
+            shard.lru.delete(key)
+
+    def expire(self) -> int:
+        count = 0
+        for shard in self.__shards:
+            with shard.lock:
+                count += shard.lru.expire()
+        return count
+
+    def load(self, items: Iterable[Tuple[str, Any, int, float | None]]) -> None:
+        shards: Dict[int, List] = {}
+        for item in items:
+            shards.setdefault(hash(item[0]) % len(self.__shards), []).append(item)
+        for index, shard_items in shards.items():
+            shard = self.__shards[index]
+            with shard.lock:
+                self.__drain(shard)
+                shard.lru.load(shard_items)
+
+    def keys(self) -> Iterator[str]:
+        """Iterate over the keys, shard by shard, from the most to the least recently used"""
+        for shard in self.__shards:
+            with shard.lock:
+                keys = list(shard.lru.keys())
+            yield from keys
+
+    def __shard(self, key: str) -> Shard:
+        return self.__shards[hash(key) % len(self.__shards)]
+
+    def __drain(self, shard: Shard) -> None:
+        hits = shard.hits
+        while hits:
+            try:
+                key = hits.popleft()
+            except IndexError:
+                return
+            shard.lru.read(key)
+
+    def __evict(self, key: str, value: Any) -> None:
+        if self.on_evict is not None:
+            self.on_evict(key, value)
 
-    def __createNode(self, value: bytes):
-        return Node(value, None, None)
+    def _check_invariants(self) -> None:
+        """Check the consistency of every shard (used by the tests)"""
+        for shard in self.__shards:
+            with shard.lock:
+                shard.lru._check_invariants()
@@ -1,70 +1,315 @@
+import gc
 import logging
 import os
-from utils.LRU import LRU
-from utils.base_storage import Storage
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from utils.LRU import LRU, EvictionPolicy
+from utils.base_storage import STREAM_CHUNK_SIZE, FileSystem, Mem, Storage
+from utils.chunking import CHUNK_SIZE
+from utils.codec import Codec
+from utils.journal import JOURNAL, LRUJournal
 from memcache import Client
 
 
+def limit_maxbytes(client: Client) -> int | None:
+    """Smallest `limit_maxbytes` reported by the memcached servers of the client
+
+    It can be used as the `max_bytes` budget of a `Mem_LRU`.
+    """
+    limits = []
+    for _, stats in client.get_stats():
+        value = stats.get("limit_maxbytes", stats.get(b"limit_maxbytes"))
+        if value is not None:
+            limits.append(int(value))
+    return min(limits) if limits else None
+
+
+def check_ttl(lru: EvictionPolicy, ttl: float | None) -> float | None:
+    """Return the ttl, raising ValueError if the policy does not support ttls"""
+    if ttl is not None and not lru.supports_ttl:
+        raise ValueError(f"{lru.__class__.__name__} does not support ttl")
+    return ttl
+
+
 class Mem_LRU(Storage):
-    def __init__(self, client: Client, capacity: int = 10) -> None:
+    """Memcached storage managed by an LRU cache
+
+    The LRU is bounded by a number of keys (`capacity`) and/or by the total size of the
+    values in bytes (`max_bytes`), e.g. memcached's `limit_maxbytes`.
+
+    An existing cache can be given with `lru`, e.g. a `ShardedLRU` to share the storage
+    between threads or another `EvictionPolicy` (see `utils.policies`).
+
+    Keys created with a `ttl`, or with the default `ttl` of the storage, expire in
+    memcached and in the LRU cache. `expire` reclaims them in bulk and can be called
+    periodically by an `ExpiryReaper`. The ttls need a policy supporting them (e.g. `LRU`
+    or `ShardedLRU`, see `EvictionPolicy.supports_ttl`): a ttl with another policy raises
+    ValueError, in `__init__` for the default one, before anything is stored otherwise.
+
+    The values are stored through a `Mem` storage, which splits the values larger than
+    `chunk_size` into chunks and compresses them with the `codec`, if given.
+
+    If `demote(key, value)` is set, it is called with the value of each key evicted by the
+    LRU cache before its removal from memcached, e.g. to move it to a lower tier.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        capacity: int | None = 10,
+        max_bytes: int | None = None,
+        lru: EvictionPolicy | None = None,
+        chunk_size: int | None = CHUNK_SIZE,
+        codec: Codec | None = None,
+        ttl: float | None = None,
+    ) -> None:
         self.client = client
-        self.lru = LRU(capacity)
+        self.mem = Mem(client, chunk_size, codec)
+        self.lru = lru if lru is not None else LRU(capacity, max_bytes)
+        self.lru.on_evict = self.__evict
+        self.ttl = check_ttl(self.lru, ttl)
+        self.demote: Callable[[str, bytes], None] | None = None
         self.log = logging.getLogger("Mem LRU")
         self.log.debug("init - client %s", client.__class__.__name__)
 
-    def create(self, key: str, value: bytes):
+    def create(self, key: str, value: bytes, ttl: float | None = None):
+        """Store the value, expiring after `ttl` seconds if given"""
         self.log.debug("create - key: %s", key)
-        del_key = self.lru.create(key, key)
-        self.client.set(key, value)
-        if del_key:
-            self.client.delete(del_key)
+        ttl = check_ttl(self.lru, ttl if ttl is not None else self.ttl)
+        self.mem.create(key, value, ttl)
+        self.lru.create(key, key, len(value), ttl)
 
     def read(self, key: str) -> bytes | None:
         self.log.debug("read - key: %s", key)
         key = self.lru.read(key)
         if key is None:
-            self.log.warn("read - key not found")
+            self.log.debug("read - key not found")
             # raise ValueError(f"Key {key} not found")
             return None
-        value = self.client.get(key)
-        self.log.debug("read - value: %s", key[:10])
-        return value
+        return self.mem.read(key)
 
     def delete(self, key: str):
         self.log.debug("delete - key: %s", key)
         self.lru.delete(key)
-        self.client.delete(key)
+        self.mem.delete(key)
         self.log.debug("delete - done")
 
+    def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        failed = set(self.mem.create_multi(mapping, self.ttl))
+        for key, value in mapping.items():
+            if key not in failed:
+                self.lru.create(key, key, len(value), self.ttl)
+
+    def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = [key for key in keys if self.lru.read(key) is not None]
+        self.log.debug("read_multi - keys: %s", keys)
+        if not keys:
+            return {}
+        return self.mem.read_multi(keys)
+
+    def delete_multi(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self.log.debug("delete_multi - keys: %s", keys)
+        for key in keys:
+            self.lru.delete(key)
+        self.mem.delete_multi(keys)
+
+    def expire(self) -> int:
+        """Reclaim the expired keys of the LRU cache"""
+        return self.lru.expire()
+
+    def __evict(self, key: str, _: str):
+        self.log.debug("evict - key: %s", key)
+        if self.demote is not None:
+            value = self.mem.read(key)
+            # None if memcached evicted the value first
+            if value is not None:
+                self.demote(key, value)
+        self.mem.delete(key)
+
 
 class FileSystem_LRU(Storage):
-    def __init__(self, capacity: int = 10) -> None:
+    """FileSystem storage managed by an LRU cache
+
+    The LRU is bounded by a number of files (`capacity`) and/or by the total size of the
+    files in bytes (`max_bytes`), e.g. the disk quota of the cache.
+
+    An existing cache can be given with `lru`, e.g. a `ShardedLRU` to share the storage
+    between threads or another `EvictionPolicy` (see `utils.policies`).
+
+    Files created with a `ttl`, or with the default `ttl` of the storage, are removed
+    when they are read after their expiry, or in bulk by `expire`, which can be called
+    periodically by an `ExpiryReaper`. As in `Mem_LRU`, a ttl with a policy not supporting
+    them raises ValueError before anything is written.
+
+    The files are written and read by a `FileSystem` with the given `mmap_threshold`,
+    `root` and `fsync_every`: with a `root`, the keys are names of files managed in the
+    root instead of paths.
+
+    A `persistent` cache (with a `root`) journals its entries in an `LRUJournal` in the
+    root, and is rebuilt from it on startup, with the recency order, the sizes and the
+    deadlines of the files. Without a valid journal, it is rebuilt by scanning the root,
+    the files being ordered by modification time. A file removed behind the cache's back
+    is dropped when it is read.
+    """
+
+    def __init__(
+        self,
+        capacity: int | None = 10,
+        max_bytes: int | None = None,
+        lru: EvictionPolicy | None = None,
+        mmap_threshold: int | None = None,
+        root: str | None = None,
+        fsync_every: int = 0,
+        persistent: bool = False,
+        ttl: float | None = None,
+    ) -> None:
+        assert root is not None or not persistent, "a persistent cache needs a root"
         self.log = logging.getLogger("FileSystem LRU")
-        self.lru = LRU(capacity)
+        self.fs = FileSystem(mmap_threshold, root, fsync_every)
+        self.lru = lru if lru is not None else LRU(capacity, max_bytes)
+        self.lru.on_evict = self.__evict
+        self.ttl = check_ttl(self.lru, ttl)
+        self.journal: LRUJournal | None = None
+        if persistent:
+            self.__restore(LRUJournal(os.path.join(root, JOURNAL), self.__order))
 
     def list(self, directory: str):
         self.log.debug("list - directory: %s", directory)
         return os.listdir(directory)
 
-    def create(self, filename: str, data: bytes):
+    def create(self, filename: str, data: bytes, ttl: float | None = None):
+        """Write the file, expiring after `ttl` seconds if given"""
         self.log.debug("create - filename: %s", filename)
-        del_filename = self.lru.create(filename, filename)
-        with open(filename, "wb") as file:
-            file.write(data)
-        if del_filename:
-            self.delete(del_filename)
+        ttl = check_ttl(self.lru, ttl if ttl is not None else self.ttl)
+        self.fs.create(filename, data)
+        self.__created(filename, len(data), ttl)
 
     def delete(self, filename: str):
         self.log.debug("delete - filename: %s", filename)
         self.lru.delete(filename)
-        os.remove(filename)
+        if self.journal is not None:
+            self.journal.deleted(filename)
+        self.fs.delete(filename)
 
     def read(self, filename: str):
         self.log.debug("read - filename: %s", filename)
-        lru_filename = self.lru.read(filename)
+        lru_filename = self.__hit(filename)
         if lru_filename is None:
-            self.log.warn("read - filename not found")
+            self.log.debug("read - filename not found")
             # raise ValueError(f"Filename {filename} not found")
             return None
-        with open(lru_filename, "rb") as file:
-            return file.read()
+        try:
+            return self.fs.read(lru_filename)
+        except FileNotFoundError:
+            if self.journal is None:
+                raise
+            self.log.warning("read - %s removed from the disk", filename)
+            self.lru.delete(filename)
+            self.journal.deleted(filename)
+            return None
+
+    def read_multi(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        filenames = [filename for filename in filenames if self.__hit(filename)]
+        self.log.debug("read_multi - filenames: %s", filenames)
+        return self.fs.read_multi(filenames)
+
+    def read_stream(self, filename: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator:
+        if self.__hit(filename) is None:
+            raise FileNotFoundError(filename)
+        return self.fs.read_stream(filename, chunk_size)
+
+    def write_stream(self, filename: str, chunks: Iterable, ttl: float | None = None):
+        ttl = check_ttl(self.lru, ttl if ttl is not None else self.ttl)
+        size = self.fs.write_stream(filename, chunks)
+        self.__created(filename, size, ttl)
+
+    def close(self) -> None:
+        """Flush and close the journal of a persistent cache"""
+        if self.journal is not None:
+            self.journal.close()
+
+    def expire(self) -> int:
+        """Reclaim the expired files of the LRU cache"""
+        return self.lru.expire()
+
+    def __created(self, filename: str, size: int, ttl: float | None) -> None:
+        if self.journal is not None:
+            self.journal.created(filename, size, ttl)
+        self.lru.create(filename, filename, size, ttl)
+        if self.journal is not None:
+            self.journal.compact_if_due()
+
+    def __hit(self, filename: str) -> str | None:
+        lru_filename = self.lru.read(filename)
+        if lru_filename is not None and self.journal is not None:
+            self.journal.touched(filename)
+        return lru_filename
+
+    def __evict(self, filename: str, _: str):
+        self.log.debug("evict - filename: %s", filename)
+        if self.journal is not None:
+            self.journal.deleted(filename)
+        try:
+            self.fs.delete(filename)
+        except FileNotFoundError:
+            self.log.warning("evict - %s already removed", filename)
+
+    def __order(self) -> List[str]:
+        """Keys from the least to the most recently used"""
+        keys = list(self.lru.keys())
+        keys.reverse()
+        return keys
+
+    def __restore(self, journal: LRUJournal) -> None:
+        start = time.perf_counter()
+        entries = journal.load()
+        loaded = entries is not None
+        if entries is None:
+            entries = self.__scan()
+        now = time.time()
+        expired = [
+            filename
+            for filename, (_, deadline) in entries.items()
+            if deadline and deadline <= now
+        ]
+        for filename in expired:
+            del entries[filename]
+            self.__evict(filename, filename)
+        # the collector would scan the young nodes again and again while they are created
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            self.lru.load(
+                (filename, filename, size, deadline - now if deadline else None)
+                for filename, (size, deadline) in entries.items()
+            )
+        finally:
+            if collect:
+                gc.enable()
+        kept = entries
+        if expired or len(self.lru) < len(entries):
+            # the expired entries, and those evicted by a smaller cache, are gone
+            kept = {
+                filename: entry
+                for filename, entry in entries.items()
+                if filename in self.lru
+            }
+        self.journal = journal
+        journal.open(kept, compact=not loaded or kept is not entries)
+        self.log.info(
+            "restore - %s files in %.3fs", len(kept), time.perf_counter() - start
+        )
+
+    def __scan(self) -> Dict[str, Tuple[int, float]]:
+        """Entries of the files of the root, from the oldest to the newest"""
+        self.log.warning("restore - no journal, scanning %s", self.fs.layout.root)
+        files = []
+        for entry in self.fs.layout.files():
+            filename = self.fs.layout.key(entry.path)
+            if filename is not None:
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, filename, stat.st_size))
+        files.sort()
+        return {filename: (size, 0.0) for _, filename, size in files}
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import pickle
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple, TypeVar
+
+from memcache import (
+    SERVER_MAX_KEY_LENGTH,
+    SERVER_MAX_VALUE_LENGTH,
+    Client,
+    cmemcache_hash,
+    valid_key_chars_re,
+)
+
+T = TypeVar("T")
+Exchange = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[T]]
+
+DEFAULT_PORT = 11211
+
+
+def encode(value: Any) -> Tuple[int, bytes]:
+    """Flags and bytes of a value, as stored by python-memcached's `Client`"""
+    kind = type(value)
+    if kind is bytes:
+        return 0, value
+    if kind is str:
+        return Client._FLAG_TEXT, value.encode("utf-8")
+    if kind is int:
+        return Client._FLAG_INTEGER, b"%d" % value
+    return Client._FLAG_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(flags: int, data: bytes) -> Any:
+    """Value of the bytes stored with `flags` by python-memcached's `Client`"""
+    if flags & Client._FLAG_COMPRESSED:
+        data = zlib.decompress(data)
+        flags &= ~Client._FLAG_COMPRESSED
+    if flags == 0:
+        return data
+    if flags & Client._FLAG_TEXT:
+        return data.decode("utf-8")
+    if flags & (Client._FLAG_INTEGER | Client._FLAG_LONG):
+        return int(data)
+    if flags & Client._FLAG_PICKLE:
+        return pickle.loads(data)
+    raise ValueError(f"unknown flags {flags:#x}")
+
+
+class Server:
+    """Pool of the connections to a memcached server, at most `pool_size` at once
+
+    The connections belong to the event loop they were opened in: in another loop, the
+    pool starts over with new connections.
+
+    Args:
+        address (str): address of the server, as "host:port"
+        pool_size (int): maximum number of connections
+        dead_retry (float): seconds before retrying the server once marked dead
+        timeout (float): seconds before a request times out
+    """
+
+    def __init__(
+        self, address: str, pool_size: int, dead_retry: float, timeout: float
+    ) -> None:
+        host, _, port = address.rpartition(":")
+        self.address = address
+        self.host = host if port.isdigit() else address
+        self.port = int(port) if port.isdigit() else DEFAULT_PORT
+        self.pool_size = pool_size
+        self.dead_retry = dead_retry
+        self.timeout = timeout
+        self.dead_until = 0.0
+        self.log = logging.getLogger("AsyncClient")
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.__slots: asyncio.Semaphore | None = None
+
+    @property
+    def alive(self) -> bool:
+        return time.monotonic() >= self.dead_until
+
+    async def request(self, exchange: Exchange[T]) -> T:
+        """Run the exchange on an idle connection, or on a new one"""
+        loop = asyncio.get_running_loop()
+        if loop is not self.__loop:
+            self.__loop = loop
+            self.__idle = []
+            self.__slots = asyncio.Semaphore(self.pool_size)
+        async with self.__slots:
+            if self.__idle:
+                reader, writer = self.__idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            try:
+                result = await asyncio.wait_for(exchange(reader, writer), self.timeout)
+            except BaseException:
+                # a reply may be half read, the connection cannot be reused
+                writer.close()
+                raise
+            self.__idle.append((reader, writer))
+            return result
+
+    def mark_dead(self, error: BaseException) -> None:
+        self.log.warning(
+            "%s marked dead for %ss: %r", self.address, self.dead_retry, error
+        )
+        self.dead_until = time.monotonic() + self.dead_retry
+        self.close()
+
+    def close(self) -> None:
+        idle, self.__idle = self.__idle, []
+        for _, writer in idle:
+            writer.close()
+
+
+class AsyncClient:
+    """asyncio memcached client speaking the text protocol
+
+    The keys are mapped to the servers and the values are stored with the flags of
+    python-memcached's `Client` (bytes, str, int, pickled objects), so that both clients
+    can share the servers and read each other's values, e.g. to use `Mem` and `AsyncMem`
+    on the same cache.
+
+    Each server has a pool of at most `pool_size` connections, the other requests
+    waiting for one on the event loop. The multi-key operations send one pipelined
+    request per server, the servers being queried concurrently.
+
+    As with python-memcached, a request failing on a connection error, a protocol error
+    or after `socket_timeout` seconds marks its server dead for `dead_retry` seconds,
+    the keys of a dead server going to the next servers, and answers like a miss: None
+    for `get`, the key missing from `get_multi`, False for `set` and `delete`, the key
+    among the keys returned by `set_multi`. The keys are checked like python-memcached,
+    an invalid key raising ValueError.
+
+    Args:
+        servers (List[str]): addresses of the servers, as "host:port"
+        pool_size (int, optional): maximum number of connections per server. Defaults to 16.
+        dead_retry (float, optional): seconds before retrying a dead server. Defaults to 30.
+        socket_timeout (float, optional): seconds before a request times out. Defaults to 3.
+    """
+
+    def __init__(
+        self,
+        servers: List[str],
+        pool_size: int = 16,
+        dead_retry: float = 30.0,
+        socket_timeout: float = 3.0,
+    ) -> None:
+        self.servers = [
+            Server(address, pool_size, dead_retry, socket_timeout)
+            for address in servers
+        ]
+        self.log = logging.getLogger("AsyncClient")
+
+    async def get(self, key: str) -> Any | None:
+        return (await self.get_multi([key])).get(key)
+
+    async def get_multi(self, keys: Iterable[str]) -> Dict[str, Any]:
+        by_server, _ = self.__by_server(keys)
+        requests = [self.__get(server, names) for server, names in by_server.items()]
+        values: Dict[str, Any] = {}
+        for result in await asyncio.gather(*requests):
+            values.update(result)
+        return values
+
+    async def set(self, key: str, value: Any, time: int = 0) -> bool:
+        return not await self.set_multi({key: value}, time)
+
+    async def add(self, key: str, value: Any, time: int = 0) -> bool:
+        """Store the value if the key is not stored yet"""
+        return not await self.__store_multi(b"add", {key: value}, time)
+
+    async def set_multi(self, mapping: Dict[str, Any], time: int = 0) -> List[str]:
+        """Store the values, and return the keys that were not stored"""
+        return await self.__store_multi(b"set", mapping, time)
+
+    async def delete(self, key: str) -> bool:
+        return await self.delete_multi([key])
+
+    async def delete_multi(self, keys: Iterable[str]) -> bool:
+        """Delete the keys, return False if a server failed"""
+        by_server, unserved = self.__by_server(keys)
+        requests = [self.__delete(server, names) for server, names in by_server.items()]
+        return all(await asyncio.gather(*requests)) and not unserved
+
+    async def flush_all(self) -> None:
+        async def exchange(reader, writer) -> None:
+            writer.write(b"flush_all\r\n")
+            await writer.drain()
+            self.__expect(await reader.readline(), b"OK\r\n")
+
+        await asyncio.gather(
+            *(self.__request(server, exchange, None) for server in self.servers)
+        )
+
+    def disconnect_all(self) -> None:
+        for server in self.servers:
+            server.close()
+
+    def __server(self, name: bytes) -> Server | None:
+        """Server of a key, skipping the dead servers as python-memcached does"""
+        serverhash = cmemcache_hash(name)
+        for attempt in range(Client._SERVER_RETRIES):
+            server = self.servers[serverhash % len(self.servers)]
+            if server.alive:
+                return server
+            serverhash = cmemcache_hash(f"{serverhash}{attempt}".encode("ascii"))
+        return None
+
+    def __by_server(
+        self, keys: Iterable[str]
+    ) -> Tuple[Dict[Server, Dict[bytes, str]], List[str]]:
+        """Keys by server with their encoded names, and the keys without live server"""
+        by_server: Dict[Server, Dict[bytes, str]] = {}
+        unserved = []
+        for key in keys:
+            name = self.__name(key)
+            server = self.__server(name)
+            if server is not None:
+                by_server.setdefault(server, {})[name] = key
+            else:
+                unserved.append(key)
+        return by_server, unserved
+
+    @staticmethod
+    def __name(key: str) -> bytes:
+        name = key.encode("utf-8") if isinstance(key, str) else key
+        if len(name) > SERVER_MAX_KEY_LENGTH or not valid_key_chars_re.match(name):
+            raise ValueError(f"invalid memcached key {key!r}")
+        return name
+
+    @staticmethod
+    def __expect(line: bytes, *replies: bytes) -> bytes:
+        if line not in replies:
+            raise IOError(f"unexpected reply {line[:80]!r}")
+        return line
+
+    async def __request(self, server: Server, exchange: Exchange[T], default: T) -> T:
+        try:
+            return await server.request(exchange)
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            server.mark_dead(e)
+            return default
+
+    async def __get(self, server: Server, names: Dict[bytes, str]) -> Dict[str, Any]:
+        async def exchange(reader, writer) -> Dict[bytes, Tuple[int, bytes]]:
+            writer.write(b"get " + b" ".join(names) + b"\r\n")
+            await writer.drain()
+            items = {}
+            while True:
+                line = await reader.readline()
+                if line == b"END\r\n":
+                    return items
+                parts = line.split()
+                if len(parts) != 4 or parts[0] != b"VALUE":
+                    raise IOError(f"unexpected reply {line[:80]!r}")
+                data = await reader.readexactly(int(parts[3]))
+                self.__expect(await reader.readexactly(2), b"\r\n")
+                items[parts[1]] = (int(parts[2]), data)
+
+        items = await self.__request(server, exchange, {})
+        values = {}
+        for name, (flags, data) in items.items():
+            key = names.get(name)
+            if key is None:
+                continue
+            try:
+                values[key] = decode(flags, data)
+            except Exception as e:
+                self.log.error("get - %s: %s", key, e)
+        return values
+
+    async def __store_multi(
+        self, command: bytes, mapping: Dict[str, Any], time: int
+    ) -> List[str]:
+        by_server, failed = self.__by_server(mapping)
+        items: Dict[Server, List[Tuple[bytes, str, int, bytes]]] = {}
+        for server, names in by_server.items():
+            for name, key in names.items():
+                flags, data = encode(mapping[key])
+                # not stored, as with python-memcached
+                if len(data) > SERVER_MAX_VALUE_LENGTH:
+                    failed.append(key)
+                else:
+                    items.setdefault(server, []).append((name, key, flags, data))
+        requests = [
+            self.__store(server, command, server_items, time)
+            for server, server_items in items.items()
+        ]
+        for result in await asyncio.gather(*requests):
+            failed.extend(result)
+        return failed
+
+    async def __store(
+        self,
+        server: Server,
+        command: bytes,
+        items: List[Tuple[bytes, str, int, bytes]],
+        time: int,
+    ) -> List[str]:
+        async def exchange(reader, writer) -> List[str]:
+            for name, _, flags, data in items:
+                header = b"%s %s %d %d %d\r\n" % (command, name, flags, time, len(data))
+                writer.write(header)
+                writer.write(data)
+                writer.write(b"\r\n")
+            await writer.drain()
+            failed = []
+            for _, key, _, _ in items:
+                reply = await reader.readline()
+                if reply == b"STORED\r\n":
+                    continue
+                if not reply.startswith((b"NOT_STORED", b"SERVER_ERROR")):
+                    raise IOError(f"unexpected reply {reply[:80]!r}")
+                self.log.debug("set - %s not stored: %s", key, reply.strip())
+                failed.append(key)
+            return failed
+
+        return await self.__request(server, exchange, [item[1] for item in items])
+
+    async def __delete(self, server: Server, names: Dict[bytes, str]) -> bool:
+        async def exchange(reader, writer) -> bool:
+            writer.write(b"".join(b"delete %s\r\n" % name for name in names))
+            await writer.drain()
+            for _ in names:
+                self.__expect(await reader.readline(), b"DELETED\r\n", b"NOT_FOUND\r\n")
+            return True
+
+        return await self.__request(server, exchange, False)
@@ -0,0 +1,901 @@
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from typing import Dict, Iterable, List
+
+from botocore.exceptions import ClientError
+
+from utils.aio_memcached import AsyncClient
+from utils.base_storage import (
+    CHUNK_SIZE,
+    MB,
+    MIN_PART_SIZE,
+    S3_MAX_CONNECTIONS,
+    FileSystem,
+    Mem,
+    Storage,
+    expiry,
+    is_missing,
+    views,
+)
+from utils.chunking import join, manifest_key, parse_manifest, split
+from utils.codec import Codec
+from utils.complex_storage import Tiering
+from utils.LRU import ShardedLRU
+from utils.LRU_storage import FileSystem_LRU
+from utils.serializer import Serializer
+from utils.migration import AsyncMigrationWorker, PlacementTable, TierPlanner
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+
+class AsyncStorage(ABC):
+    """asyncio counterpart of the `Storage` interface
+
+    It has the same methods as `Storage`, as coroutines. The batched methods run the
+    single-key operations concurrently by default.
+    """
+
+    @abstractmethod
+    async def create(self, key: str, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    async def read(self, filename: str) -> bytes:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    async def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        await asyncio.gather(*(self.create(key, data) for key, data in mapping.items()))
+
+    async def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        results = await asyncio.gather(
+            *(self.read(key) for key in keys), return_exceptions=True
+        )
+        values = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, FileNotFoundError) or result is None:
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            values[key] = result
+        return values
+
+    async def delete_multi(self, keys: Iterable[str]) -> None:
+        await asyncio.gather(*(self.delete(key) for key in keys))
+
+
+class AsyncAdapter(AsyncStorage):
+    """Run the operations of a blocking storage in worker threads
+
+    It is a thread-offload shim, not asynchronous I/O: each operation holds a thread of
+    the default executor of the loop while it blocks. It is meant for the storages
+    without a non-blocking API, like the files, or the custom `Storage` subclasses.
+    `AsyncMem` and `AsyncAWSS3` do their I/O on the event loop instead.
+
+    At most `limit` operations of the storage are in flight at once, the others wait on
+    the event loop without holding a thread. The batched operations are forwarded to the
+    batched methods of the storage, to keep their round trips.
+
+    Args:
+        storage (Storage): blocking storage
+        limit (int, optional): maximum number of operations in flight. Defaults to 16.
+    """
+
+    def __init__(self, storage: Storage, limit: int = 16) -> None:
+        self.storage = storage
+        self.limit = limit
+        self.log = logging.getLogger(f"Async{storage.__class__.__name__}")
+        self.__semaphore = asyncio.Semaphore(limit)
+
+    async def run(self, method: str, *args, **kwargs):
+        async with self.__semaphore:
+            return await asyncio.to_thread(
+                getattr(self.storage, method), *args, **kwargs
+            )
+
+    async def create(self, key: str, data: bytes, *args, **kwargs) -> None:
+        await self.run("create", key, data, *args, **kwargs)
+
+    async def read(self, filename: str, *args, **kwargs) -> bytes:
+        return await self.run("read", filename, *args, **kwargs)
+
+    async def delete(self, key: str, *args, **kwargs) -> None:
+        await self.run("delete", key, *args, **kwargs)
+
+    async def create_multi(self, mapping: Dict[str, bytes], *args, **kwargs):
+        return await self.run("create_multi", mapping, *args, **kwargs)
+
+    async def read_multi(self, keys: Iterable[str], *args, **kwargs) -> Dict[str, bytes]:
+        return await self.run("read_multi", list(keys), *args, **kwargs)
+
+    async def delete_multi(self, keys: Iterable[str], *args, **kwargs) -> None:
+        await self.run("delete_multi", list(keys), *args, **kwargs)
+
+
+class AsyncFileSystem(AsyncAdapter):
+    """asyncio `FileSystem`, with at most `limit` file operations in flight
+
+    The regular files have no non-blocking I/O, so the operations run in worker threads
+    (see `AsyncAdapter`). The other arguments are those of `FileSystem`.
+
+    Args:
+        limit (int, optional): maximum number of file operations in flight. Defaults to 32.
+        mmap_threshold (int | None, optional): minimum size of the mapped files. Defaults to None.
+        root (str | None, optional): root directory of the managed files. Defaults to None.
+        fsync_every (int, optional): number of writes per fsync batch, 0 for none. Defaults to 0.
+        levels (int, optional): levels of subdirectories of the root. Defaults to 2.
+    """
+
+    def __init__(
+        self,
+        limit: int = 32,
+        mmap_threshold: int | None = None,
+        root: str | None = None,
+        fsync_every: int = 0,
+        levels: int = 2,
+    ) -> None:
+        super().__init__(FileSystem(mmap_threshold, root, fsync_every, levels), limit)
+
+
+class AsyncMem(AsyncStorage):
+    """asyncio `Mem`, on an `AsyncClient` speaking the memcached protocol on the loop
+
+    The values are stored as by `Mem`, with the same chunking of the values larger than
+    `chunk_size`, `codec` and `serializer`, so that both storages can share the memcached
+    servers. The requests in flight are bounded by the connections of the client (see
+    `AsyncClient.pool_size`).
+
+    Args:
+        client (AsyncClient): asyncio memcached client
+        chunk_size (int | None, optional): size of the chunks, None to disable the chunking. Defaults to `CHUNK_SIZE`.
+        codec (Codec | None, optional): compression of the values. Defaults to None.
+        serializer (Serializer | None, optional): serialization of the values. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        chunk_size: int | None = CHUNK_SIZE,
+        codec: Codec | None = None,
+        serializer: Serializer | None = None,
+    ) -> None:
+        self.client = client
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.serializer = serializer
+        self.log = logging.getLogger("AsyncMem")
+
+    _encode = Mem._encode
+    _decode = Mem._decode
+    _chunked = Mem._chunked
+
+    async def create(self, key: str, value: bytes, ttl: int | None = None) -> None:
+        """Store the value, expiring after `ttl` seconds if given"""
+        self.log.debug("create - key: %s", key)
+        time = expiry(ttl)
+        value = self._encode(key, value)
+        if self._chunked(value):
+            manifest, chunks = split(key, value, self.chunk_size)
+            self.log.debug("create - %s chunks", len(chunks))
+            await self.client.set_multi(chunks, time=time)
+            value = manifest
+        await self.client.set(key, value, time=time)
+
+    async def read(self, key: str) -> bytes | None:
+        self.log.debug("read - key: %s", key)
+        value = await self.client.get(key)
+        manifest = parse_manifest(value)
+        if manifest is not None:
+            self.log.debug("read - %s chunks", manifest.count)
+            chunks = await self.client.get_multi(manifest.chunk_keys(key))
+            value = join(key, manifest, chunks)
+        value = self._decode(key, value)
+        if value is None:
+            self.log.debug("read - key not found")
+        return value
+
+    async def delete(self, key: str) -> None:
+        self.log.debug("delete - key: %s", key)
+        await self.delete_multi([key])
+
+    async def create_multi(
+        self, mapping: Dict[str, bytes], ttl: int | None = None
+    ) -> List[str]:
+        """Store several values and return the keys that were not stored"""
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        time = expiry(ttl)
+        values = {}
+        chunks = {}
+        for key, value in mapping.items():
+            value = self._encode(key, value)
+            if self._chunked(value):
+                values[key], value_chunks = split(key, value, self.chunk_size)
+                chunks.update(value_chunks)
+            else:
+                values[key] = value
+        if chunks:
+            await self.client.set_multi(chunks, time=time)
+        failed = await self.client.set_multi(values, time=time)
+        if failed:
+            self.log.warning("create_multi - keys not stored: %s", failed)
+        return failed
+
+    async def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        self.log.debug("read_multi - keys: %s", keys)
+        values = await self.client.get_multi(keys)
+        manifests = {}
+        for key, value in values.items():
+            manifest = parse_manifest(value)
+            if manifest is not None:
+                manifests[key] = manifest
+        if manifests:
+            chunks = await self.client.get_multi(
+                [
+                    chunk_key
+                    for key, manifest in manifests.items()
+                    for chunk_key in manifest.chunk_keys(key)
+                ]
+            )
+            for key, manifest in manifests.items():
+                value = join(key, manifest, chunks)
+                if value is None:
+                    del values[key]
+                else:
+                    values[key] = value
+        if self.codec is not None or self.serializer is not None:
+            for key, value in values.items():
+                values[key] = self._decode(key, value)
+        self.log.debug("read_multi - %s/%s keys found", len(values), len(keys))
+        return values
+
+    async def delete_multi(self, keys: Iterable[str]) -> None:
+        """Delete the values, with the chunks found from their manifest copies"""
+        keys = list(keys)
+        self.log.debug("delete_multi - keys: %s", keys)
+        chunk_keys = []
+        if self.chunk_size is not None:
+            markers = {manifest_key(key): key for key in keys}
+            for marker, value in (await self.client.get_multi(list(markers))).items():
+                manifest = parse_manifest(value)
+                if manifest is not None:
+                    chunk_keys.extend(manifest.chunk_keys(markers[marker]))
+                    chunk_keys.append(marker)
+        await self.client.delete_multi(keys + chunk_keys)
+
+
+class AsyncAWSS3(AsyncStorage):
+    """asyncio `AWSS3`, on an aiobotocore S3 client sending the requests on the loop
+
+    The objects are stored and read as by `AWSS3`: the objects of `multipart_threshold`
+    bytes or more are uploaded in parts of `part_size` bytes, the objects larger than
+    `part_size` are read with byte-range requests into one `bytearray`, up to
+    `concurrency` part requests at once per operation, and `delete_multi` deletes up to
+    1000 objects per request. At most `limit` requests are in flight at once, the others
+    waiting on the event loop.
+
+    Without a `client`, an aiobotocore client is created on first use, with the
+    credentials of the `ak` and `sk` environment variables as `s3_client`, and closed by
+    `close`. It belongs to the event loop it was created in. aiobotocore is an optional
+    dependency: without it, a `client` must be given.
+
+    Args:
+        limit (int, optional): maximum number of requests in flight. Defaults to `S3_MAX_CONNECTIONS`.
+        bucket (str, optional): name of the bucket. Defaults to "ensta".
+        client (optional): asyncio S3 client, e.g. a `utils.fake_s3.AsyncFakeS3Client`. Defaults to an aiobotocore client.
+        multipart_threshold (int, optional): minimum size of a multipart upload. Defaults to 16MB.
+        part_size (int, optional): size of the parts and ranges, at least 5MB. Defaults to 8MB.
+        concurrency (int, optional): concurrent part requests per operation. Defaults to 8.
+    """
+
+    def __init__(
+        self,
+        limit: int = S3_MAX_CONNECTIONS,
+        bucket: str = "ensta",
+        client=None,
+        multipart_threshold: int = 16 * MB,
+        part_size: int = 8 * MB,
+        concurrency: int = 8,
+    ) -> None:
+        assert part_size >= MIN_PART_SIZE, "S3 parts must be at least 5MB"
+        if client is None and get_session is None:
+            raise ImportError("AsyncAWSS3 needs aiobotocore, or an S3 client")
+        self.client = client
+        self.bucket = bucket
+        self.limit = limit
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.log = logging.getLogger("AsyncAWSS3")
+        self.__slots = asyncio.Semaphore(limit)
+        self.__opening = asyncio.Lock()
+        self.__exit_stack: AsyncExitStack | None = None
+
+    async def create(self, filename: str, data: bytes) -> None:
+        self.log.debug("create - filename: %s", filename)
+        client = await self.__client()
+        if len(data) >= self.multipart_threshold:
+            await self.__create_multipart(client, filename, data)
+            return
+        async with self.__slots:
+            await client.put_object(
+                Bucket=self.bucket,
+                Key=filename,
+                Body=bytes(data) if isinstance(data, memoryview) else data,
+            )
+
+    async def read(self, filename: str) -> bytearray:
+        """Read the object, in ranges of `part_size` bytes fetched concurrently"""
+        self.log.debug("read - filename: %s", filename)
+        client = await self.__client()
+        try:
+            async with self.__slots:
+                obj = await client.get_object(
+                    Bucket=self.bucket, Key=filename, Range=f"bytes=0-{self.part_size - 1}"
+                )
+                first = await self.__body(obj)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "InvalidRange":
+                raise
+            # empty object
+            async with self.__slots:
+                obj = await client.get_object(Bucket=self.bucket, Key=filename)
+                return bytearray(await self.__body(obj))
+        size = int(obj["ContentRange"].rpartition("/")[2])
+        if size <= len(first):
+            self.log.debug("read - %s bytes", len(first))
+            return bytearray(first)
+        self.log.debug("read - %s bytes in ranges", size)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        view[: len(first)] = first
+        # bounds the part requests of this read
+        parts = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *(
+                self.__read_range(
+                    client,
+                    parts,
+                    filename,
+                    obj["ETag"],
+                    view[start : start + self.part_size],
+                    start,
+                )
+                for start in range(len(first), size, self.part_size)
+            )
+        )
+        view.release()
+        return buffer
+
+    async def delete(self, filename: str) -> None:
+        self.log.debug("delete - filename: %s", filename)
+        client = await self.__client()
+        async with self.__slots:
+            await client.delete_object(Bucket=self.bucket, Key=filename)
+
+    async def read_multi(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        filenames = list(filenames)
+        self.log.debug("read_multi - filenames: %s", filenames)
+
+        async def get(filename: str) -> bytes | None:
+            try:
+                return await self.read(filename)
+            except ClientError as e:
+                if is_missing(e):
+                    return None
+                raise
+
+        values = await asyncio.gather(*(get(filename) for filename in filenames))
+        return {
+            filename: value
+            for filename, value in zip(filenames, values)
+            if value is not None
+        }
+
+    async def delete_multi(self, filenames: Iterable[str]) -> None:
+        filenames = list(filenames)
+        self.log.debug("delete_multi - filenames: %s", filenames)
+        client = await self.__client()
+
+        async def delete(objects: List[Dict]) -> None:
+            async with self.__slots:
+                await client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+                )
+
+        await asyncio.gather(
+            *(
+                delete([{"Key": key} for key in filenames[start : start + 1000]])
+                for start in range(0, len(filenames), 1000)
+            )
+        )
+
+    async def close(self) -> None:
+        """Close the aiobotocore client created by the storage, if any"""
+        if self.__exit_stack is not None:
+            exit_stack, self.__exit_stack = self.__exit_stack, None
+            self.client = None
+            await exit_stack.aclose()
+
+    async def __client(self):
+        if self.client is not None:
+            return self.client
+        async with self.__opening:
+            if self.client is None:
+                if not (os.getenv("ak") and os.getenv("sk")):
+                    print("Please set up your AWS credentials in .env file")
+                    exit(1)
+                exit_stack = AsyncExitStack()
+                self.client = await exit_stack.enter_async_context(
+                    get_session().create_client(
+                        "s3",
+                        aws_access_key_id=os.getenv("ak"),
+                        aws_secret_access_key=os.getenv("sk"),
+                        config=AioConfig(max_pool_connections=self.limit),
+                    )
+                )
+                self.__exit_stack = exit_stack
+        return self.client
+
+    @staticmethod
+    async def __body(response: Dict) -> bytes:
+        async with response["Body"] as body:
+            return await body.read()
+
+    async def __create_multipart(self, client, filename: str, data: bytes) -> None:
+        async with self.__slots:
+            upload_id = (
+                await client.create_multipart_upload(Bucket=self.bucket, Key=filename)
+            )["UploadId"]
+        self.log.debug("create - multipart upload %s", upload_id)
+        try:
+            # bounds the parts in memory
+            parts = asyncio.Semaphore(self.concurrency)
+            uploaded = await asyncio.gather(
+                *(
+                    self.__upload_part(client, parts, filename, upload_id, number, part)
+                    for number, part in enumerate(views(data, self.part_size), 1)
+                )
+            )
+            async with self.__slots:
+                await client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=filename,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": uploaded},
+                )
+        except Exception:
+            self.log.error("create - multipart upload of %s failed", filename)
+            async with self.__slots:
+                await client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=filename, UploadId=upload_id
+                )
+            raise
+
+    async def __upload_part(
+        self,
+        client,
+        parts: asyncio.Semaphore,
+        filename: str,
+        upload_id: str,
+        number: int,
+        part: memoryview,
+    ) -> Dict:
+        async with parts, self.__slots:
+            response = await client.upload_part(
+                Bucket=self.bucket,
+                Key=filename,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=bytes(part),
+            )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    async def __read_range(
+        self,
+        client,
+        parts: asyncio.Semaphore,
+        filename: str,
+        etag: str,
+        target: memoryview,
+        start: int,
+    ) -> None:
+        """Read the bytes of the object from `start` into `target`"""
+        end = start + len(target) - 1
+        async with parts, self.__slots:
+            obj = await client.get_object(
+                Bucket=self.bucket, Key=filename, Range=f"bytes={start}-{end}", IfMatch=etag
+            )
+            async with obj["Body"] as body:
+                offset = 0
+                while offset < len(target):
+                    chunk = await body.read(min(len(target) - offset, MB))
+                    if not chunk:
+                        raise IOError(f"{filename}: range {start}-{end} ended early")
+                    target[offset : offset + len(chunk)] = chunk
+                    offset += len(chunk)
+
+
+class AsyncReplica(AsyncStorage):
+    """asyncio `Replica` storage, writing and deleting in both storages at once"""
+
+    def __init__(self, filesystem: AsyncStorage, aws: AsyncStorage) -> None:
+        self.fs = filesystem
+        self.aws = aws
+        self.log = logging.getLogger("AsyncReplica")
+
+    async def create(self, key: str, data: bytes):
+        self.log.debug("create - key: %s", key)
+        await asyncio.gather(self.fs.create(key, data), self.aws.create(key, data))
+
+    async def read(self, filename: str):
+        self.log.debug("read - filename: %s", filename)
+        try:
+            return await self.fs.read(filename)
+        except FileNotFoundError:
+            self.log.debug("file not found in filesystem, trying aws")
+            content = await self.aws.read(filename)
+            await self.fs.create(filename, content)
+            return content
+
+    async def delete(self, key: str):
+        results = await asyncio.gather(
+            self.fs.delete(key), self.aws.delete(key), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.log.error(result)
+
+    async def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        await asyncio.gather(self.fs.create_multi(mapping), self.aws.create_multi(mapping))
+
+    async def read_multi(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        filenames = list(filenames)
+        values = await self.fs.read_multi(filenames)
+        missing = [filename for filename in filenames if filename not in values]
+        if missing:
+            self.log.debug("files not found in filesystem, trying aws: %s", missing)
+            aws_values = await self.aws.read_multi(missing)
+            await self.fs.create_multi(aws_values)
+            values.update(aws_values)
+        return values
+
+    async def delete_multi(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        results = await asyncio.gather(
+            self.fs.delete_multi(keys), self.aws.delete_multi(keys), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.log.error(result)
+
+
+class AsyncTiering(AsyncStorage):
+    """asyncio `Tiering` storage, with the same cost thresholds"""
+
+    def __init__(
+        self, filesystem: AsyncStorage, aws: AsyncStorage, memcached: AsyncStorage
+    ) -> None:
+        self.fs = filesystem
+        self.aws = aws
+        self.mem = memcached
+        self.log = logging.getLogger("AsyncTiering")
+        self.storages = {"aws": aws, "fs": filesystem, "mem": memcached}
+
+    _storage = Tiering._storage
+    _tier = Tiering._tier
+
+    async def create(self, key: str, data: bytes, cost: int):
+        self.log.debug("create - key: %s", key)
+        await self._storage(cost).create(key, data)
+
+    async def read(self, filename: str, cost: int) -> bytes:
+        return await self._storage(cost).read(filename)
+
+    async def delete(self, key: str, cost: int) -> None:
+        self.log.debug("delete - key: %s", key)
+        storage = self._storage(cost)
+        try:
+            await storage.delete(key)
+        except Exception as e:
+            self.log.error(e)
+
+    async def create_multi(self, mapping: Dict[str, bytes], cost: int) -> None:
+        await self._storage(cost).create_multi(mapping)
+
+    async def read_multi(self, filenames: Iterable[str], cost: int) -> Dict[str, bytes]:
+        return await self._storage(cost).read_multi(filenames)
+
+    async def delete_multi(self, keys: Iterable[str], cost: int) -> None:
+        await self._storage(cost).delete_multi(keys)
+
+
+class AsyncAuto_tiering(AsyncTiering):
+    """asyncio `Auto_tiering` storage
+
+    The files are placed as in `Auto_tiering`: their access scores decay in a
+    `PlacementTable` with a `half_life` in seconds, and their tier is planned by a
+    `TierPlanner`, with the `hysteresis` of the thresholds and the capacities of
+    memcached (`mem_capacity`) and of the filesystem (`fs_capacity`), if given.
+
+    The moves are done in the background by an `AsyncMigrationWorker`, a task of the
+    event loop, at most `rate` moves per second: the reads submit the files to promote,
+    and a sweep every `sweep_interval` seconds submits the files to demote (and to
+    promote, with capacities). A file is read from its current tier until its copy to
+    the new tier is complete. The writes and moves of a file are serialized, the reads
+    are not.
+
+    `flush()` waits until the submitted moves are done, and `close()` stops the worker.
+    """
+
+    def __init__(
+        self,
+        filesystem: AsyncStorage,
+        aws: AsyncStorage,
+        memcached: AsyncStorage,
+        half_life: float = 3600.0,
+        hysteresis: float = 0.2,
+        rate: float = 50.0,
+        sweep_interval: float = 60.0,
+        fs_capacity: int | None = None,
+        mem_capacity: int | None = None,
+    ) -> None:
+        super().__init__(filesystem, aws, memcached)
+        self.log = logging.getLogger("AsyncAuto-tiering")
+        self.hysteresis = hysteresis
+        self.tiers = [aws, filesystem, memcached]
+        self.capacities = [None, fs_capacity, mem_capacity]
+        self.placement = PlacementTable(len(self.tiers), half_life)
+        self.planner = TierPlanner(
+            self.placement,
+            lambda score: self.tiers.index(self._storage(score)),
+            self.capacities,
+            hysteresis,
+        )
+        self.moves = 0
+        self.__locks = [asyncio.Lock() for _ in range(64)]
+        self.__worker = AsyncMigrationWorker(
+            self.__migrate, self.planner.sweep, rate, sweep_interval
+        )
+
+    async def create(self, filename: str, data: bytes) -> None:
+        self.log.debug("create - filename: %s", filename)
+        async with self.__lock(filename):
+            await self.aws.create(filename, data)
+            previous = self.placement.add(filename, 0, len(data))
+            if previous is not None and previous.tier != 0:
+                await self.tiers[previous.tier].delete(filename)
+
+    async def read(self, filename: str) -> bytes:
+        self.log.debug("read - filename: %s", filename)
+        entry = self.placement.hit(filename)
+        if entry is None:
+            raise FileNotFoundError(filename)
+        self.log.debug("read - score: %.1f", entry.score)
+        if self.planner.target(entry) != entry.tier:
+            self.__worker.submit(filename)
+        while True:
+            tier = entry.tier
+            try:
+                value = await self.tiers[tier].read(filename)
+            except FileNotFoundError:
+                value = None
+            # the file may have been moved away since its tier was looked up
+            if value is not None or entry.tier == tier:
+                if value is None and self.tiers[tier] is not self.mem:
+                    raise FileNotFoundError(filename)
+                return value
+
+    async def delete(self, filename: str) -> None:
+        self.log.debug("delete - filename: %s", filename)
+        async with self.__lock(filename):
+            entry = self.placement.pop(filename)
+            if entry is None:
+                raise FileNotFoundError(filename)
+            try:
+                await self.tiers[entry.tier].delete(filename)
+            except Exception as e:
+                self.log.error(e)
+
+    create_multi = AsyncStorage.create_multi
+    read_multi = AsyncStorage.read_multi
+    delete_multi = AsyncStorage.delete_multi
+
+    def storage(self, filename: str) -> AsyncStorage | None:
+        """Current tier of the file"""
+        entry = self.placement.get(filename)
+        return self.tiers[entry.tier] if entry is not None else None
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """Wait until the submitted moves are done, return False on timeout"""
+        return await self.__worker.flush(timeout)
+
+    async def close(self) -> None:
+        await self.__worker.stop()
+
+    def __lock(self, filename: str) -> asyncio.Lock:
+        return self.__locks[hash(filename) % len(self.__locks)]
+
+    async def __migrate(self, filename: str) -> None:
+        async with self.__lock(filename):
+            entry = self.placement.get(filename)
+            if entry is None:
+                return
+            target = self.planner.destination(filename, entry)
+            if target is None:
+                return
+            current = self.tiers[entry.tier]
+            self.log.debug("move - %s from tier %s to %s", filename, entry.tier, target)
+            content = await current.read(filename)
+            if content is None:
+                self.log.warning("move - %s evicted from memcached", filename)
+                return
+            await self.tiers[target].create(filename, content)
+            # the reads go to the new tier once the copy has landed
+            self.placement.move(filename, target)
+            await current.delete(filename)
+            self.moves += 1
+
+
+class AsyncTwoLevelCaching(AsyncStorage):
+    """asyncio `TwoLevelCaching` storage
+
+    The writes and deletes go to aws, the filesystem and memcached at once, and a value
+    read from aws is cached in both tiers at once. The LRU caches of the tiers are
+    `ShardedLRU` caches, as the filesystem tier is used from several worker threads.
+
+    The memcached tier is an `AsyncMem` on the event loop, the values evicted by its LRU
+    cache being deleted from memcached by the operation that evicted them. The files
+    are written and read in worker threads (see `AsyncFileSystem`).
+
+    Args:
+        mem_client (AsyncClient): asyncio memcached client
+        fs_lru_capacity (int, optional): number of files in the filesystem tier. Defaults to 20.
+        mem_lru_capacity (int, optional): number of values in the memcached tier. Defaults to 15.
+        fs_lru_max_bytes (int | None, optional): bytes budget of the filesystem tier. Defaults to None.
+        mem_lru_max_bytes (int | None, optional): bytes budget of the memcached tier. Defaults to None.
+        shards (int, optional): number of shards of the LRU caches. Defaults to 4.
+        limit (int, optional): maximum number of file operations in flight. Defaults to 16.
+        aws (AsyncStorage | None, optional): aws tier. Defaults to an `AsyncAWSS3`.
+    """
+
+    def __init__(
+        self,
+        mem_client: AsyncClient,
+        fs_lru_capacity: int = 20,
+        mem_lru_capacity: int = 15,
+        fs_lru_max_bytes: int | None = None,
+        mem_lru_max_bytes: int | None = None,
+        shards: int = 4,
+        limit: int = 16,
+        aws: AsyncStorage | None = None,
+    ) -> None:
+        assert (
+            fs_lru_capacity > mem_lru_capacity > 0
+        ), "fs_lru_capacity must be greater than mem_lru_capacity and both should be greater than 0"
+        self.log = logging.getLogger("AsyncCache_2level")
+        self.aws = aws if aws is not None else AsyncAWSS3()
+        self.fs_lru = AsyncAdapter(
+            FileSystem_LRU(lru=ShardedLRU(fs_lru_capacity, fs_lru_max_bytes, shards)),
+            limit,
+        )
+        self.mem = AsyncMem(mem_client)
+        self.mem_lru = ShardedLRU(mem_lru_capacity, mem_lru_max_bytes, shards)
+        self.mem_lru.on_evict = self.__evict_mem
+        # keys evicted from the memcached tier, not deleted from memcached yet
+        self.__evicted: List[str] = []
+
+    async def create(self, key: str, value: bytes):
+        self.log.debug("create - key: %s", key)
+        await asyncio.gather(
+            self.aws.create(key, value),
+            self.fs_lru.create(key, value),
+            self.__cache_mem(key, value),
+        )
+
+    async def read(self, key: str) -> bytes | None:
+        self.log.debug("read - key: %s", key)
+        value = await self.__read_mem(key)
+        if value is not None:
+            return value
+        value = await self.fs_lru.read(key)
+        if value is not None:
+            await self.__cache_mem(key, value)
+            return value
+        self.log.debug("read - key not found in LRU caches")
+        value = await self.aws.read(key)
+        await asyncio.gather(
+            self.fs_lru.create(key, value), self.__cache_mem(key, value)
+        )
+        return value
+
+    async def delete(self, key: str):
+        self.log.debug("delete - key: %s", key)
+        self.mem_lru.delete(key)
+        await asyncio.gather(
+            self.mem.delete(key), self.__drop_fs(key), self.aws.delete(key)
+        )
+
+    async def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        await asyncio.gather(
+            self.aws.create_multi(mapping),
+            self.fs_lru.create_multi(mapping),
+            self.__cache_mem_multi(mapping),
+        )
+
+    async def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        cached = [key for key in keys if self.mem_lru.read(key) is not None]
+        values = await self.mem.read_multi(cached) if cached else {}
+        missing = [key for key in keys if key not in values]
+        if not missing:
+            return values
+        fs_values = await self.fs_lru.read_multi(missing)
+        missing = [key for key in missing if key not in fs_values]
+        aws_values = await self.aws.read_multi(missing) if missing else {}
+        fs_values.update(aws_values)
+        await asyncio.gather(
+            self.fs_lru.create_multi(aws_values), self.__cache_mem_multi(fs_values)
+        )
+        values.update(fs_values)
+        return values
+
+    async def delete_multi(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self.log.debug("delete_multi - keys: %s", keys)
+        for key in keys:
+            self.mem_lru.delete(key)
+        await asyncio.gather(
+            self.mem.delete_multi(keys),
+            *(self.__drop_fs(key) for key in keys),
+            self.aws.delete_multi(keys),
+        )
+
+    async def __read_mem(self, key: str) -> bytes | None:
+        if self.mem_lru.read(key) is None:
+            return None
+        return await self.mem.read(key)
+
+    async def __cache_mem(self, key: str, value: bytes) -> None:
+        await self.mem.create(key, value)
+        self.mem_lru.create(key, key, len(value))
+        await self.__delete_evicted()
+
+    async def __cache_mem_multi(self, mapping: Dict[str, bytes]) -> None:
+        if not mapping:
+            return
+        failed = set(await self.mem.create_multi(mapping))
+        for key, value in mapping.items():
+            if key not in failed:
+                self.mem_lru.create(key, key, len(value))
+        await self.__delete_evicted()
+
+    def __evict_mem(self, key: str, _: str) -> None:
+        self.log.debug("evict - key: %s", key)
+        self.__evicted.append(key)
+
+    async def __delete_evicted(self) -> None:
+        evicted, self.__evicted = self.__evicted, []
+        if evicted:
+            await self.mem.delete_multi(evicted)
+
+    async def __drop_fs(self, key: str) -> None:
+        """Remove the file of the key, if it is cached on the disk"""
+        if key in self.fs_lru.storage.lru:
+            try:
+                await self.fs_lru.delete(key)
+            except FileNotFoundError:
+                pass
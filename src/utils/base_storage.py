@@ -1,16 +1,52 @@
 import logging
+import math
+import mmap
 import os
+import time
+import zlib
+import threading
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from memcache import Client
+from utils.chunking import (
+    CHUNK_SIZE,
+    Manifest,
+    chunk_key,
+    join,
+    manifest_key,
+    parse_manifest,
+    split,
+)
+from utils.codec import Codec
+from utils.disk_layout import AtomicWriter, ShardedLayout
+from utils.pool import Slots
+from utils.s3_index import S3Index
+from utils.serializer import Serializer
 
 load_dotenv()
 # logging.basicConfig(level=logging.DEBUG)
-if not (os.getenv("ak") and os.getenv("sk")):
-    print("Please set up your AWS credentials in .env file")
-    exit(1)
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+# memcached reads the expiry times above 30 days as unix timestamps
+RELATIVE_EXPIRY_LIMIT = 60 * 60 * 24 * 30
+
+
+def expiry(ttl: float | None) -> int:
+    """memcached expiry time of a ttl in seconds, 0 for no expiry
+
+    The ttls above 30 days are converted to unix timestamps, so that memcached does not
+    read them as timestamps in 1970 and expire the items at once.
+    """
+    if not ttl:
+        return 0
+    ttl = math.ceil(ttl)
+    return ttl if ttl <= RELATIVE_EXPIRY_LIMIT else math.ceil(time.time()) + ttl
 
 
 class Storage:
@@ -23,6 +59,17 @@ class Storage:
     - read: to read a file from the storage
     - delete: to delete a file from the storage
 
+    And their batched versions, which storages can implement with fewer round trips:
+    - create_multi: to create several files from a mapping of keys to data
+    - read_multi: to read several files, returning a mapping of the keys found to their data
+    - delete_multi: to delete several files
+
+    And their streaming versions, which storages can implement with bounded memory:
+    - read_stream: to read a file as an iterator of buffers
+    - write_stream: to create a file from an iterable of buffers
+
+    The buffers of `read_stream` may be reused views: copy them to keep them.
+
     """
 
     @abstractmethod
@@ -37,93 +84,774 @@ class Storage:
     def delete(self, key: str) -> None:
         pass
 
+    def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        for key, data in mapping.items():
+            self.create(key, data)
+
+    def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        values = {}
+        for key in keys:
+            try:
+                value = self.read(key)
+            except FileNotFoundError:
+                continue
+            if value is not None:
+                values[key] = value
+        return values
+
+    def delete_multi(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.delete(key)
+
+    def read_stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator:
+        value = self.read(key)
+        if value is None:
+            raise FileNotFoundError(key)
+        return views(value, chunk_size)
+
+    def write_stream(self, key: str, chunks: Iterable) -> None:
+        self.create(key, b"".join(chunks))
+
+
+def views(value, chunk_size: int) -> Iterator[memoryview]:
+    """Views of the consecutive `chunk_size` bytes of a value, without copy"""
+    view = memoryview(value)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+def read_file(filename: str, mmap_threshold: int | None = None):
+    """Read a file with a single `read` call of its size
+
+    The files of `mmap_threshold` bytes or more are mapped instead, and returned as a
+    read-only `memoryview` of the mapping, without copy. The view stays valid after the
+    file is removed or replaced, but not if the file is truncated.
+    """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if mmap_threshold is not None and size >= max(mmap_threshold, 1):
+            return memoryview(mmap.mmap(fd, size, access=mmap.ACCESS_READ))
+        data = os.read(fd, size)
+        while len(data) < size:
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        os.close(fd)
+    return data
+
+
+def read_files(
+    filenames: Iterable[str], mmap_threshold: int | None = None
+) -> Dict[str, bytes]:
+    """Read several files with `read_file`, skipping the missing ones
+
+    Each file is read with a single `read` call of its size, without the buffering and the
+    growing reads of `file.read()`.
+    """
+    values = {}
+    for filename in filenames:
+        try:
+            values[filename] = read_file(filename, mmap_threshold)
+        except FileNotFoundError:
+            continue
+    return values
+
 
 class FileSystem(Storage):
-    """FileSystem class for file operations"""
+    """FileSystem class for file operations
 
-    def __init__(self) -> None:
+    The files are written atomically (see `utils.disk_layout.AtomicWriter`), so a reader
+    never sees a partial file, with fsync batches of `fsync_every` writes.
+
+    With a `root`, the keys are not paths anymore but names of files managed in the root,
+    fanned out into hashed subdirectories (see `utils.disk_layout.ShardedLayout`).
+
+    With a `mmap_threshold`, the files of at least that many bytes are read as read-only
+    `memoryview` of a memory mapping, without copying them (see `read_file`).
+
+    Args:
+        mmap_threshold (int | None, optional): minimum size of the mapped files. Defaults to None.
+        root (str | None, optional): root directory of the managed files. Defaults to None.
+        fsync_every (int, optional): number of writes per fsync batch, 0 for none. Defaults to 0.
+        levels (int, optional): levels of subdirectories of the root. Defaults to 2.
+    """
+
+    def __init__(
+        self,
+        mmap_threshold: int | None = None,
+        root: str | None = None,
+        fsync_every: int = 0,
+        levels: int = 2,
+    ) -> None:
+        self.mmap_threshold = mmap_threshold
         self.log = logging.getLogger("FileSystem")
+        self.layout = ShardedLayout(root, levels) if root is not None else None
+        self.writer = AtomicWriter(fsync_every)
+        if self.layout is not None:
+            self.layout.clean()
+
+    def path(self, key: str) -> str:
+        return self.layout.path(key) if self.layout is not None else key
 
     def list(self, directory: str):
         self.log.debug("list - directory: %s", directory)
         return os.listdir(directory)
 
+    def keys(self) -> Iterator[str]:
+        """Keys of the files of the root"""
+        for entry in self.layout.files():
+            key = self.layout.key(entry.path)
+            if key is not None:
+                yield key
+
     def create(self, filename: str, data: bytes):
         self.log.debug("create - filename: %s", filename)
-        with open(filename, "wb") as file:
-            file.write(data)
+        self.__write(filename, (data,))
 
     def delete(self, filename: str):
         self.log.debug("delete - filename: %s", filename)
-        os.remove(filename)
+        os.remove(self.path(filename))
 
     def read(self, filename: str):
         self.log.debug("read - filename: %s", filename)
-        with open(filename, "rb") as file:
-            return file.read()
+        return read_file(self.path(filename), self.mmap_threshold)
+
+    def read_multi(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        filenames = list(filenames)
+        self.log.debug("read_multi - filenames: %s", filenames)
+        if self.layout is None:
+            return read_files(filenames, self.mmap_threshold)
+        paths = {self.path(filename): filename for filename in filenames}
+        return {
+            paths[path]: value
+            for path, value in read_files(paths, self.mmap_threshold).items()
+        }
+
+    def read_stream(self, filename: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator:
+        self.log.debug("read_stream - filename: %s", filename)
+        return read_file_stream(self.path(filename), chunk_size)
+
+    def write_stream(self, filename: str, chunks: Iterable) -> int:
+        """Write the chunks to the file and return its size"""
+        self.log.debug("write_stream - filename: %s", filename)
+        return self.__write(filename, chunks)
+
+    def sync(self) -> None:
+        """fsync the pending batch of writes"""
+        self.writer.sync()
+
+    def __write(self, filename: str, chunks: Iterable) -> int:
+        if self.layout is not None:
+            self.layout.directory(filename)
+        return self.writer.write(self.path(filename), chunks)
+
+
+def read_file_stream(filename: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator:
+    """Read a file in views of one buffer of `chunk_size` bytes, refilled for each view"""
+    with open(filename, "rb", buffering=0) as file:
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                return
+            yield view[:size]
 
 
 class Mem(Storage):
-    """Mem class for memcached operations"""
+    """Mem class for memcached operations
+
+    The bytes values larger than `chunk_size` are split into chunks stored under a manifest
+    key (see `utils.chunking`), so values above the memcached item size limit can be cached.
+    A value whose chunks were partially evicted is read as a miss. `chunk_size=None`
+    disables the chunking.
+
+    The chunks of an overwritten value are not deleted: memcached evicts them. A delete
+    only probes the small copy of the manifest under `<key>:manifest` to find the chunks
+    of the value, without fetching the value itself. The chunks of values written before
+    these copies existed are left to the eviction of memcached as well.
+
+    With a `codec`, the values are compressed when it is worth it, before the chunking.
+
+    With a `serializer` (see `utils.serializer`), the values can be any object: they are
+    serialized before the compression, instead of being pickled by the memcache client.
+    """
 
-    def __init__(self, client: Client) -> None:
+    def __init__(
+        self,
+        client: Client,
+        chunk_size: int | None = CHUNK_SIZE,
+        codec: Codec | None = None,
+        serializer: Serializer | None = None,
+    ) -> None:
         self.client = client
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.serializer = serializer
         self.log = logging.getLogger("Mem")
         self.log.debug("init - client %s", client.__class__)
 
-    def create(self, key: str, value: bytes):
+    def create(self, key: str, value: bytes, ttl: int | None = None):
+        """Store the value, expiring after `ttl` seconds if given"""
         self.log.debug("create - key: %s", key)
-        self.client.set(key, value)
+        time = expiry(ttl)
+        value = self._encode(key, value)
+        if self._chunked(value):
+            manifest, chunks = split(key, value, self.chunk_size)
+            self.log.debug("create - %s chunks", len(chunks))
+            self.client.set_multi(chunks, time=time)
+            value = manifest
+        self.client.set(key, value, time=time)
         self.log.debug("create - done")
 
     def read(self, key: str) -> bytes | None:
         self.log.debug("read - key: %s", key)
         value = self.client.get(key)
+        manifest = parse_manifest(value)
+        if manifest is not None:
+            self.log.debug("read - %s chunks", manifest.count)
+            value = join(key, manifest, self.client.get_multi(manifest.chunk_keys(key)))
+        value = self._decode(key, value)
         if value is None:
-            self.log.warn("read - key not found")
+            self.log.debug("read - key not found")
             # raise ValueError(f"Key {key} not found")
             return None
-        self.log.debug("read - value: %s", value[:10])
+        if isinstance(value, (bytes, memoryview)):
+            self.log.debug("read - %s bytes", len(value))
         return value
 
     def delete(self, key: str):
         self.log.debug("delete - key: %s", key)
+        if self.chunk_size is not None:
+            marker = manifest_key(key)
+            manifest = parse_manifest(self.client.get(marker))
+            if manifest is not None:
+                self.client.delete_multi(manifest.chunk_keys(key) + [marker])
         self.client.delete(key)
         self.log.debug("delete - done")
 
+    def create_multi(self, mapping: Dict[str, bytes], ttl: int | None = None) -> List[str]:
+        """Store several values and return the keys that were not stored"""
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        time = expiry(ttl)
+        values = {}
+        chunks = {}
+        for key, value in mapping.items():
+            value = self._encode(key, value)
+            if self._chunked(value):
+                values[key], value_chunks = split(key, value, self.chunk_size)
+                chunks.update(value_chunks)
+            else:
+                values[key] = value
+        if chunks:
+            self.client.set_multi(chunks, time=time)
+        failed = self.client.set_multi(values, time=time)
+        if failed:
+            self.log.warning("create_multi - keys not stored: %s", failed)
+        return list(failed or [])
 
-class AWSS3(Storage):
-    """AWS S3 class for file operations using AWS S3 bucket"""
-
-    def __init__(self) -> None:
-        self.ak = os.getenv("ak")
-        self.sk = os.getenv("sk")
-        self.session = boto3.Session(
-            aws_access_key_id=self.ak,
-            aws_secret_access_key=self.sk,
+    def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        self.log.debug("read_multi - keys: %s", keys)
+        values = self.client.get_multi(keys)
+        manifests = {}
+        for key, value in values.items():
+            manifest = parse_manifest(value)
+            if manifest is not None:
+                manifests[key] = manifest
+        if manifests:
+            chunk_keys = [
+                chunk_key
+                for key, manifest in manifests.items()
+                for chunk_key in manifest.chunk_keys(key)
+            ]
+            chunks = self.client.get_multi(chunk_keys)
+            for key, manifest in manifests.items():
+                value = join(key, manifest, chunks)
+                if value is None:
+                    del values[key]
+                else:
+                    values[key] = value
+        if self.codec is not None or self.serializer is not None:
+            for key, value in values.items():
+                values[key] = self._decode(key, value)
+        self.log.debug("read_multi - %s/%s keys found", len(values), len(keys))
+        return values
+
+    def delete_multi(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self.log.debug("delete_multi - keys: %s", keys)
+        chunk_keys = []
+        if self.chunk_size is not None:
+            markers = {manifest_key(key): key for key in keys}
+            for marker, value in self.client.get_multi(list(markers)).items():
+                manifest = parse_manifest(value)
+                if manifest is not None:
+                    chunk_keys.extend(manifest.chunk_keys(markers[marker]))
+                    chunk_keys.append(marker)
+        self.client.delete_multi(keys + chunk_keys)
+
+    def read_stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator:
+        """Read the value chunk by chunk, checking its length and crc32 at the end"""
+        if self.codec is not None or self.serializer is not None:
+            yield from super().read_stream(key, chunk_size)
+            return
+        value = self.client.get(key)
+        manifest = parse_manifest(value)
+        if manifest is None:
+            if value is None:
+                raise FileNotFoundError(key)
+            yield from views(value, chunk_size)
+            return
+        self.log.debug("read_stream - %s chunks", manifest.count)
+        total = 0
+        crc = 0
+        for name in manifest.chunk_keys(key):
+            chunk = self.client.get(name)
+            if chunk is None:
+                raise FileNotFoundError(name)
+            total += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        if total != manifest.total or crc != manifest.crc:
+            raise IOError(f"{key}: chunks inconsistent with the manifest")
+
+    def write_stream(self, key: str, chunks: Iterable, ttl: int | None = None) -> None:
+        """Store the value chunk by chunk, buffering at most one chunk
+
+        With a codec or a serializer, the value is joined and stored with `create`, so that
+        it gets the same framing as the values read back through them.
+        """
+        if (
+            self.codec is not None
+            or self.serializer is not None
+            or self.chunk_size is None
+        ):
+            self.create(key, b"".join(chunks), ttl)
+            return
+        self.log.debug("write_stream - key: %s", key)
+        time = expiry(ttl)
+        version = os.urandom(8)
+        buffer = bytearray()
+        count = total = crc = 0
+        for data in chunks:
+            buffer += data
+            while len(buffer) > self.chunk_size:
+                chunk = bytes(buffer[: self.chunk_size])
+                del buffer[: self.chunk_size]
+                self.client.set(chunk_key(key, version, count), chunk, time=time)
+                count += 1
+                total += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+        if count == 0:
+            self.client.set(key, bytes(buffer), time=time)
+            return
+        if buffer:
+            self.client.set(chunk_key(key, version, count), bytes(buffer), time=time)
+            count += 1
+            total += len(buffer)
+            crc = zlib.crc32(buffer, crc)
+        manifest = Manifest(version, count, total, crc).pack()
+        self.client.set(manifest_key(key), manifest, time=time)
+        self.client.set(key, manifest, time=time)
+        self.log.debug("write_stream - %s chunks", count)
+
+    def _encode(self, key: str, value):
+        """Value as stored: serialized (or copied to bytes), then compressed"""
+        if self.serializer is not None:
+            value = self.serializer.dumps(value)
+        elif isinstance(value, (bytearray, memoryview)):
+            value = bytes(value)
+        if self.codec is not None:
+            value = self.codec.encode(key, value)
+        return value
+
+    def _decode(self, key: str, value):
+        """Value read back from its stored form, None for a miss"""
+        if value is not None and self.codec is not None:
+            value = self.codec.decode(key, value)
+        if value is not None and self.serializer is not None:
+            value = self.serializer.loads(value)
+        return value
+
+    def _chunked(self, value) -> bool:
+        return (
+            self.chunk_size is not None
+            and isinstance(value, bytes)
+            and len(value) > self.chunk_size
         )
-        self.s3 = self.session.resource("s3")
-        self.bucket = self.s3.Bucket("ensta")
+
+
+S3_MAX_CONNECTIONS = 32
+MB = 1024 * 1024
+# minimum size of the parts of a multipart upload, except the last one
+MIN_PART_SIZE = 5 * MB
+
+_s3_client = None
+_s3_lock = threading.Lock()
+
+
+def s3_client(max_pool_connections: int = S3_MAX_CONNECTIONS):
+    """boto3 S3 client shared by the AWSS3 storages
+
+    boto3 clients are thread-safe, unlike resources and sessions, so one client with a
+    pool of `max_pool_connections` connections serves every storage and thread.
+    """
+    global _s3_client
+    with _s3_lock:
+        if _s3_client is None:
+            if not (os.getenv("ak") and os.getenv("sk")):
+                print("Please set up your AWS credentials in .env file")
+                exit(1)
+            session = boto3.Session(
+                aws_access_key_id=os.getenv("ak"),
+                aws_secret_access_key=os.getenv("sk"),
+            )
+            _s3_client = session.client(
+                "s3", config=Config(max_pool_connections=max_pool_connections)
+            )
+        return _s3_client
+
+
+# bounds the concurrent requests to the connections of the shared client
+S3_SLOTS = Slots("s3", S3_MAX_CONNECTIONS)
+# threads of the part requests, shared by the storages (see `AWSS3.concurrency`)
+S3_PARTS = ThreadPoolExecutor(S3_MAX_CONNECTIONS, thread_name_prefix="s3-parts")
+
+
+def is_missing(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+
+
+class AWSS3(Storage):
+    """AWS S3 class for file operations using AWS S3 bucket
+
+    The storages share one thread-safe S3 client (see `s3_client`) and the requests wait
+    for one of its connections in `S3_SLOTS`, which records the wait times.
+
+    The objects of `multipart_threshold` bytes or more are uploaded in parts of `part_size`
+    bytes, and the objects larger than `part_size` are downloaded with byte-range requests
+    of `part_size` bytes into one buffer, up to `concurrency` parts at once per operation.
+    The part requests run in the threads of `S3_PARTS`, shared by the storages. The first
+    range request also gives the size of the object, so the small objects are still read
+    in one request.
+
+    The batched operations run up to `workers` requests concurrently, and `delete_multi`
+    deletes up to 1000 objects per request.
+
+    Args:
+        workers (int, optional): concurrent requests of the batched operations. Defaults to 16.
+        bucket (str, optional): name of the bucket. Defaults to "ensta".
+        client (optional): S3 client, e.g. a `utils.fake_s3.FakeS3Client`. Defaults to `s3_client()`.
+        slots (Slots, optional): slots of the connections of the client. Defaults to `S3_SLOTS`.
+        multipart_threshold (int, optional): minimum size of a multipart upload. Defaults to 16MB.
+        part_size (int, optional): size of the parts and ranges, at least 5MB. Defaults to 8MB.
+        concurrency (int, optional): concurrent part requests. Defaults to 8.
+        index (bool, optional): keep a local `S3Index` of the bucket for `exists` and `size`, filled by `index.refresh()`. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        workers: int = 16,
+        bucket: str = "ensta",
+        client=None,
+        slots: Slots = S3_SLOTS,
+        multipart_threshold: int = 16 * MB,
+        part_size: int = 8 * MB,
+        concurrency: int = 8,
+        index: bool = False,
+    ) -> None:
+        assert part_size >= MIN_PART_SIZE, "S3 parts must be at least 5MB"
+        self.client = client if client is not None else s3_client()
+        self.bucket = bucket
+        self.slots = slots
+        self.workers = workers
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.concurrency = concurrency
         self.log = logging.getLogger("AWSS3")
+        self.index = S3Index(self) if index else None
+
+    def list(
+        self, prefix: str = "", delimiter: str | None = None, page_size: int = 1000
+    ) -> Iterator[str]:
+        """Lazily list the keys starting with `prefix`, `page_size` keys per request
+
+        With a `delimiter`, the keys containing it after the prefix are grouped and only
+        their common prefix is listed, like a directory.
+        """
+        self.log.debug("list - prefix: %s", prefix)
+        for page in self.__list_pages(prefix, delimiter, page_size):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+            for common in page.get("CommonPrefixes", []):
+                yield common["Prefix"]
+
+    def list_objects(self, prefix: str = "", page_size: int = 1000) -> Iterator[List[Dict]]:
+        """Lazily list the pages of objects (with their `Key`, `Size` and `ETag`)"""
+        for page in self.__list_pages(prefix, None, page_size):
+            yield page.get("Contents", [])
+
+    def exists(self, filename: str) -> bool:
+        if self.index is not None:
+            exists = self.index.exists(filename)
+            if exists is not None:
+                return exists
+        return self.__head(filename) is not None
 
-    def list(self):
-        self.log.debug("list - start listing")
-        objects = self.bucket.objects.all()
-        return [obj.key for obj in objects]
+    def size(self, filename: str) -> int | None:
+        """Size of the object, None if it does not exist"""
+        if self.index is not None:
+            size = self.index.size(filename)
+            if size is not None or self.index.exists(filename) is False:
+                return size
+        head = self.__head(filename)
+        return head["ContentLength"] if head is not None else None
 
     def create(self, filename: str, data: bytes):
         self.log.debug("create - filename: %s", filename)
-        self.bucket.put_object(Key=filename, Body=data)
+        if len(data) >= self.multipart_threshold:
+            etag = self.__create_multipart(filename, views(data, self.part_size))
+        else:
+            with self.slots.slot():
+                etag = self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=filename,
+                    Body=bytes(data) if isinstance(data, memoryview) else data,
+                )["ETag"]
+        if self.index is not None:
+            self.index.add(filename, len(data), etag)
 
-    def read(self, filename: str) -> bytes:
+    def write_stream(self, filename: str, chunks: Iterable) -> None:
+        """Upload the chunks, in parts when they reach `multipart_threshold` bytes
+
+        At most `concurrency` parts are buffered while they are uploaded.
+        """
+        self.log.debug("write_stream - filename: %s", filename)
+        chunks = iter(chunks)
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= self.multipart_threshold:
+                break
+        else:
+            self.create(filename, bytes(buffer))
+            return
+        total = len(buffer)
+
+        def parts() -> Iterator[bytes]:
+            nonlocal total
+            for chunk in chunks:
+                while len(buffer) >= self.part_size:
+                    yield bytes(buffer[: self.part_size])
+                    del buffer[: self.part_size]
+                buffer.extend(chunk)
+                total += len(chunk)
+            while len(buffer) >= self.part_size:
+                yield bytes(buffer[: self.part_size])
+                del buffer[: self.part_size]
+            if buffer:
+                yield bytes(buffer)
+
+        etag = self.__create_multipart(filename, parts())
+        if self.index is not None:
+            self.index.add(filename, total, etag)
+
+    def read_stream(self, filename: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator:
+        self.log.debug("read_stream - filename: %s", filename)
+        with self.slots.slot():
+            body = self.client.get_object(Bucket=self.bucket, Key=filename)["Body"]
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, filename: str) -> bytearray:
+        """Read the object, in ranges of `part_size` bytes fetched in parallel
+
+        The objects larger than a part are read into one preallocated `bytearray`, which
+        is returned as it is, without a copy to `bytes`. The smaller objects are returned
+        as a `bytearray` too, so that the type of the value does not depend on its size.
+        """
         self.log.debug("read - filename: %s", filename)
-        obj = self.bucket.Object(filename)
-        resource = obj.get()["Body"].read()
-        self.log.debug("read - resource: %s", resource[:10])
-        return resource
-        # return self.s3.Object("ensta", filename).get()["Body"].read().decode("UTF-8")
+        try:
+            with self.slots.slot():
+                obj = self.client.get_object(
+                    Bucket=self.bucket, Key=filename, Range=f"bytes=0-{self.part_size - 1}"
+                )
+                first = obj["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "InvalidRange":
+                raise
+            # empty object
+            with self.slots.slot():
+                return bytearray(
+                    self.client.get_object(Bucket=self.bucket, Key=filename)[
+                        "Body"
+                    ].read()
+                )
+        size = int(obj["ContentRange"].rpartition("/")[2])
+        if size <= len(first):
+            self.log.debug("read - %s bytes", len(first))
+            return bytearray(first)
+        self.log.debug("read - %s bytes in ranges", size)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        view[: len(first)] = first
+        futures = []
+        for start in range(len(first), size, self.part_size):
+            if len(futures) >= self.concurrency:
+                # bounds the part requests of this read
+                futures[len(futures) - self.concurrency].result()
+            futures.append(
+                S3_PARTS.submit(
+                    self.__read_range,
+                    filename,
+                    obj["ETag"],
+                    view[start : start + self.part_size],
+                    start,
+                )
+            )
+        for future in futures:
+            future.result()
+        view.release()
+        return buffer
 
     def delete(self, filename: str):
         self.log.debug("delete - filename: %s", filename)
-        self.bucket.Object(filename).delete()
+        with self.slots.slot():
+            self.client.delete_object(Bucket=self.bucket, Key=filename)
+        if self.index is not None:
+            self.index.discard(filename)
         self.log.debug("delete - done")
+
+    def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        self.log.debug("create_multi - filenames: %s", list(mapping))
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = [
+                executor.submit(self.create, key, data) for key, data in mapping.items()
+            ]
+            for future in futures:
+                future.result()
+
+    def read_multi(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        filenames = list(filenames)
+        self.log.debug("read_multi - filenames: %s", filenames)
+
+        def get(filename: str) -> bytes | None:
+            try:
+                return self.read(filename)
+            except ClientError as e:
+                if is_missing(e):
+                    return None
+                raise
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            values = executor.map(get, filenames)
+            return {
+                filename: value
+                for filename, value in zip(filenames, values)
+                if value is not None
+            }
+
+    def delete_multi(self, filenames: Iterable[str]) -> None:
+        filenames = list(filenames)
+        self.log.debug("delete_multi - filenames: %s", filenames)
+        for start in range(0, len(filenames), 1000):
+            objects = [{"Key": filename} for filename in filenames[start : start + 1000]]
+            with self.slots.slot():
+                self.client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+                )
+        if self.index is not None:
+            for filename in filenames:
+                self.index.discard(filename)
+        self.log.debug("delete_multi - done")
+
+    def __create_multipart(self, filename: str, parts: Iterable) -> str:
+        with self.slots.slot():
+            upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=filename
+            )["UploadId"]
+        self.log.debug("create - multipart upload %s", upload_id)
+        try:
+            futures = []
+            for number, part in enumerate(parts, 1):
+                if number > self.concurrency:
+                    # bounds the parts in memory
+                    futures[number - 1 - self.concurrency].result()
+                futures.append(
+                    S3_PARTS.submit(self.__upload_part, filename, upload_id, number, part)
+                )
+            uploaded = [future.result() for future in futures]
+            with self.slots.slot():
+                return self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=filename,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": uploaded},
+                )["ETag"]
+        except Exception:
+            self.log.error("create - multipart upload of %s failed", filename)
+            with self.slots.slot():
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=filename, UploadId=upload_id
+                )
+            raise
+
+    def __upload_part(
+        self, filename: str, upload_id: str, number: int, part
+    ) -> Dict:
+        with self.slots.slot():
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=filename,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=bytes(part),
+            )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    def __read_range(
+        self, filename: str, etag: str, target: memoryview, start: int
+    ) -> None:
+        """Read the bytes of the object from `start` into `target`"""
+        end = start + len(target) - 1
+        with self.slots.slot():
+            body = self.client.get_object(
+                Bucket=self.bucket, Key=filename, Range=f"bytes={start}-{end}", IfMatch=etag
+            )["Body"]
+            offset = 0
+            while offset < len(target):
+                chunk = body.read(min(len(target) - offset, 1024 * 1024))
+                if not chunk:
+                    raise IOError(f"{filename}: range {start}-{end} ended early")
+                target[offset : offset + len(chunk)] = chunk
+                offset += len(chunk)
+
+    def __list_pages(
+        self, prefix: str, delimiter: str | None, page_size: int
+    ) -> Iterator[Dict]:
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix, "MaxKeys": page_size}
+        if delimiter is not None:
+            kwargs["Delimiter"] = delimiter
+        while True:
+            with self.slots.slot():
+                page = self.client.list_objects_v2(**kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+    def __head(self, filename: str) -> Dict | None:
+        try:
+            with self.slots.slot():
+                return self.client.head_object(Bucket=self.bucket, Key=filename)
+        except ClientError as e:
+            if is_missing(e):
+                return None
+            raise
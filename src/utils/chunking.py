@@ -0,0 +1,91 @@
+import os
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+# memcached refuses items over 1MB by default, key and item header included
+CHUNK_SIZE = 1000 * 1000
+
+MAGIC = b"\x00MEMCHUNK"
+HEADER = struct.Struct("!8sIQI")  # version, number of chunks, total size, crc32
+
+
+class Manifest:
+    """Manifest of a value split into chunks
+
+    The manifest is stored under the key of the value, and the chunks under
+    `<key>:<version>:<index>`. The version is random for each write, so chunks of
+    different writes are never mixed, and the crc32 detects any other inconsistency.
+
+    A copy of the manifest is also stored under `<key>:manifest` (`manifest_key`), a
+    small item that a delete probes to find the chunks without fetching the value.
+
+    Args:
+        version (bytes): version of the write
+        count (int): number of chunks
+        total (int): total size of the value
+        crc (int): crc32 of the value
+    """
+
+    __slots__ = ("version", "count", "total", "crc")
+
+    def __init__(self, version: bytes, count: int, total: int, crc: int) -> None:
+        self.version = version
+        self.count = count
+        self.total = total
+        self.crc = crc
+
+    def pack(self) -> bytes:
+        return MAGIC + HEADER.pack(self.version, self.count, self.total, self.crc)
+
+    def chunk_keys(self, key: str) -> List[str]:
+        return [chunk_key(key, self.version, index) for index in range(self.count)]
+
+
+def chunk_key(key: str, version: bytes, index: int) -> str:
+    return f"{key}:{version.hex()}:{index}"
+
+
+def manifest_key(key: str) -> str:
+    return f"{key}:manifest"
+
+
+def parse_manifest(value) -> Manifest | None:
+    """Return the manifest stored in `value`, or None if it is a plain value"""
+    if (
+        not isinstance(value, bytes)
+        or len(value) != len(MAGIC) + HEADER.size
+        or not value.startswith(MAGIC)
+    ):
+        return None
+    return Manifest(*HEADER.unpack_from(value, len(MAGIC)))
+
+
+def split(key: str, value: bytes, chunk_size: int) -> Tuple[bytes, Dict[str, bytes]]:
+    """Split `value` into chunks and return its packed manifest and the chunks by key
+
+    The chunks include the copy of the manifest under `manifest_key(key)`.
+    """
+    view = memoryview(value)
+    manifest = Manifest(
+        os.urandom(8), -(-len(value) // chunk_size), len(value), zlib.crc32(view)
+    )
+    chunks = {
+        chunk_key: bytes(view[index * chunk_size : (index + 1) * chunk_size])
+        for index, chunk_key in enumerate(manifest.chunk_keys(key))
+    }
+    packed = manifest.pack()
+    chunks[manifest_key(key)] = packed
+    return packed, chunks
+
+
+def join(key: str, manifest: Manifest, chunks: Dict[str, bytes]) -> bytes | None:
+    """Reassemble a value from its chunks, or return None if a chunk is missing or corrupted"""
+    parts = [chunks.get(chunk_key) for chunk_key in manifest.chunk_keys(key)]
+    if any(part is None for part in parts):
+        return None
+    # `b"".join` sizes the result once and copies each chunk into it
+    value = b"".join(parts)
+    if len(value) != manifest.total or zlib.crc32(value) != manifest.crc:
+        return None
+    return value
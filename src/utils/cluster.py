@@ -0,0 +1,275 @@
+import bisect
+import hashlib
+import logging
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List
+
+from memcache import Client
+
+
+def _hash(data: bytes, index: int = 0) -> int:
+    digest = hashlib.md5(data).digest()
+    return int.from_bytes(digest[index * 4 : index * 4 + 4], "little")
+
+
+class HashRing:
+    """Ketama-style consistent hash ring
+
+    Each node is placed on the ring at `points` positions (virtual nodes), 4 per md5 digest
+    of `<node>-<i>`, and a key belongs to the first nodes found clockwise from the hash of
+    the key. Adding or removing a node only remaps the keys of the node.
+
+    Args:
+        nodes (Iterable[str]): nodes of the ring, e.g. "host:port"
+        points (int, optional): number of virtual nodes per node. Defaults to 160.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), points: int = 160) -> None:
+        self.__points = points
+        self.__ring: List[int] = []
+        self.__owners: Dict[int, str] = {}
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.__points // 4):
+            data = f"{node}-{i}".encode()
+            for j in range(4):
+                point = _hash(data, j)
+                if point not in self.__owners:
+                    self.__owners[point] = node
+                    bisect.insort(self.__ring, point)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        owners = {point: owner for point, owner in self.__owners.items() if owner != node}
+        # the ring is swapped first, so that its points always have an owner
+        self.__ring = sorted(owners)
+        self.__owners = owners
+
+    def get_nodes(self, key: str, count: int = 1) -> List[str]:
+        """First `count` distinct nodes of the key, clockwise on the ring"""
+        if not self.__ring:
+            return []
+        count = min(count, len(self.nodes))
+        nodes: List[str] = []
+        index = bisect.bisect(self.__ring, _hash(key.encode()))
+        for offset in range(len(self.__ring)):
+            node = self.__owners[self.__ring[(index + offset) % len(self.__ring)]]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == count:
+                    break
+        return nodes
+
+
+class ClusterClient:
+    """Memcached client for a cluster of nodes placed on a consistent hash ring
+
+    It has the same interface as `memcache.Client` for the operations used by `Mem`, so
+    `Mem(ClusterClient([...]))` runs on the whole cluster.
+
+    Each key is written to its `replicas` first nodes on the `HashRing` and read from all of
+    them at once, the first value answered being used. A node that fails is marked dead and
+    removed from the ring for `dead_retry` seconds, so only its keys are remapped. `add` only
+    goes to the first node of the key, to stay atomic (e.g. for leases).
+
+    A node missed the writes and deletes of its keys while it was out of the ring, so it is
+    flushed before it goes back in: it would serve stale or deleted values otherwise. A node
+    that cannot be flushed stays dead for another `dead_retry` seconds. The flush runs
+    outside the lock of the ring, so the other nodes can die or revive meanwhile.
+
+    Args:
+        nodes (Iterable[str]): memcached nodes, e.g. "host:port"
+        replicas (int, optional): number of nodes storing each key. Defaults to 2.
+        client_factory (Callable[[str], Any] | None, optional): client of a node. Defaults to `memcache.Client([node])`.
+        dead_retry (float, optional): seconds before a dead node is tried again. Defaults to 30.
+        points (int, optional): number of virtual nodes per node. Defaults to 160.
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[str],
+        replicas: int = 2,
+        client_factory: Callable[[str], Any] | None = None,
+        dead_retry: float = 30.0,
+        points: int = 160,
+    ) -> None:
+        self.log = logging.getLogger("ClusterClient")
+        factory = client_factory or (lambda node: Client([node], debug=0))
+        self.nodes = list(nodes)
+        self.replicas = replicas
+        self.dead_retry = dead_retry
+        self.clients = {node: factory(node) for node in self.nodes}
+        self.ring = HashRing(self.nodes, points)
+        self.__dead: Dict[str, float] = {}
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(
+            max(4, 2 * len(self.nodes)), thread_name_prefix="cluster"
+        )
+
+    def mark_dead(self, node: str) -> None:
+        with self.__lock:
+            if node in self.__dead:
+                return
+            self.log.warning("mark_dead - node %s removed from the ring", node)
+            self.__dead[node] = time.monotonic() + self.dead_retry
+            self.ring.remove(node)
+
+    def mark_alive(self, node: str) -> None:
+        with self.__lock:
+            retry_at = self.__dead.get(node)
+            if retry_at is None or retry_at == math.inf:
+                # not dead, or already being flushed by another thread
+                return
+            self.__dead[node] = math.inf
+        # the flush is a network round trip, the other nodes are not kept waiting for it
+        try:
+            self.clients[node].flush_all()
+            flushed = self.__alive(node)
+        except Exception as e:
+            self.log.error("mark_alive - flush of %s failed: %s", node, e)
+            flushed = False
+        with self.__lock:
+            if not flushed:
+                self.__dead[node] = time.monotonic() + self.dead_retry
+                return
+            del self.__dead[node]
+            self.log.info("mark_alive - node %s flushed and back in the ring", node)
+            self.ring.add(node)
+
+    def nodes_for(self, key: str) -> List[str]:
+        self.__revive()
+        return self.ring.get_nodes(key, self.replicas)
+
+    def set(self, key: str, value, time: int = 0) -> bool:
+        stored = False
+        for node in self.nodes_for(key):
+            stored = bool(self.__call(node, "set", key, value, time=time)) or stored
+        return stored
+
+    def add(self, key: str, value, time: int = 0) -> bool:
+        nodes = self.nodes_for(key)
+        return bool(nodes) and bool(self.__call(nodes[0], "add", key, value, time=time))
+
+    def get(self, key: str):
+        nodes = self.nodes_for(key)
+        if len(nodes) <= 1:
+            return self.__call(nodes[0], "get", key) if nodes else None
+        pending = {self.__executor.submit(self.__call, node, "get", key) for node in nodes}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                value = future.result()
+                if value is not None:
+                    return value
+        return None
+
+    def delete(self, key: str) -> int:
+        deleted = 0
+        for node in self.nodes_for(key):
+            deleted = self.__call(node, "delete", key) or deleted
+        return deleted
+
+    def set_multi(self, mapping: Dict[str, Any], time: int = 0) -> List[str]:
+        """Store the values on their replicas and return the keys not stored on any node"""
+        by_node: Dict[str, Dict[str, Any]] = {}
+        for key, value in mapping.items():
+            for node in self.nodes_for(key):
+                by_node.setdefault(node, {})[key] = value
+        stored = set()
+        futures = {
+            node: self.__executor.submit(
+                self.__call, node, "set_multi", values, time=time, default=list(values)
+            )
+            for node, values in by_node.items()
+        }
+        for node, future in futures.items():
+            failed = set(future.result() or [])
+            stored.update(key for key in by_node[node] if key not in failed)
+        return [key for key in mapping if key not in stored]
+
+    def get_multi(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Read the keys from their first replica, then the misses from the next ones"""
+        keys = list(keys)
+        values: Dict[str, Any] = {}
+        replicas = {key: self.nodes_for(key) for key in keys}
+        for rank in range(self.replicas):
+            by_node: Dict[str, List[str]] = {}
+            for key in keys:
+                if key not in values and rank < len(replicas[key]):
+                    by_node.setdefault(replicas[key][rank], []).append(key)
+            if not by_node:
+                break
+            futures = [
+                self.__executor.submit(
+                    self.__call, node, "get_multi", node_keys, default={}
+                )
+                for node, node_keys in by_node.items()
+            ]
+            for future in futures:
+                values.update(future.result() or {})
+        return values
+
+    def delete_multi(self, keys: Iterable[str]) -> int:
+        """Delete the keys from their replicas, return 1 if every node succeeded, else 0"""
+        by_node: Dict[str, List[str]] = {}
+        for key in keys:
+            for node in self.nodes_for(key):
+                by_node.setdefault(node, []).append(key)
+        deleted = 1
+        for node, node_keys in by_node.items():
+            if not self.__call(node, "delete_multi", node_keys):
+                deleted = 0
+        return deleted
+
+    def get_stats(self) -> List:
+        stats = []
+        for node in self.ring.nodes:
+            stats.extend(self.__call(node, "get_stats", default=[]))
+        return stats
+
+    def disconnect_all(self) -> None:
+        for client in self.clients.values():
+            if hasattr(client, "disconnect_all"):
+                client.disconnect_all()
+        self.__executor.shutdown(wait=False)
+
+    def __call(self, node: str, method: str, *args, default=None, **kwargs):
+        """Call a method of the client of a node, marking the node dead if it is down"""
+        try:
+            result = getattr(self.clients[node], method)(*args, **kwargs)
+        except Exception as e:
+            self.log.error("%s on %s failed: %s", method, node, e)
+            self.mark_dead(node)
+            return default
+        if not result and not self.__alive(node):
+            # python-memcached reports connection errors as falsy results
+            self.mark_dead(node)
+            return default
+        return result
+
+    def __alive(self, node: str) -> bool:
+        servers = getattr(self.clients[node], "servers", None)
+        if servers is None:
+            # the other clients raise on connection errors
+            return True
+        now = time.time()
+        return any(server.deaduntil <= now for server in servers)
+
+    def __revive(self) -> None:
+        if not self.__dead:
+            return
+        now = time.monotonic()
+        for node, retry_at in list(self.__dead.items()):
+            if retry_at <= now:
+                self.mark_alive(node)
@@ -0,0 +1,155 @@
+import logging
+import time
+import zlib
+from typing import Dict
+
+from utils.LRU import ShardedLRU
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+# header of the encoded values: 2 magic bytes and the codec used
+MAGIC = b"\xc7\x0c"
+HEADER_SIZE = len(MAGIC) + 1
+RAW = 0
+ZLIB = 1
+LZ4 = 2
+
+HEADERS = {codec: MAGIC + bytes((codec,)) for codec in (RAW, ZLIB, LZ4)}
+
+
+class CodecStats:
+    """Compression statistics of a key, or of all the keys
+
+    Args:
+        bytes_in (int): size of the values given to the codec
+        bytes_out (int): size of the encoded values, headers included
+        encode_seconds (float): CPU time spent encoding
+        decode_seconds (float): CPU time spent decoding
+    """
+
+    __slots__ = ("bytes_in", "bytes_out", "encode_seconds", "decode_seconds")
+
+    def __init__(self) -> None:
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_saved,
+            "encode_seconds": self.encode_seconds,
+            "decode_seconds": self.decode_seconds,
+        }
+
+
+class Codec:
+    """Adaptive compression codec for the memcached values
+
+    The values smaller than `threshold` are stored raw. For the others, a sample of
+    `sample_size` bytes is compressed first and the value is stored raw if the sample does
+    not compress below `min_ratio`, e.g. for JPEG images. The codec is lz4 when it is
+    installed, zlib level `level` otherwise.
+
+    The compressed values are prefixed with a 3-byte header (`MAGIC` and the codec used).
+    The raw values are stored as they are, without copy, unless they start with `MAGIC`:
+    those get a raw header, stripped by `decode`. A value stored without the codec that
+    starts with `MAGIC` is decoded wrongly: enabling the codec on a memcached already
+    holding such values requires flushing it first.
+
+    The statistics are kept for the `stats_capacity` most recently used keys, and in total.
+
+    Args:
+        threshold (int, optional): minimum size of the values to compress. Defaults to 4096.
+        level (int, optional): zlib compression level. Defaults to 1.
+        sample_size (int, optional): size of the sample of the value to try. Defaults to 16384.
+        min_ratio (float, optional): maximum compressed/raw size ratio worth storing. Defaults to 0.9.
+        stats_capacity (int, optional): number of keys with statistics. Defaults to 1024.
+        use_lz4 (bool, optional): use lz4 if it is installed. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 4096,
+        level: int = 1,
+        sample_size: int = 16 * 1024,
+        min_ratio: float = 0.9,
+        stats_capacity: int = 1024,
+        use_lz4: bool = True,
+    ) -> None:
+        self.threshold = threshold
+        self.level = level
+        self.sample_size = sample_size
+        self.min_ratio = min_ratio
+        self.codec = LZ4 if use_lz4 and lz4 is not None else ZLIB
+        self.total = CodecStats()
+        self.__stats = ShardedLRU(stats_capacity, shards=4)
+        self.log = logging.getLogger("Codec")
+
+    def stats(self, key: str) -> CodecStats | None:
+        """Statistics of a key, if it is still tracked"""
+        return self.__stats.peek(key)
+
+    def encode(self, key: str, value):
+        if not isinstance(value, bytes):
+            return value
+        start = time.thread_time()
+        encoded = value
+        if len(value) >= self.threshold and self.__worth(value):
+            compressed = self.__compress(value)
+            if len(compressed) < len(value) * self.min_ratio:
+                encoded = HEADERS[self.codec] + compressed
+        if encoded is value and value.startswith(MAGIC):
+            encoded = HEADERS[RAW] + value
+        self.__record(key, len(value), len(encoded), time.thread_time() - start, 0.0)
+        return encoded
+
+    def decode(self, key: str, value):
+        if not isinstance(value, bytes) or not value.startswith(MAGIC):
+            return value
+        codec = value[len(MAGIC)]
+        if codec == RAW:
+            return value[HEADER_SIZE:]
+        start = time.thread_time()
+        if codec == ZLIB:
+            decoded = zlib.decompress(memoryview(value)[HEADER_SIZE:])
+        elif codec == LZ4 and lz4 is not None:
+            decoded = lz4.decompress(memoryview(value)[HEADER_SIZE:])
+        else:
+            self.log.error("decode - unknown codec %s for key %s", codec, key)
+            return None
+        self.__record(key, 0, 0, 0.0, time.thread_time() - start)
+        return decoded
+
+    def __worth(self, value: bytes) -> bool:
+        if len(value) <= self.sample_size:
+            return True
+        sample = memoryview(value)[: self.sample_size]
+        return len(self.__compress(sample)) < self.sample_size * self.min_ratio
+
+    def __compress(self, data) -> bytes:
+        if self.codec == LZ4:
+            return lz4.compress(data)
+        return zlib.compress(data, self.level)
+
+    def __record(
+        self, key: str, bytes_in: int, bytes_out: int, encode: float, decode: float
+    ) -> None:
+        stats = self.__stats.read(key)
+        if stats is None:
+            stats = CodecStats()
+            self.__stats.create(key, stats)
+        for target in (stats, self.total):
+            target.bytes_in += bytes_in
+            target.bytes_out += bytes_out
+            target.encode_seconds += encode
+            target.decode_seconds += decode
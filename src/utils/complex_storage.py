@@ -1,33 +1,84 @@
 import logging
 import os
-from typing import Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List
 
 from dotenv import load_dotenv
 from memcache import Client
+from utils.LRU import LRU, EvictionPolicy, ShardedLRU
 from utils.LRU_storage import FileSystem_LRU, Mem_LRU
-from utils.base_storage import AWSS3, FileSystem, Mem, Storage
+from utils.policies import make_policy
+from utils.base_storage import S3_MAX_CONNECTIONS, AWSS3, FileSystem, Mem, Storage
+from utils.cost_model import CostModel, Decision
+from utils.metrics import instrument
+from utils.migration import MigrationWorker, PlacementTable, TierPlanner
+from utils.single_flight import SingleFlight
+from utils.write_behind import WriteBehindQueue
 
 load_dotenv()
 # logging.basicConfig(level=logging.DEBUG)
-if not (os.getenv("ak") and os.getenv("sk")):
-    print("Please set up your AWS credentials in .env file")
-    exit(1)
 
 
 class Replica(Storage):
-    """Replica storage"""
+    """Replica storage
+
+    The writes go to the filesystem and to aws, depending on the `mode`:
+
+    - "sync": one after the other, the latency of a write is the sum of both
+    - "concurrent": both at once, the latency of a write is the slowest of both. The aws
+      writes run in a pool of `S3_MAX_CONNECTIONS` threads, as many as the S3 client has
+      connections
+    - "write-behind": to the filesystem, then to a `WriteBehindQueue` writing to aws in the
+      background, so the latency of a write is the filesystem only. The repeated writes of
+      a key are coalesced, `flush()` waits until aws is up to date and `close()` flushes
+      and stops the queue. Until then, the reads answer the keys waiting in the queue.
+      The deletes are queued for aws even if the file is missing from the filesystem.
+
+    Args:
+        filesystem (FileSystem): local replica
+        aws (AWSS3): remote replica
+        mode (str, optional): "sync", "concurrent" or "write-behind". Defaults to "sync".
+        **kwargs: arguments of the `WriteBehindQueue` in "write-behind" mode
+    """
+
+    MODES = ("sync", "concurrent", "write-behind")
 
-    def __init__(self, filesystem: FileSystem, aws: AWSS3) -> None:
-        self.fs = filesystem
-        self.aws = aws
+    def __init__(
+        self, filesystem: FileSystem, aws: AWSS3, mode: str = "sync", **kwargs
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(
+                f"Unknown replica mode {mode}, expected one of {self.MODES}"
+            )
+        self.fs = instrument(filesystem, "replica.fs")
+        self.aws = instrument(aws, "replica.aws")
+        self.mode = mode
         self.log = logging.getLogger("Replica")
+        self.__flight = SingleFlight()
+        self.__executor = (
+            ThreadPoolExecutor(S3_MAX_CONNECTIONS, thread_name_prefix="replica")
+            if mode == "concurrent"
+            else None
+        )
+        self.queue = (
+            WriteBehindQueue(self.aws, name="replica-write-behind", **kwargs)
+            if mode == "write-behind"
+            else None
+        )
 
     def create(self, key: str, data: bytes):
         self.log.debug("create - key: %s", key)
-        self.fs.create(key, data)
-        self.log.debug("file created in filesystem at key: %s", key)
-        self.aws.create(key, data)
-        self.log.debug("file created in aws at key: %s", key)
+        if self.queue is not None:
+            self.fs.create(key, data)
+            self.queue.create(key, data)
+            self.log.debug("file created in filesystem, queued for aws at key: %s", key)
+            return
+        self.__both(
+            lambda: self.fs.create(key, data), lambda: self.aws.create(key, data)
+        )
+        self.log.debug("file created in filesystem and aws at key: %s", key)
 
     def read(self, filename: str):
         self.log.debug("read - filename: %s", filename)
@@ -35,57 +86,372 @@ class Replica(Storage):
             self.log.debug("trying filesystem")
             return self.fs.read(filename)
         except FileNotFoundError:
+            content = self.queue.peek(filename) if self.queue is not None else None
+            if content is not None:
+                return content
             self.log.debug("file not found in filesystem, trying aws")
-            content = self.aws.read(filename)
-            self.log.debug("file found in aws, creating in filesystem")
-            self.fs.create(filename, content)
-            self.log.debug("file created in filesystem")
-            return content
+            # the concurrent misses of a key share a single aws read
+            return self.__flight.do(filename, lambda: self.__fetch(filename))
 
     def delete(self, key: str):
         try:
-            self.fs.delete(key)
-            self.aws.delete(key)
+            if self.queue is not None:
+                try:
+                    self.fs.delete(key)
+                finally:
+                    self.queue.delete(key)
+                return
+            self.__both(lambda: self.fs.delete(key), lambda: self.aws.delete(key))
+        except Exception as e:
+            self.log.error(e)
+
+    def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        if self.queue is not None:
+            self.fs.create_multi(mapping)
+            for key, data in mapping.items():
+                self.queue.create(key, data)
+            return
+        self.__both(
+            lambda: self.fs.create_multi(mapping),
+            lambda: self.aws.create_multi(mapping),
+        )
+
+    def read_multi(self, filenames: Iterable[str]) -> Dict[str, bytes]:
+        filenames = list(filenames)
+        self.log.debug("read_multi - filenames: %s", filenames)
+        values = self.fs.read_multi(filenames)
+        missing = [filename for filename in filenames if filename not in values]
+        if missing and self.queue is not None:
+            missing = queued(self.queue, missing, values)
+        if missing:
+            self.log.debug("files not found in filesystem, trying aws: %s", missing)
+            aws_values = self.aws.read_multi(missing)
+            self.fs.create_multi(aws_values)
+            values.update(aws_values)
+        return values
+
+    def delete_multi(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        try:
+            if self.queue is not None:
+                try:
+                    self.fs.delete_multi(keys)
+                finally:
+                    for key in keys:
+                        self.queue.delete(key)
+                return
+            self.__both(
+                lambda: self.fs.delete_multi(keys), lambda: self.aws.delete_multi(keys)
+            )
         except Exception as e:
             self.log.error(e)
 
+    def flush(self, timeout: float | None = None) -> None:
+        """Wait until the writes queued for aws are done (see `WriteBehindQueue.flush`)"""
+        if self.queue is not None:
+            self.queue.flush(timeout)
+
+    def close(self) -> None:
+        if self.queue is not None:
+            self.queue.close()
+        if self.__executor is not None:
+            self.__executor.shutdown()
+
+    def __fetch(self, filename: str) -> bytes:
+        content = self.aws.read(filename)
+        self.log.debug("file found in aws, creating in filesystem")
+        self.fs.create(filename, content)
+        self.log.debug("file created in filesystem")
+        return content
+
+    def __both(self, local: Callable, remote: Callable) -> None:
+        if self.__executor is None:
+            local()
+            remote()
+            return
+        future = self.__executor.submit(remote)
+        try:
+            local()
+        finally:
+            # the aws write is waited for even if the local one failed
+            future.result()
+
+
+def queued(
+    queue: WriteBehindQueue, keys: Iterable[str], values: Dict[str, bytes]
+) -> List[str]:
+    """Add the values of the keys waiting in the queue to `values`, and return the keys
+    neither waiting to be written nor to be deleted"""
+    missing = []
+    for key in keys:
+        try:
+            value = queue.peek(key)
+        except FileNotFoundError:
+            continue
+        if value is None:
+            missing.append(key)
+        else:
+            values[key] = value
+    return missing
+
 
 class Tiering(Storage):
-    """Tiering storage"""
+    """Tiering storage
+
+    By default, the tier of a key is given by the `cost` of each operation: S3 below 100,
+    the filesystem below 1000, memcached above. The `cost` is then required by every
+    operation, a missing one raising ValueError.
+
+    With a `CostModel`, the `cost` of a write is the expected access rate of the key
+    instead, in reads per hour, and the key goes to the tier minimizing its expected
+    access cost (rate × latency of the tier for its size) under the capacities of the
+    tiers, possibly moving keys saving less per byte out of a full tier. The `cost` of
+    the other operations is ignored, and `explain(key)` tells why the key is in its tier.
+    The latency and throughput of each tier are estimated from its measured single-key
+    operations, see `cost_model.snapshot()`.
+
+    The rate given to `create` is only the initial estimate of the key: its reads update
+    it (see `CostModel.hit`). When the estimated rate of a key moves away from its rate
+    when placed by more than `hysteresis`, or when the latency estimates change the tier
+    it is cheapest in, the key is placed again by a `MigrationWorker` in the background,
+    at most `rate` placements per second, a sweep every `sweep_interval` seconds finding
+    the keys whose reads stopped. `flush()` waits until they are placed, and `close()`
+    stops the worker.
+
+    Args:
+        filesystem (FileSystem): filesystem storage
+        aws (AWSS3): S3 storage
+        memcached (Mem): memcached storage
+        cost_model (CostModel | None, optional): places the keys by expected access cost. Defaults to None.
+        hysteresis (float, optional): relative change of access rate placing a key again. Defaults to 0.2.
+        rate (float, optional): placements per second in the background. Defaults to 50.
+        sweep_interval (float, optional): seconds between two sweeps. Defaults to 60.
+    """
 
-    def __init__(self, filesystem: FileSystem, aws: AWSS3, memcached: Mem) -> None:
-        self.fs = filesystem
-        self.aws = aws
-        self.mem = memcached
+    def __init__(
+        self,
+        filesystem: FileSystem,
+        aws: AWSS3,
+        memcached: Mem,
+        cost_model: CostModel | None = None,
+        hysteresis: float = 0.2,
+        rate: float = 50.0,
+        sweep_interval: float = 60.0,
+    ) -> None:
+        self.fs = instrument(filesystem, "tiering.fs")
+        self.aws = instrument(aws, "tiering.aws")
+        self.mem = instrument(memcached, "tiering.mem")
         self.log = logging.getLogger("Tiering")
+        self.storages = {"aws": self.aws, "fs": self.fs, "mem": self.mem}
+        self.adaptive = cost_model is not None
+        self.cost_model = cost_model
+        self.hysteresis = hysteresis
+        # the placements, which may move other keys, are serialized
+        self.__placing = threading.RLock()
+        self.__worker = None
+        if self.adaptive:
+            self.__worker = MigrationWorker(
+                self.__replace, self.__sweep, rate, sweep_interval
+            )
+            self.__worker.start()
 
     def create(self, key: str, data: bytes, cost: int):
         self.log.debug("create - key: %s", key)
-        self._storage(cost).create(key, data)
+        if self.adaptive:
+            self.__place(key, data, cost)
+        else:
+            self.__create(self._tier(cost), key, data)
         self.log.debug("create - done")
 
-    def read(self, filename: str, cost: int) -> bytes:
-        return self._storage(cost).read(filename)
-
-    def delete(self, key: str, cost: int) -> None:
+    def read(self, filename: str, cost: int | None = None) -> bytes:
+        if not self.adaptive:
+            return self.__read(self._tier(cost), filename)
+        decision = self.cost_model.hit(filename)
+        if decision is None:
+            raise FileNotFoundError(filename)
+        if self.cost_model.stale(decision, self.hysteresis):
+            self.__worker.submit(filename)
+        tier = decision.tier
+        try:
+            value = self.__read(tier, filename)
+        except FileNotFoundError:
+            if self.__tier(filename) == tier:
+                raise
+            value = None
+        current = self.__tier(filename)
+        if value is None and current not in (tier, None):
+            # moved to another tier meanwhile
+            value = self.__read(current, filename)
+        return value
+
+    def create_multi(self, mapping: Dict[str, bytes], cost: int) -> None:
+        if not self.adaptive:
+            self._storage(cost).create_multi(mapping)
+            return
+        for key, data in mapping.items():
+            self.__place(key, data, cost)
+
+    def read_multi(
+        self, filenames: Iterable[str], cost: int | None = None
+    ) -> Dict[str, bytes]:
+        if not self.adaptive:
+            return self._storage(cost).read_multi(filenames)
+        values: Dict[str, bytes] = {}
+        for tier, keys in self.__by_tier(filenames).items():
+            values.update(self.storages[tier].read_multi(keys))
+        return values
+
+    def delete_multi(self, keys: Iterable[str], cost: int | None = None) -> None:
+        if not self.adaptive:
+            self._storage(cost).delete_multi(keys)
+            return
+        with self.__placing:
+            by_tier = self.__by_tier(keys)
+            for tier, tier_keys in by_tier.items():
+                for key in tier_keys:
+                    self.cost_model.forget(key)
+                self.storages[tier].delete_multi(tier_keys)
+
+    def delete(self, key: str, cost: int | None = None) -> None:
         self.log.debug("delete - key: %s", key)
+        # a missing cost is a caller error, not a storage one
+        storage = None if self.adaptive else self._storage(cost)
         try:
-            self._storage(cost).delete(key)
+            if storage is not None:
+                storage.delete(key)
+            else:
+                with self.__placing:
+                    decision = self.cost_model.forget(key)
+                    if decision is None:
+                        raise FileNotFoundError(key)
+                    self.storages[decision.tier].delete(key)
         except Exception as e:
             self.log.error(e)
         self.log.debug("delete - done")
 
+    def explain(self, key: str) -> Dict[str, Any]:
+        """Tier of the key, its expected access costs and why it is there"""
+        if not self.adaptive:
+            raise ValueError("explain requires a cost model")
+        return self.cost_model.explain(key)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until the keys to place again are placed, return False on timeout"""
+        return self.__worker.flush(timeout) if self.__worker is not None else True
+
+    def close(self) -> None:
+        if self.__worker is not None:
+            self.__worker.stop()
+
     def _storage(self, cost: int) -> Storage:
+        return self.storages[self._tier(cost)]
+
+    def _tier(self, cost: int) -> str:
         self.log.debug("storage - cost: %s", cost)
+        if cost is None:
+            raise ValueError("cost is required without a cost model")
         if cost < 100:
             self.log.debug("cost < 100: aws storage")
-            return self.aws
+            return "aws"
         elif cost < 1000:
             self.log.debug("cost < 1000: filesystem storage")
-            return self.fs
+            return "fs"
         else:
             self.log.debug("cost >= 1000: memcached storage")
-            return self.mem
+            return "mem"
+
+    def __place(self, key: str, data: bytes, rate: float) -> None:
+        with self.__placing:
+            decision = self.cost_model.place(key, len(data), rate)
+            self.__apply(key, data, decision)
+
+    def __apply(self, key: str, data: bytes, decision: Decision) -> None:
+        """Write the key to its tier, moving the keys it displaces first
+
+        Each displaced key is recorded in its new tier as soon as it is copied there, so
+        that a failure leaves the cost model consistent with the data.
+        """
+        self.log.debug("place - %s", decision.reason)
+        for displaced, tier in decision.displaced.items():
+            entry = self.cost_model.get(displaced)
+            if entry is None:
+                continue
+            previous = entry.tier
+            value = self.__read(previous, displaced)
+            if value is None:
+                self.log.warning("place - %s evicted from %s", displaced, previous)
+                self.cost_model.forget(displaced)
+                continue
+            self.__create(tier, displaced, value)
+            self.cost_model.move(displaced, tier, key)
+            self.__drop(previous, displaced)
+        self.__create(decision.tier, key, data)
+        previous = self.cost_model.apply(key, decision)
+        if previous is not None and previous.tier != decision.tier:
+            self.__drop(previous.tier, key)
+
+    def __drop(self, tier: str, key: str) -> None:
+        """Delete the copy of a key left in its previous tier"""
+        try:
+            self.storages[tier].delete(key)
+        except Exception as e:
+            self.log.error("place - %s left in %s: %s", key, tier, e)
+
+    def __replace(self, key: str) -> None:
+        """Place a key again with its estimated access rate, if still needed"""
+        with self.__placing:
+            entry = self.cost_model.get(key)
+            if entry is None or not self.cost_model.stale(entry, self.hysteresis):
+                return
+            rate = self.cost_model.rate(entry)
+            decision = self.cost_model.place(key, entry.size, rate)
+            if decision.tier == entry.tier and not decision.displaced:
+                # staying in its tier, with its new rate and costs
+                self.cost_model.apply(key, decision)
+                return
+            data = self.__read(entry.tier, key)
+            if data is None:
+                self.log.warning("place - %s evicted from %s", key, entry.tier)
+                self.cost_model.forget(key)
+                return
+            self.__apply(key, data, decision)
+
+    def __sweep(self) -> List[str]:
+        return [
+            key
+            for key, decision in self.cost_model.items()
+            if self.cost_model.stale(decision, self.hysteresis)
+        ]
+
+    def __by_tier(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        by_tier: Dict[str, List[str]] = {}
+        for key in keys:
+            decision = self.cost_model.get(key)
+            if decision is not None:
+                by_tier.setdefault(decision.tier, []).append(key)
+        return by_tier
+
+    def __tier(self, key: str) -> str | None:
+        decision = self.cost_model.get(key)
+        return decision.tier if decision is not None else None
+
+    def __create(self, tier: str, key: str, data: bytes) -> None:
+        if not self.adaptive:
+            self.storages[tier].create(key, data)
+            return
+        start = time.perf_counter()
+        self.storages[tier].create(key, data)
+        self.cost_model.observe(tier, len(data), time.perf_counter() - start)
+
+    def __read(self, tier: str, key: str) -> bytes | None:
+        if not self.adaptive:
+            return self.storages[tier].read(key)
+        start = time.perf_counter()
+        value = self.storages[tier].read(key)
+        if value is not None:
+            self.cost_model.observe(tier, len(value), time.perf_counter() - start)
+        return value
 
 
 class TwoLevelCaching(Storage):
@@ -98,101 +464,398 @@ class TwoLevelCaching(Storage):
     These LRU caches are used to store the keys of the files that are stored in the Memcached storage and the filesystem, respectively.
 
     They enable us to manage the keys based on the frequency of access to the files.
+
+    Each LRU cache can also be given a budget in bytes (`fs_lru_max_bytes`, `mem_lru_max_bytes`).
+
+    With `shards` > 1, the LRU caches are thread-safe `ShardedLRU` caches split in `shards` shards.
+
+    The eviction policy of each tier can be chosen with `fs_policy` and `mem_policy` among
+    `utils.policies.POLICIES`, e.g. "arc", "2q" or "w-tinylfu" for scan resistant tiers.
+    The other policies are bounded by the number of keys only and are not thread-safe:
+    they raise ValueError with a bytes budget or with `shards` > 1.
+
+    With a `fs_root`, the filesystem tier stores the files in this managed directory,
+    fanned out into hashed subdirectories, instead of at the paths given as keys.
+
+    The `write_policy` chooses where `create` writes:
+
+    - "write-through": to aws and to both tiers
+    - "write-around": to aws only, dropping the cached copies, the tiers being filled by
+      the reads, so that the values written and never read do not take their place
+    - "write-back": to both tiers, then to aws in the background through a
+      `WriteBehindQueue`, `flush()` waiting until aws is up to date. The `write_back_*`
+      arguments are the `max_pending`, `workers`, `retries`, `backoff` and `timeout` of
+      the queue, the defaults of the queue being used for the missing ones. They raise
+      TypeError with the other policies.
+
+    With `exclusive`, a value is cached in one tier at a time, so that both tiers together
+    hold more distinct values: the values go to memcached, a value read from the
+    filesystem is promoted to memcached and removed from the disk, and a value evicted
+    from memcached is demoted to the filesystem.
+
+    With `STORAGE_METRICS` set (see `utils.metrics`), the tiers record their hits, misses,
+    evictions and latencies in the metrics "2level.mem", "2level.fs" and "2level.aws".
     """
 
+    WRITE_POLICIES = ("write-through", "write-around", "write-back")
+
     def __init__(
-        self, mem_client: Client, fs_lru_capacity: int = 20, mem_lru_capacity: int = 15
+        self,
+        mem_client: Client,
+        fs_lru_capacity: int = 20,
+        mem_lru_capacity: int = 15,
+        fs_lru_max_bytes: int | None = None,
+        mem_lru_max_bytes: int | None = None,
+        shards: int = 1,
+        fs_policy: str = "lru",
+        mem_policy: str = "lru",
+        fs_root: str | None = None,
+        write_policy: str = "write-through",
+        exclusive: bool = False,
+        aws: AWSS3 | None = None,
+        write_back_max_pending: int | None = None,
+        write_back_workers: int | None = None,
+        write_back_retries: int | None = None,
+        write_back_backoff: float | None = None,
+        write_back_timeout: float | None = None,
     ) -> None:
         assert (
             fs_lru_capacity > mem_lru_capacity > 0
         ), "fs_lru_capacity must be greater than mem_lru_capacity and both should be greater than 0"
+        if write_policy not in self.WRITE_POLICIES:
+            raise ValueError(
+                f"Unknown write policy {write_policy}, expected one of {self.WRITE_POLICIES}"
+            )
+        write_back = {
+            "max_pending": write_back_max_pending,
+            "workers": write_back_workers,
+            "retries": write_back_retries,
+            "backoff": write_back_backoff,
+            "timeout": write_back_timeout,
+        }
+        write_back = {
+            name: value for name, value in write_back.items() if value is not None
+        }
+        if write_back and write_policy != "write-back":
+            raise TypeError(
+                f"write_back_{', write_back_'.join(write_back)} only apply to the "
+                f"write-back policy, not {write_policy}"
+            )
         self.log = logging.getLogger("Cache_2level")
-        self.aws = AWSS3()
-        self.fs_lru = FileSystem_LRU(fs_lru_capacity)
-        self.mem_lru = Mem_LRU(mem_client, mem_lru_capacity)
+        self.aws = instrument(aws if aws is not None else AWSS3(), "2level.aws")
+        self.write_policy = write_policy
+        self.exclusive = exclusive
+        fs_lru = FileSystem_LRU(
+            lru=self.__policy(fs_policy, fs_lru_capacity, fs_lru_max_bytes, shards),
+            root=fs_root,
+        )
+        mem_lru = Mem_LRU(
+            mem_client,
+            lru=self.__policy(mem_policy, mem_lru_capacity, mem_lru_max_bytes, shards),
+        )
+        if exclusive:
+            mem_lru.demote = self.__demote
+        self.fs_lru = instrument(fs_lru, "2level.fs")
+        self.mem_lru = instrument(mem_lru, "2level.mem")
+        self.queue = (
+            WriteBehindQueue(self.aws, name="cache-write-back", **write_back)
+            if write_policy == "write-back"
+            else None
+        )
+        self.__flight = SingleFlight()
 
     def create(self, key: str, value: bytes):
         self.log.debug("create - key: %s", key)
-        self.aws.create(key, value)
-        self.fs_lru.create(key, value)
-        self.mem_lru.create(key, value)
+        if self.write_policy == "write-around":
+            self.aws.create(key, value)
+            self.__drop(key)
+        elif self.queue is not None:
+            self.__cache(key, value)
+            self.queue.create(key, value)
+        else:
+            self.aws.create(key, value)
+            self.__cache(key, value)
         self.log.debug("create - done")
 
     def read(self, key: str) -> bytes | None:
         self.log.debug("read - key: %s", key)
         mem_value = self.mem_lru.read(key)
         if mem_value is None:
-            fs_value = self.fs_lru.read(key)
-            if fs_value is None:
-                self.log.warn("read - key not found in LRU caches")
-                aws_value = self.aws.read(key)
-                self.log.debug("read from aws - value: %s", mem_value[:10])
-                self.fs_lru.create(key, aws_value)
-                self.mem_lru.create(key, aws_value)
-                return aws_value
-            self.log.debug("read from fs - value: %s", mem_value[:10])
-            self.mem_lru.create(key, fs_value)
-            return fs_value
-        self.log.debug("read from mem - value: %s", mem_value[:10])
+            # the concurrent misses of a key share a single fill of the tiers
+            return self.__flight.do(key, lambda: self.__fill(key))
+        self.log.debug("read from mem - %s bytes", len(mem_value))
         self.log.debug("read - done")
         return mem_value
 
     def delete(self, key: str):
         self.log.debug("delete - key: %s", key)
-        self.mem_lru.delete(key)
-        self.fs_lru.delete(key)
-        self.aws.delete(key)
+        self.__drop(key)
+        if self.queue is not None:
+            self.queue.delete(key)
+        else:
+            self.aws.delete(key)
         self.log.debug("delete - done")
 
+    def create_multi(self, mapping: Dict[str, bytes]) -> None:
+        self.log.debug("create_multi - keys: %s", list(mapping))
+        if self.write_policy == "write-around":
+            self.aws.create_multi(mapping)
+            for key in mapping:
+                self.__drop(key)
+            return
+        if self.queue is None:
+            self.aws.create_multi(mapping)
+        if not self.exclusive:
+            self.fs_lru.create_multi(mapping)
+        else:
+            for key in mapping:
+                self.__drop_fs(key)
+        self.mem_lru.create_multi(mapping)
+        if self.queue is not None:
+            for key, value in mapping.items():
+                self.queue.create(key, value)
+
+    def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Read several keys: one batch from memcached, then the misses from the filesystem,
+        then what is still missing from aws"""
+        keys = list(keys)
+        self.log.debug("read_multi - keys: %s", keys)
+        values = self.mem_lru.read_multi(keys)
+        missing = [key for key in keys if key not in values]
+        if not missing:
+            return values
+        fs_values = self.fs_lru.read_multi(missing)
+        self.log.debug("read_multi - %s keys read from fs", len(fs_values))
+        missing = [key for key in missing if key not in fs_values]
+        if missing and self.queue is not None:
+            missing = queued(self.queue, missing, fs_values)
+        aws_values = self.aws.read_multi(missing) if missing else {}
+        self.log.debug("read_multi - %s keys read from aws", len(aws_values))
+        if self.exclusive:
+            # promoted to memcached, the values leave the disk
+            for key in fs_values:
+                self.__drop_fs(key)
+        else:
+            self.fs_lru.create_multi(aws_values)
+        fs_values.update(aws_values)
+        self.mem_lru.create_multi(fs_values)
+        values.update(fs_values)
+        return values
+
+    def delete_multi(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self.log.debug("delete_multi - keys: %s", keys)
+        for key in keys:
+            self.__drop(key)
+        if self.queue is not None:
+            for key in keys:
+                self.queue.delete(key)
+        else:
+            self.aws.delete_multi(keys)
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Wait until the writes queued for aws are done (see `WriteBehindQueue.flush`)"""
+        if self.queue is not None:
+            self.queue.flush(timeout)
+
+    def close(self) -> None:
+        if self.queue is not None:
+            self.queue.close()
+        self.fs_lru.close()
+
+    def __fill(self, key: str) -> bytes:
+        fs_value = self.fs_lru.read(key)
+        if fs_value is None:
+            self.log.debug("read - key not found in LRU caches")
+            aws_value = self.queue.peek(key) if self.queue is not None else None
+            if aws_value is None:
+                aws_value = self.aws.read(key)
+            self.log.debug("read from aws - %s bytes", len(aws_value))
+            self.__cache(key, aws_value)
+            return aws_value
+        self.log.debug("read from fs - %s bytes", len(fs_value))
+        self.mem_lru.create(key, fs_value)
+        if self.exclusive:
+            self.__drop_fs(key)
+        return fs_value
+
+    def __cache(self, key: str, value: bytes) -> None:
+        if self.exclusive:
+            self.__drop_fs(key)
+        else:
+            self.fs_lru.create(key, value)
+        self.mem_lru.create(key, value)
+
+    def __demote(self, key: str, value: bytes) -> None:
+        self.log.debug("demote - key: %s", key)
+        self.fs_lru.create(key, value)
+
+    def __drop(self, key: str) -> None:
+        """Remove the cached copies of the key"""
+        self.mem_lru.delete(key)
+        self.__drop_fs(key)
+
+    def __drop_fs(self, key: str) -> None:
+        if key in self.fs_lru.lru:
+            try:
+                self.fs_lru.delete(key)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def __policy(
+        name: str, capacity: int, max_bytes: int | None, shards: int
+    ) -> EvictionPolicy:
+        if name != "lru":
+            if max_bytes is not None or shards > 1:
+                raise ValueError(
+                    f"the {name} policy has no bytes budget and no shards, "
+                    "only the lru policy does"
+                )
+            return make_policy(name, capacity)
+        if shards > 1:
+            return ShardedLRU(capacity, max_bytes, shards)
+        return LRU(capacity, max_bytes)
+
 
 class Auto_tiering(Tiering):
-    """Auto-tiering storage"""
+    """Auto-tiering storage
+
+    The tier, the size and the access score of each file are kept in a `PlacementTable`,
+    the scores decaying exponentially with a `half_life` in seconds, and the tier of
+    each file is planned by a `TierPlanner`.
+
+    Without capacities, the tier of a file is the storage of its score in `Tiering`. To
+    keep the files near a threshold from bouncing between two tiers, a file is promoted
+    when its score exceeds the threshold by `hysteresis` (20% by default), and demoted
+    when it is below by as much.
+
+    With a capacity in bytes for memcached (`mem_capacity`) and/or the filesystem
+    (`fs_capacity`), a tier without capacity being unbounded, the tiers hold the files with
+    the highest score per byte instead: the sweep fills memcached, then the filesystem,
+    with the files in decreasing order of score per byte, among the files read at least
+    once recently (score of 1). The files of a tier get a `hysteresis` bonus to keep it.
+    Between two sweeps, a read promotes a file to a tier with enough free space if its
+    score per byte exceeds the lowest one of the tier at the last sweep.
+
+    The moves are done in the background by a `MigrationWorker`, at most `rate` moves per
+    second: the reads submit the files to promote, and a sweep every `sweep_interval`
+    seconds submits the files to demote (and to promote, with capacities). A file is read
+    from its current tier until its copy to the new tier is complete.
+
+    `flush()` waits until the submitted moves are done, and `close()` stops the worker.
+    """
 
-    def __init__(self, filesystem: FileSystem, aws: AWSS3, memcached: Mem) -> None:
+    def __init__(
+        self,
+        filesystem: FileSystem,
+        aws: AWSS3,
+        memcached: Mem,
+        half_life: float = 3600.0,
+        hysteresis: float = 0.2,
+        rate: float = 50.0,
+        sweep_interval: float = 60.0,
+        fs_capacity: int | None = None,
+        mem_capacity: int | None = None,
+    ) -> None:
         super().__init__(filesystem, aws, memcached)
         self.log = logging.getLogger("Auto-tiering")
-        self.__frequency: Dict[str, int] = {}
-        self.__current_storage: Storage
+        self.hysteresis = hysteresis
+        self.tiers = [self.aws, self.fs, self.mem]
+        self.capacities = [None, fs_capacity, mem_capacity]
+        self.placement = PlacementTable(len(self.tiers), half_life)
+        self.planner = TierPlanner(
+            self.placement,
+            lambda score: self.tiers.index(self._storage(score)),
+            self.capacities,
+            hysteresis,
+        )
+        self.moves = 0
+        # the writes and moves of a key are serialized, the reads are not
+        self.__locks = [threading.Lock() for _ in range(64)]
+        self.__worker = MigrationWorker(
+            self.__migrate, self.planner.sweep, rate, sweep_interval
+        )
+        self.__worker.start()
 
     def create(self, filename: str, data: bytes) -> None:
         self.log.debug("create - filename: %s", filename)
-        self.__frequency[filename] = 0
-        self.__current_storage = super()._storage(self.__frequency[filename])
-        super().create(
-            filename,
-            data,
-            self.__frequency[filename],
-        )
+        with self.__lock(filename):
+            self.aws.create(filename, data)
+            previous = self.placement.add(filename, 0, len(data))
+            if previous is not None and previous.tier != 0:
+                self.tiers[previous.tier].delete(filename)
 
     def read(self, filename: str) -> bytes:
         self.log.debug("read - filename: %s", filename)
-        self.__frequency[filename] += 1
-        # ^ This can be updated to a more complex algorithm for calculating the frequency of access based on the time of access.
-        self.log.debug("read - frequency: %s", self.__frequency[filename])
-        self.__auto_check(filename)
-        return super().read(filename, self.__frequency[filename])
+        entry = self.placement.hit(filename)
+        if entry is None:
+            raise FileNotFoundError(filename)
+        self.log.debug("read - score: %.1f", entry.score)
+        if self.planner.target(entry) != entry.tier:
+            self.__worker.submit(filename)
+        while True:
+            tier = entry.tier
+            try:
+                value = self.tiers[tier].read(filename)
+            except FileNotFoundError:
+                value = None
+            # the file may have been moved away since its tier was looked up
+            if value is not None or entry.tier == tier:
+                if value is None and self.tiers[tier] is not self.mem:
+                    raise FileNotFoundError(filename)
+                return value
 
     def delete(self, filename: str) -> None:
         self.log.debug("delete - filename: %s", filename)
-        self.log.debug("delete - frequency: %s", self.__frequency[filename])
-        super().delete(filename, self.__frequency[filename])
-        del self.__frequency[filename]
-
-    def __auto_check(self, filename: str) -> None:
-        self.log.debug("auto_check - filename: %s", filename)
-        if self.__current_storage != super()._storage(self.__frequency[filename]):
-            self.__move(filename)
-        self.log.debug("auto_check - done")
-
-    def __move(self, filename: str) -> None:
-        self.log.debug("move - filename: %s", filename)
-        content = self.__current_storage.read(filename)
-        self.log.debug("move - content: %s", content[:10])
-        super().create(filename, content, self.__frequency[filename])
-        self.__current_storage.delete(filename)
-        self.log.debug(
-            "move - update current storage to %s",
-            super()._storage(self.__frequency[filename]).__class__.__name__,
-        )
-        self.__current_storage = super()._storage(self.__frequency[filename])
-        self.log.debug("move - done")
+        with self.__lock(filename):
+            entry = self.placement.pop(filename)
+            if entry is None:
+                raise FileNotFoundError(filename)
+            try:
+                self.tiers[entry.tier].delete(filename)
+            except Exception as e:
+                self.log.error(e)
+
+    create_multi = Storage.create_multi
+    read_multi = Storage.read_multi
+    delete_multi = Storage.delete_multi
+
+    def storage(self, filename: str) -> Storage | None:
+        """Current tier of the file"""
+        entry = self.placement.get(filename)
+        return self.tiers[entry.tier] if entry is not None else None
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until the submitted moves are done, return False on timeout"""
+        return self.__worker.flush(timeout)
+
+    def close(self) -> None:
+        self.__worker.stop()
+
+    def __lock(self, filename: str) -> threading.Lock:
+        return self.__locks[hash(filename) % len(self.__locks)]
+
+    def __migrate(self, filename: str) -> None:
+        with self.__lock(filename):
+            entry = self.placement.get(filename)
+            if entry is None:
+                return
+            target = self.planner.destination(filename, entry)
+            if target is None:
+                return
+            current = self.tiers[entry.tier]
+            self.log.debug(
+                "move - %s from %s to %s",
+                filename,
+                current.__class__.__name__,
+                self.tiers[target].__class__.__name__,
+            )
+            content = current.read(filename)
+            if content is None:
+                self.log.warning("move - %s evicted from memcached", filename)
+                return
+            self.tiers[target].create(filename, content)
+            self.placement.move(filename, target)
+            current.delete(filename)
+            self.moves += 1
@@ -0,0 +1,351 @@
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# latency in seconds and throughput in bytes per second assumed for each tier until
+# enough of its operations are measured
+PRIORS = {
+    "aws": (0.05, 50e6),
+    "fs": (0.001, 200e6),
+    "mem": (0.0005, 100e6),
+}
+
+
+class LatencyModel:
+    """Running estimate of the duration of an operation on a backend, by object size
+
+    The duration is modelled as `latency + size / throughput`, fitted by an exponentially
+    weighted least squares regression on the measured operations, each new operation
+    weighing `alpha` of the fit, so that the estimate follows the backend when its
+    performance changes. The prior is used until `min_samples` operations are measured.
+    With objects of (nearly) a single size, the throughput cannot be fitted and the prior
+    one is kept, the latency being fitted alone.
+
+    Args:
+        latency (float): prior latency in seconds
+        throughput (float): prior throughput in bytes per second
+        alpha (float, optional): weight of the last operation in the fit. Defaults to 0.05.
+        min_samples (int, optional): operations measured before trusting the fit. Defaults to 10.
+    """
+
+    def __init__(
+        self,
+        latency: float,
+        throughput: float,
+        alpha: float = 0.05,
+        min_samples: int = 10,
+    ) -> None:
+        self.prior = (latency, 1 / throughput)
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.samples = 0
+        self.__size = 0.0
+        self.__seconds = 0.0
+        self.__variance = 0.0
+        self.__covariance = 0.0
+        self.__lock = threading.Lock()
+
+    def observe(self, size: int, seconds: float) -> None:
+        with self.__lock:
+            self.samples += 1
+            # plain averages for the first samples, the prior weighing nothing
+            alpha = max(self.alpha, 1 / self.samples)
+            dx = size - self.__size
+            dy = seconds - self.__seconds
+            self.__size += alpha * dx
+            self.__seconds += alpha * dy
+            self.__variance = (1 - alpha) * (self.__variance + alpha * dx * dx)
+            self.__covariance = (1 - alpha) * (self.__covariance + alpha * dx * dy)
+
+    def fit(self) -> Tuple[float, float]:
+        """Latency in seconds and seconds per byte"""
+        with self.__lock:
+            if self.samples < self.min_samples:
+                return self.prior
+            per_byte = self.prior[1]
+            # the sizes must spread by 10% around their mean to fit the throughput
+            if self.__variance > (0.1 * self.__size) ** 2 > 0:
+                per_byte = max(self.__covariance / self.__variance, 0.0)
+            latency = max(self.__seconds - per_byte * self.__size, 0.0)
+            return latency, per_byte
+
+    def estimate(self, size: int) -> float:
+        """Expected seconds of an operation on an object of `size` bytes"""
+        latency, per_byte = self.fit()
+        return latency + per_byte * size
+
+    def snapshot(self) -> Dict[str, float]:
+        latency, per_byte = self.fit()
+        return {
+            "samples": self.samples,
+            "latency": latency,
+            "throughput": 1 / per_byte if per_byte else float("inf"),
+        }
+
+
+class Decision:
+    """Tier of a key, with the expected access costs it was chosen from and why"""
+
+    __slots__ = (
+        "tier",
+        "size",
+        "rate",
+        "costs",
+        "reason",
+        "displaced",
+        "estimate",
+        "last",
+    )
+
+    def __init__(
+        self,
+        tier: str,
+        size: int,
+        rate: float,
+        costs: Dict[str, float],
+        reason: str,
+        displaced: Dict[str, str] | None = None,
+    ) -> None:
+        self.tier = tier
+        self.size = size
+        self.rate = rate
+        self.costs = costs
+        self.reason = reason
+        # keys moved out of the tier to make room for this one, with their new tier
+        self.displaced = displaced or {}
+        # access rate estimated from the reads, decayed since `last`
+        self.estimate = rate
+        self.last = 0.0
+
+
+class CostModel:
+    """Placement of keys minimizing their expected access cost under tier capacities
+
+    The expected access cost of a key in a tier is its access rate times the estimated
+    latency of the tier for its size (`LatencyModel`), measured from the operations of the
+    tiers with `observe`. A key goes to the cheapest tier with enough free space. When
+    that tier is full, the keys of the tier saving the least per byte (access rate times
+    the latency saved over the slowest tier, divided by their size) are moved to their
+    next cheapest tier with room, if they save less per byte than the new key.
+
+    The access rate given to `place` is in reads per hour, and is only the initial
+    estimate of the key: each read counted with `hit` updates it, the reads decaying
+    exponentially with a `half_life` in seconds, so that the estimate converges to the
+    measured rate. `stale` tells whether a key may belong to another tier since its
+    placement, for its caller to place it again.
+
+    `place` only computes a `Decision`, which is applied with `apply` once the data is
+    written, the keys it displaces being recorded in their new tier one by one with
+    `move`, and `explain` tells why a key is in its tier.
+
+    Args:
+        capacities (Dict[str, int | None] | None, optional): capacity of the tiers in bytes, a tier missing or None being unbounded. Defaults to None.
+        priors (Dict[str, Tuple[float, float]], optional): prior latency and throughput of the tiers, in their order of preference on ties. Defaults to `PRIORS`.
+        alpha (float, optional): weight of the last operation in the estimates. Defaults to 0.05.
+        min_samples (int, optional): operations measured before trusting an estimate. Defaults to 10.
+        half_life (float, optional): half-life of the reads in the access rates, in seconds. Defaults to 3600.
+        clock (Callable[[], float], optional): time in seconds. Defaults to `time.monotonic`.
+    """
+
+    def __init__(
+        self,
+        capacities: Dict[str, int | None] | None = None,
+        priors: Dict[str, Tuple[float, float]] = PRIORS,
+        alpha: float = 0.05,
+        min_samples: int = 10,
+        half_life: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.tiers = list(priors)
+        self.capacities = {tier: (capacities or {}).get(tier) for tier in self.tiers}
+        self.models = {
+            tier: LatencyModel(latency, throughput, alpha, min_samples)
+            for tier, (latency, throughput) in priors.items()
+        }
+        self.used = {tier: 0 for tier in self.tiers}
+        self.half_life = half_life
+        self.clock = clock
+        self.__decay = math.log(2) / half_life
+        # a read adds the rate, in reads per hour, it sustains over the mean lifetime
+        self.__per_read = 3600 * self.__decay
+        self.__decisions: Dict[str, Decision] = {}
+        self.__lock = threading.RLock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__decisions
+
+    def get(self, key: str) -> Decision | None:
+        return self.__decisions.get(key)
+
+    def items(self) -> List[Tuple[str, Decision]]:
+        with self.__lock:
+            return list(self.__decisions.items())
+
+    def observe(self, tier: str, size: int, seconds: float) -> None:
+        self.models[tier].observe(size, seconds)
+
+    def costs(self, rate: float, size: int) -> Dict[str, float]:
+        """Expected access cost of a key in each tier"""
+        return {
+            tier: rate * model.estimate(size) for tier, model in self.models.items()
+        }
+
+    def place(self, key: str, size: int, rate: float) -> Decision:
+        """Tier of a new or rewritten key, raising IOError if no tier has room"""
+        with self.__lock:
+            costs = self.costs(rate, size)
+            previous = self.__decisions.get(key)
+            skipped: List[str] = []
+            for tier in sorted(self.tiers, key=costs.get):
+                free = self.__free(tier)
+                if previous is not None and previous.tier == tier:
+                    free += previous.size
+                if size <= free:
+                    reason = self.__reason(tier, costs, skipped, "with room")
+                    return Decision(tier, size, rate, costs, reason)
+                displaced = self.__displace(key, tier, size - free, rate, size)
+                if displaced is not None:
+                    detail = f"after moving {len(displaced)} key(s) out"
+                    reason = self.__reason(tier, costs, skipped, detail)
+                    return Decision(tier, size, rate, costs, reason, displaced)
+                skipped.append(tier)
+            raise IOError(f"no tier has room for {key} ({size} bytes)")
+
+    def apply(self, key: str, decision: Decision) -> Decision | None:
+        """Record the tier of the key and of the keys it displaced, return its previous one"""
+        with self.__lock:
+            previous = self.forget(key)
+            for displaced, tier in decision.displaced.items():
+                self.move(displaced, tier, key)
+            decision.last = self.clock()
+            self.__decisions[key] = decision
+            self.used[decision.tier] += decision.size
+        return previous
+
+    def move(self, key: str, tier: str, by: str) -> None:
+        """Record that the key was moved to `tier` to make room for the key `by`"""
+        with self.__lock:
+            entry = self.__decisions.get(key)
+            if entry is None or entry.tier == tier:
+                return
+            self.used[entry.tier] -= entry.size
+            self.used[tier] += entry.size
+            entry.tier = tier
+            entry.reason = f"{tier}: moved out of the tier by {by}"
+
+    def hit(self, key: str) -> Decision | None:
+        """Count a read of the key in its access rate, None if it is not placed"""
+        with self.__lock:
+            decision = self.__decisions.get(key)
+            if decision is not None:
+                decision.estimate = self.rate(decision) + self.__per_read
+                decision.last = self.clock()
+        return decision
+
+    def rate(self, decision: Decision) -> float:
+        """Access rate of a placed key estimated from its reads, in reads per hour"""
+        elapsed = self.clock() - decision.last
+        return decision.estimate * math.exp(-self.__decay * elapsed)
+
+    def stale(self, decision: Decision, hysteresis: float = 0.2) -> bool:
+        """Whether the key may belong to another tier since its placement
+
+        That is when its estimated access rate moved away from its rate when placed by
+        more than `hysteresis`, or when the tier of lowest expected access cost changed
+        with the latency estimates.
+        """
+        rate = self.rate(decision)
+        bound = 1 + hysteresis
+        if not decision.rate / bound <= rate <= decision.rate * bound:
+            return True
+        costs = self.costs(rate, decision.size)
+        return min(self.tiers, key=costs.get) != min(
+            self.tiers, key=decision.costs.get
+        )
+
+    def forget(self, key: str) -> Decision | None:
+        with self.__lock:
+            decision = self.__decisions.pop(key, None)
+            if decision is not None:
+                self.used[decision.tier] -= decision.size
+        return decision
+
+    def explain(self, key: str) -> Dict[str, Any]:
+        """Tier of the key, its expected costs when placed and now, and why it is there"""
+        decision = self.__decisions.get(key)
+        if decision is None:
+            raise FileNotFoundError(key)
+        return {
+            "tier": decision.tier,
+            "size": decision.size,
+            "rate": decision.rate,
+            "current_rate": self.rate(decision),
+            "reason": decision.reason,
+            "costs": dict(decision.costs),
+            "current_costs": self.costs(self.rate(decision), decision.size),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            tier: {
+                **self.models[tier].snapshot(),
+                "used": self.used[tier],
+                "capacity": self.capacities[tier],
+            }
+            for tier in self.tiers
+        }
+
+    def __free(self, tier: str) -> float:
+        capacity = self.capacities[tier]
+        return float("inf") if capacity is None else capacity - self.used[tier]
+
+    def __density(self, tier: str, rate: float, size: int) -> float:
+        """Expected cost saved per byte by a key in the tier, over the slowest tier"""
+        estimates = [model.estimate(size) for model in self.models.values()]
+        saved = max(estimates) - self.models[tier].estimate(size)
+        return rate * saved / max(size, 1)
+
+    def __displace(
+        self, key: str, tier: str, needed: int, rate: float, size: int
+    ) -> Dict[str, str] | None:
+        """Keys to move out of a full tier with their new tier, None if not worth it"""
+        density = self.__density(tier, rate, size)
+        residents = [
+            (self.__density(tier, self.rate(entry), entry.size), resident, entry)
+            for resident, entry in self.__decisions.items()
+            if entry.tier == tier and resident != key
+        ]
+        residents.sort(key=lambda resident: resident[0])
+        displaced: Dict[str, str] = {}
+        # space taken in the other tiers by the displaced keys
+        taken = {other: 0 for other in self.tiers}
+        for resident_density, resident, entry in residents:
+            if needed <= 0:
+                break
+            if resident_density >= density:
+                return None
+            target = self.__fallback(tier, entry, taken)
+            if target is None:
+                return None
+            displaced[resident] = target
+            taken[target] += entry.size
+            needed -= entry.size
+        return displaced if needed <= 0 else None
+
+    def __fallback(
+        self, tier: str, entry: Decision, taken: Dict[str, int]
+    ) -> str | None:
+        costs = self.costs(self.rate(entry), entry.size)
+        for other in sorted(self.tiers, key=costs.get):
+            if other != tier and entry.size <= self.__free(other) - taken[other]:
+                return other
+        return None
+
+    def __reason(
+        self, tier: str, costs: Dict[str, float], skipped: Iterable[str], detail: str
+    ) -> str:
+        cost = costs[tier]
+        reason = f"{tier}: cheapest tier {detail}, expected access cost {cost:.3g}"
+        full = ", ".join(f"{other} ({costs[other]:.3g})" for other in skipped)
+        return f"{reason}, cheaper tiers full: {full}" if full else reason
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Iterable, Iterator, List, Set
+from urllib.parse import quote, unquote
+
+# `quote` never produces "%%", so these names cannot clash with a key
+TMP_PREFIX = "%%tmp-"
+HASHED_PREFIX = "%%"
+# longest file name kept readable, most filesystems allow 255 bytes
+MAX_NAME = 200
+
+
+class ShardedLayout:
+    """Layout of the files of a cache root, fanned out into hashed subdirectories
+
+    A key is stored in `<root>/<h0>/<h1>/<name>`, `h0` and `h1` being bytes of its hash in
+    hex (`levels` subdirectories of 256), so that each directory stays small with millions
+    of keys. The name is the key quoted for the filesystem, so the keys can be recovered by
+    scanning the root, except for the keys longer than `MAX_NAME`, stored under their hash.
+
+    Args:
+        root (str): root directory of the cache
+        levels (int, optional): levels of subdirectories. Defaults to 2.
+    """
+
+    def __init__(self, root: str, levels: int = 2) -> None:
+        self.root = root
+        self.levels = levels
+        self.log = logging.getLogger("ShardedLayout")
+        self.__directories: Set[str] = set()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        name = quote(key, safe="")
+        if name in (".", ".."):
+            name = name.replace(".", "%2E")
+        elif len(name) > MAX_NAME:
+            name = HASHED_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+        shards = [digest[2 * level : 2 * level + 2] for level in range(self.levels)]
+        return os.path.join(self.root, *shards, name)
+
+    def directory(self, key: str) -> str:
+        """Directory of the key, created if needed"""
+        directory = os.path.dirname(self.path(key))
+        if directory not in self.__directories:
+            os.makedirs(directory, exist_ok=True)
+            self.__directories.add(directory)
+        return directory
+
+    @staticmethod
+    def key(path: str) -> str | None:
+        """Key of a file of the layout, None for a hashed name or a temporary file"""
+        name = os.path.basename(path)
+        if name.startswith(HASHED_PREFIX):
+            return None
+        return unquote(name)
+
+    def files(self) -> Iterator[os.DirEntry]:
+        """Files of the layout, temporary files included"""
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        yield entry
+
+    def clean(self) -> int:
+        """Remove the temporary files left by interrupted writes"""
+        removed = 0
+        for entry in self.files():
+            if entry.name.startswith(TMP_PREFIX):
+                os.remove(entry.path)
+                removed += 1
+        if removed:
+            self.log.info("clean - %s temporary files removed", removed)
+        return removed
+
+
+class AtomicWriter:
+    """Write files atomically, with a temporary file renamed over the target
+
+    Readers see either the previous file or the new one, never a partial file, and a
+    crash leaves at most a temporary file (see `ShardedLayout.clean`).
+
+    The durability is chosen with `fsync_every`: 0 never syncs, leaving it to the system,
+    1 syncs each file before its rename and its directory after, and n > 1 syncs the files
+    and their directories by batches of n writes (or on `sync()`), so a crash can only lose
+    or truncate the writes of the current batch.
+
+    Args:
+        fsync_every (int, optional): number of writes per fsync batch, 0 for none. Defaults to 0.
+    """
+
+    def __init__(self, fsync_every: int = 0) -> None:
+        self.fsync_every = fsync_every
+        self.__pending: List[str] = []
+        self.__lock = threading.Lock()
+
+    def write(self, path: str, chunks: Iterable) -> int:
+        """Write the chunks to `path` and return the number of bytes written"""
+        directory = os.path.dirname(path) or "."
+        fd, tmp = tempfile.mkstemp(prefix=TMP_PREFIX, dir=directory)
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    size += file.write(chunk)
+                if self.fsync_every == 1:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        if self.fsync_every == 1:
+            fsync_directory(directory)
+        elif self.fsync_every > 1:
+            with self.__lock:
+                self.__pending.append(path)
+                batch = len(self.__pending) >= self.fsync_every
+            if batch:
+                self.sync()
+        return size
+
+    def sync(self) -> None:
+        """fsync the files written since the last batch, and their directories"""
+        with self.__lock:
+            paths, self.__pending = self.__pending, []
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for directory in {os.path.dirname(path) or "." for path in paths}:
+            fsync_directory(directory)
+
+
+def fsync_directory(directory: str) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
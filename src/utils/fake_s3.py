@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import io
+import itertools
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from botocore.exceptions import ClientError
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _error(code: str, operation: str, message: str = "") -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client used by `AWSS3`
+
+    It supports `put_object`, `get_object` (with `Range` and `IfMatch`), `head_object`,
+    `list_objects_v2` (with `Prefix`, `Delimiter` and pages), `delete_object`,
+    `delete_objects` and the multipart uploads, and raises the same `ClientError` codes as
+    S3. A `latency` in seconds can be injected before each request,
+    and `calls` counts the requests per operation.
+
+    Args:
+        latency (float, optional): seconds to wait before each request. Defaults to 0.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.buckets: Dict[str, Dict[str, Tuple[bytes, str]]] = {}
+        self.calls: Dict[str, int] = {}
+        self.__uploads: Dict[str, Dict[int, Tuple[bytes, str]]] = {}
+        self.__ids = itertools.count()
+        self.__lock = threading.Lock()
+
+    def __request(self, operation: str) -> None:
+        with self.__lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def __object(self, operation: str, bucket: str, key: str) -> Tuple[bytes, str]:
+        obj = self.buckets.get(bucket, {}).get(key)
+        if obj is None:
+            raise _error("NoSuchKey", operation, key)
+        return obj
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", **kwargs) -> Dict:
+        self.__request("PutObject")
+        data = Body.read() if hasattr(Body, "read") else bytes(Body)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        with self.__lock:
+            self.buckets.setdefault(Bucket, {})[Key] = (data, etag)
+        return {"ETag": etag}
+
+    def get_object(
+        self, Bucket: str, Key: str, Range: str | None = None, IfMatch: str | None = None
+    ) -> Dict:
+        self.__request("GetObject")
+        data, etag = self.__object("GetObject", Bucket, Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise _error("PreconditionFailed", "GetObject", Key)
+        response = {"ETag": etag, "ContentLength": len(data)}
+        if Range is not None:
+            start, _, end = Range.removeprefix("bytes=").partition("-")
+            start = int(start)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                raise _error("InvalidRange", "GetObject", Range)
+            response["ContentRange"] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start : end + 1]
+            response["ContentLength"] = len(data)
+        response["Body"] = io.BytesIO(data)
+        return response
+
+    def head_object(self, Bucket: str, Key: str) -> Dict:
+        self.__request("HeadObject")
+        try:
+            data, etag = self.__object("HeadObject", Bucket, Key)
+        except ClientError:
+            raise _error("404", "HeadObject", Key)
+        return {"ETag": etag, "ContentLength": len(data)}
+
+    def list_objects_v2(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        Delimiter: str | None = None,
+        MaxKeys: int = 1000,
+        ContinuationToken: str | None = None,
+        StartAfter: str = "",
+    ) -> Dict:
+        self.__request("ListObjectsV2")
+        with self.__lock:
+            keys = sorted(self.buckets.get(Bucket, {}))
+        after = ContinuationToken if ContinuationToken is not None else StartAfter
+        contents: List[Dict] = []
+        prefixes: List[str] = []
+        last = None
+        truncated = False
+        for key in keys:
+            if key <= after or not key.startswith(Prefix):
+                continue
+            common = None
+            if Delimiter:
+                index = key.find(Delimiter, len(Prefix))
+                if index >= 0:
+                    common = key[: index + len(Delimiter)]
+            if common is not None and prefixes and prefixes[-1] == common:
+                last = key
+                continue
+            if len(contents) + len(prefixes) == MaxKeys:
+                truncated = True
+                break
+            if common is not None:
+                prefixes.append(common)
+            else:
+                data, etag = self.buckets[Bucket][key]
+                contents.append({"Key": key, "Size": len(data), "ETag": etag})
+            last = key
+        page = {
+            "Prefix": Prefix,
+            "KeyCount": len(contents) + len(prefixes),
+            "MaxKeys": MaxKeys,
+            "IsTruncated": truncated,
+            "Contents": contents,
+            "CommonPrefixes": [{"Prefix": prefix} for prefix in prefixes],
+        }
+        if truncated:
+            page["NextContinuationToken"] = last
+        return page
+
+    def delete_object(self, Bucket: str, Key: str) -> Dict:
+        self.__request("DeleteObject")
+        with self.__lock:
+            self.buckets.get(Bucket, {}).pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict) -> Dict:
+        self.__request("DeleteObjects")
+        if len(Delete["Objects"]) > 1000:
+            raise _error("MalformedXML", "DeleteObjects")
+        with self.__lock:
+            for obj in Delete["Objects"]:
+                self.buckets.get(Bucket, {}).pop(obj["Key"], None)
+        return {}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        self.__request("CreateMultipartUpload")
+        upload_id = f"upload-{next(self.__ids)}"
+        with self.__lock:
+            self.__uploads[upload_id] = {}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(
+        self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body
+    ) -> Dict:
+        self.__request("UploadPart")
+        data = Body.read() if hasattr(Body, "read") else bytes(Body)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        with self.__lock:
+            if UploadId not in self.__uploads:
+                raise _error("NoSuchUpload", "UploadPart", UploadId)
+            self.__uploads[UploadId][PartNumber] = (data, etag)
+        return {"ETag": etag}
+
+    def complete_multipart_upload(
+        self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict
+    ) -> Dict:
+        self.__request("CompleteMultipartUpload")
+        with self.__lock:
+            uploaded = self.__uploads.pop(UploadId, None)
+        if uploaded is None:
+            raise _error("NoSuchUpload", "CompleteMultipartUpload", UploadId)
+        parts: List[bytes] = []
+        digests = b""
+        requested = MultipartUpload["Parts"]
+        for index, part in enumerate(requested):
+            data, etag = uploaded.get(part["PartNumber"], (None, None))
+            if etag is None or etag != part["ETag"]:
+                raise _error("InvalidPart", "CompleteMultipartUpload")
+            if index < len(requested) - 1 and len(data) < MIN_PART_SIZE:
+                raise _error("EntityTooSmall", "CompleteMultipartUpload")
+            parts.append(data)
+            digests += bytes.fromhex(etag.strip('"'))
+        etag = '"%s-%d"' % (hashlib.md5(digests).hexdigest(), len(parts))
+        with self.__lock:
+            self.buckets.setdefault(Bucket, {})[Key] = (b"".join(parts), etag)
+        return {"ETag": etag}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> Dict:
+        self.__request("AbortMultipartUpload")
+        with self.__lock:
+            self.__uploads.pop(UploadId, None)
+        return {}
+
+
+class AsyncBody:
+    """Streaming body of the `AsyncFakeS3Client` responses, like aiobotocore's"""
+
+    def __init__(self, body: io.BytesIO) -> None:
+        self.__body = body
+
+    async def read(self, amt: int | None = None) -> bytes:
+        return self.__body.read(amt)
+
+    async def __aenter__(self) -> "AsyncBody":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.__body.close()
+
+
+class AsyncFakeS3Client:
+    """asyncio counterpart of `FakeS3Client`, used by `AsyncAWSS3` as an aiobotocore one
+
+    It has the operations of `FakeS3Client` as coroutines, on the same objects and
+    `calls`, with the response bodies read with `await body.read()`. The `latency` is
+    waited on the event loop, so the concurrent requests overlap without threads, and
+    `peak` records the most requests in flight at once.
+
+    Args:
+        latency (float, optional): seconds to wait before each request. Defaults to 0.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.sync = FakeS3Client()
+        self.buckets = self.sync.buckets
+        self.calls = self.sync.calls
+        self.in_flight = 0
+        self.peak = 0
+
+    def __getattr__(self, operation: str):
+        method = getattr(self.sync, operation)
+
+        async def request(**kwargs) -> Dict:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                response = method(**kwargs)
+            finally:
+                self.in_flight -= 1
+            if "Body" in response:
+                response["Body"] = AsyncBody(response["Body"])
+            return response
+
+        return request
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,285 @@
+import itertools
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# name of the journal in a cache root, ignored by `ShardedLayout` like its temporary files
+JOURNAL = "%%journal"
+MAGIC = b"LRUJRNL2"
+SNAPSHOT = struct.Struct("<Q")  # number of entries of the snapshot
+CREATE = struct.Struct("!cHQd")  # op, key length, size, deadline (unix time, 0 for none)
+OTHER = struct.Struct("!cH")  # op, key length
+CREATED = b"C"
+TOUCHED = b"T"
+DELETED = b"D"
+
+Entries = Dict[str, Tuple[int, float]]
+
+
+class LRUJournal:
+    """Append-only journal of the entries of an LRU cache, to rebuild it after a restart
+
+    The journal starts with a snapshot of the entries, from the least to the most recently
+    used: their number (`SNAPSHOT`), then the arrays of the lengths of their keys, of their
+    sizes and of their deadlines, then their keys, so that it is loaded without parsing
+    each entry. Each create, read hit and delete then appends a small binary record
+    (`CREATE` or `OTHER` followed by the key), replayed over the snapshot. A torn record at
+    the end, left by a crash, is ignored.
+
+    When the journal has more than `compact_factor` records per live entry, it is due for
+    a compaction by `compact_if_due`: rewritten atomically with one record per entry, in
+    the recency order given by `order`. The cache calls it outside of its own locks, as
+    `order` needs them.
+
+    The records of the creates and deletes are flushed at once, those of the reads every
+    `flush_every` reads: a crash only loses some recency updates.
+
+    Args:
+        path (str): path of the journal file
+        order (Callable[[], Iterable[str]]): keys of the cache from the least to the most recently used
+        compact_factor (int, optional): records per entry triggering a compaction. Defaults to 4.
+        min_records (int, optional): records below which the journal is not compacted. Defaults to 4096.
+        flush_every (int, optional): read records buffered before a flush. Defaults to 256.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        order: Callable[[], Iterable[str]],
+        compact_factor: int = 4,
+        min_records: int = 4096,
+        flush_every: int = 256,
+    ) -> None:
+        self.path = path
+        self.order = order
+        self.compact_factor = compact_factor
+        self.min_records = min_records
+        self.flush_every = flush_every
+        self.log = logging.getLogger("LRUJournal")
+        self.__entries: Entries = {}
+        self.__records = 0
+        self.__valid = 0
+        self.__snapshot_end = 0
+        self.__due = False
+        self.__unflushed = 0
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    def load(self) -> Entries | None:
+        """Replay the journal, or return None if there is no valid journal"""
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(MAGIC):
+            self.log.warning("load - %s is not a journal", self.path)
+            return None
+        entries = self.__snapshot(data)
+        if entries is None:
+            self.log.warning("load - %s has a torn snapshot", self.path)
+            return None
+        offset = self.__snapshot_end
+        end = len(data)
+        records = 0
+        unpack_create = CREATE.unpack_from
+        unpack_other = OTHER.unpack_from
+        pop = entries.pop
+        while offset < end:
+            op = data[offset]
+            if op == CREATED[0]:
+                if offset + CREATE.size > end:
+                    break
+                _, length, size, deadline = unpack_create(data, offset)
+                start = offset + CREATE.size
+            elif op == TOUCHED[0] or op == DELETED[0]:
+                if offset + OTHER.size > end:
+                    break
+                _, length = unpack_other(data, offset)
+                start = offset + OTHER.size
+            else:
+                break
+            if start + length > end:
+                break
+            offset = start + length
+            key = data[start:offset].decode()
+            records += 1
+            # popping and inserting again moves the key to the end of the dict
+            entry = pop(key, None)
+            if op == CREATED[0]:
+                entries[key] = (size, deadline)
+            elif op == TOUCHED[0] and entry is not None:
+                entries[key] = entry
+        if offset < end:
+            self.log.warning("load - torn journal, %s bytes ignored", end - offset)
+        self.log.debug("load - %s records, %s entries", records, len(entries))
+        self.__records = records
+        self.__valid = offset
+        return entries
+
+    def open(self, entries: Entries, compact: bool = True) -> None:
+        """Start journaling from the entries of the cache
+
+        Without `compact`, the entries must be the ones just loaded, and the records are
+        appended to the journal after its last valid record.
+        """
+        with self.__lock:
+            self.__entries = entries
+            if not compact and self.__valid:
+                self.__file = open(self.path, "r+b")
+                self.__file.truncate(self.__valid)
+                self.__file.seek(self.__valid)
+                self.__due = self.__records > max(
+                    self.min_records, self.compact_factor * len(entries)
+                )
+                return
+        self.compact()
+
+    def compact(self) -> None:
+        order = list(self.order())
+        with self.__lock:
+            self.__compact(order)
+
+    def compact_if_due(self) -> None:
+        if self.__due:
+            self.compact()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def flush(self) -> None:
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.flush()
+                self.__unflushed = 0
+
+    def created(self, key: str, size: int, ttl: float | None = None) -> None:
+        deadline = time.time() + ttl if ttl else 0.0
+        encoded = key.encode()
+        with self.__lock:
+            self.__entries[key] = (size, deadline)
+            self.__append(CREATE.pack(CREATED, len(encoded), size, deadline) + encoded)
+            self.__file.flush()
+
+    def touched(self, key: str) -> None:
+        encoded = key.encode()
+        with self.__lock:
+            if key not in self.__entries:
+                return
+            self.__append(OTHER.pack(TOUCHED, len(encoded)) + encoded)
+            self.__unflushed += 1
+            if self.__unflushed >= self.flush_every:
+                self.__file.flush()
+                self.__unflushed = 0
+
+    def deleted(self, key: str) -> None:
+        encoded = key.encode()
+        with self.__lock:
+            if self.__entries.pop(key, None) is None:
+                return
+            self.__append(OTHER.pack(DELETED, len(encoded)) + encoded)
+            self.__file.flush()
+
+    def __append(self, record: bytes) -> None:
+        self.__file.write(record)
+        self.__records += 1
+        self.__due = self.__records > max(
+            self.min_records, self.compact_factor * len(self.__entries)
+        )
+
+    def __snapshot(self, data: bytes) -> Entries | None:
+        offset = len(MAGIC) + SNAPSHOT.size
+        if len(data) < offset:
+            return None
+        (count,) = SNAPSHOT.unpack_from(data, len(MAGIC))
+        lengths = array("H")
+        sizes = array("Q")
+        deadlines = array("d")
+        for values in (lengths, sizes, deadlines):
+            end = offset + count * values.itemsize
+            values.frombytes(data[offset:end])
+            if sys.byteorder == "big":
+                values.byteswap()
+            offset = end
+        bounds = list(itertools.accumulate(lengths, initial=offset))
+        if len(data) < bounds[-1]:
+            return None
+        self.__snapshot_end = bounds[-1]
+        blob = data[offset : bounds[-1]]
+        if blob.isascii():
+            text = blob.decode("ascii")
+            keys = [text[start - offset : end - offset] for start, end in zip(bounds, bounds[1:])]
+        else:
+            keys = [data[start:end].decode() for start, end in zip(bounds, bounds[1:])]
+        return dict(zip(keys, zip(sizes, deadlines)))
+
+    def __compact(self, order: List[str]) -> None:
+        start = time.perf_counter()
+        if self.__file is not None:
+            self.__file.close()
+        tmp = self.path + ".tmp"
+        entries = self.__entries
+        # the entries created since `order` was listed are the most recent ones
+        created = entries.keys() - set(order)
+        keys = [key for key in itertools.chain(order, created) if key in entries]
+        encoded = [key.encode() for key in keys]
+        arrays = (
+            array("H", map(len, encoded)),
+            array("Q", (entries[key][0] for key in keys)),
+            array("d", (entries[key][1] for key in keys)),
+        )
+        with open(tmp, "wb") as file:
+            file.write(MAGIC + SNAPSHOT.pack(len(keys)))
+            for values in arrays:
+                if sys.byteorder == "big":
+                    values.byteswap()
+                file.write(values.tobytes())
+            file.write(b"".join(encoded))
+        os.replace(tmp, self.path)
+        self.__file = open(self.path, "ab")
+        self.__records = 0
+        self.__due = False
+        self.log.debug(
+            "compact - %s entries in %.3fs", len(keys), time.perf_counter() - start
+        )
+
+
+if __name__ == "__main__":
+    # startup time of a persistent FileSystem_LRU with 1M entries, from a compacted
+    # journal and from a journal of records only
+    # run from the src directory: python -m utils.journal
+    import tempfile
+
+    from utils.LRU_storage import FileSystem_LRU
+
+    count = 1_000_000
+    keys = [f"images/{i:07}.jpg" for i in range(count)]
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, JOURNAL)
+        journal = LRUJournal(path, lambda: keys)
+        journal.open({key: (100_000, 0.0) for key in keys})
+        journal.close()
+        print(f"snapshot: {os.path.getsize(path) / 1e6:.1f}MB")
+        start = time.perf_counter()
+        cache = FileSystem_LRU(None, root=root, persistent=True)
+        print(f"startup with {len(cache.lru)} entries: {time.perf_counter() - start:.2f}s")
+        cache.close()
+
+        with open(path, "wb") as file:
+            file.write(MAGIC + SNAPSHOT.pack(0))
+            for key in keys:
+                encoded = key.encode()
+                file.write(CREATE.pack(CREATED, len(encoded), 100_000, 0.0) + encoded)
+        print(f"records: {os.path.getsize(path) / 1e6:.1f}MB")
+        start = time.perf_counter()
+        cache = FileSystem_LRU(None, root=root, persistent=True)
+        print(f"startup with {len(cache.lru)} entries: {time.perf_counter() - start:.2f}s")
+        cache.close()
@@ -0,0 +1,238 @@
+import logging
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, Set, Tuple
+
+# memcached treats the expiry times above 30 days as unix timestamps
+RELATIVE_EXPIRY_LIMIT = 60 * 60 * 24 * 30
+
+
+class MemcachedServer(socketserver.ThreadingTCPServer):
+    """In-process memcached stand-in speaking the text protocol
+
+    It supports `get`, `gets`, `set`, `add`, `replace`, `delete`, `touch`, `flush_all`,
+    `stats`, `version` and `quit`, which is enough for the memcache clients used by the
+    storages, and rejects the items larger than `item_size_max` like memcached. A `latency`
+    in seconds can be injected before each response.
+
+    The server runs in a daemon thread between `start()` and `stop()`, and can also be used
+    as a context manager.
+
+    Args:
+        host (str, optional): address to listen on. Defaults to "127.0.0.1".
+        port (int, optional): port to listen on, 0 for a free port. Defaults to 0.
+        item_size_max (int, optional): maximum size of a value. Defaults to 1MB.
+        limit_maxbytes (int, optional): value reported by `stats`. Defaults to 64MB.
+        latency (float, optional): seconds to wait before each response. Defaults to 0.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        item_size_max: int = 1024 * 1024,
+        limit_maxbytes: int = 64 * 1024 * 1024,
+        latency: float = 0.0,
+    ) -> None:
+        super().__init__((host, port), MemcachedHandler)
+        self.item_size_max = item_size_max
+        self.limit_maxbytes = limit_maxbytes
+        self.latency = latency
+        self.items: Dict[bytes, Tuple[int, bytes, float]] = {}
+        self.lock = threading.Lock()
+        self.connections: Set[socket.socket] = set()
+        self.stats = {"get_hits": 0, "get_misses": 0, "cmd_get": 0, "cmd_set": 0}
+        self.log = logging.getLogger("MemcachedServer")
+        self.__thread: threading.Thread | None = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "MemcachedServer":
+        self.__thread = threading.Thread(
+            target=self.serve_forever, name=f"memcached-{self.address}", daemon=True
+        )
+        self.__thread.start()
+        self.log.debug("start - listening on %s", self.address)
+        return self
+
+    def stop(self) -> None:
+        """Stop the server and close the client connections, like a crashed node"""
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.__thread is not None:
+            self.__thread.join()
+        self.log.debug("stop - %s", self.address)
+
+    def __enter__(self) -> "MemcachedServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def lookup(self, key: bytes) -> Tuple[int, bytes, float] | None:
+        item = self.items.get(key)
+        if item is not None and item[2] and item[2] <= time.time():
+            del self.items[key]
+            return None
+        return item
+
+    @staticmethod
+    def expires(exptime: int) -> float:
+        if exptime <= 0:
+            return 0
+        if exptime > RELATIVE_EXPIRY_LIMIT:
+            return exptime
+        return time.time() + exptime
+
+
+class MemcachedHandler(socketserver.StreamRequestHandler):
+    """Handler of a client connection of the `MemcachedServer`"""
+
+    server: MemcachedServer
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self) -> None:
+        with self.server.lock:
+            self.server.connections.discard(self.connection)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def handle(self) -> None:
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command = parts[0].lower()
+            if command == b"quit":
+                return
+            handler = getattr(self, f"_cmd_{command.decode(errors='replace')}", None)
+            if handler is None:
+                self.__reply(b"ERROR\r\n")
+                continue
+            try:
+                response = handler(parts[1:])
+            except (IndexError, ValueError):
+                response = b"CLIENT_ERROR bad command line format\r\n"
+            if response is not None:
+                self.__reply(response)
+
+    def __reply(self, response: bytes) -> None:
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(response)
+        self.wfile.flush()
+
+    def _cmd_get(self, keys, cas: bool = False) -> bytes:
+        server = self.server
+        out = []
+        with server.lock:
+            server.stats["cmd_get"] += len(keys)
+            for key in keys:
+                item = server.lookup(key)
+                if item is None:
+                    server.stats["get_misses"] += 1
+                    continue
+                server.stats["get_hits"] += 1
+                flags, value, _ = item
+                header = b"VALUE %s %d %d" % (key, flags, len(value))
+                if cas:
+                    header += b" %d" % (hash(value) & 0xFFFFFFFF)
+                out.append(header + b"\r\n" + value + b"\r\n")
+        out.append(b"END\r\n")
+        return b"".join(out)
+
+    def _cmd_gets(self, keys) -> bytes:
+        return self._cmd_get(keys, cas=True)
+
+    def __store(self, args, mode: bytes) -> bytes | None:
+        key, flags, exptime, length = args[0], int(args[1]), int(args[2]), int(args[3])
+        noreply = len(args) > 4 and args[4] == b"noreply"
+        value = self.rfile.read(length + 2)[:length]
+        server = self.server
+        if length > server.item_size_max:
+            response = b"SERVER_ERROR object too large for cache\r\n"
+        else:
+            with server.lock:
+                server.stats["cmd_set"] += 1
+                exists = server.lookup(key) is not None
+                if (mode == b"add" and exists) or (mode == b"replace" and not exists):
+                    response = b"NOT_STORED\r\n"
+                else:
+                    server.items[key] = (flags, value, server.expires(exptime))
+                    response = b"STORED\r\n"
+        return None if noreply else response
+
+    def _cmd_set(self, args) -> bytes | None:
+        return self.__store(args, b"set")
+
+    def _cmd_add(self, args) -> bytes | None:
+        return self.__store(args, b"add")
+
+    def _cmd_replace(self, args) -> bytes | None:
+        return self.__store(args, b"replace")
+
+    def _cmd_delete(self, args) -> bytes | None:
+        server = self.server
+        with server.lock:
+            found = server.lookup(args[0]) is not None
+            server.items.pop(args[0], None)
+        if args[-1] == b"noreply":
+            return None
+        return b"DELETED\r\n" if found else b"NOT_FOUND\r\n"
+
+    def _cmd_touch(self, args) -> bytes | None:
+        server = self.server
+        with server.lock:
+            item = server.lookup(args[0])
+            if item is not None:
+                server.items[args[0]] = (item[0], item[1], server.expires(int(args[1])))
+        if args[-1] == b"noreply":
+            return None
+        return b"TOUCHED\r\n" if item is not None else b"NOT_FOUND\r\n"
+
+    def _cmd_flush_all(self, args) -> bytes | None:
+        with self.server.lock:
+            self.server.items.clear()
+        if args and args[-1] == b"noreply":
+            return None
+        return b"OK\r\n"
+
+    def _cmd_version(self, args) -> bytes:
+        return b"VERSION 1.6.0-stand-in\r\n"
+
+    def _cmd_stats(self, args) -> bytes:
+        server = self.server
+        if args:
+            return b"END\r\n"
+        with server.lock:
+            stats = dict(server.stats)
+            stats["curr_items"] = len(server.items)
+            stats["bytes"] = sum(len(item[1]) for item in server.items.values())
+        stats["limit_maxbytes"] = server.limit_maxbytes
+        stats["item_size_max"] = server.item_size_max
+        lines = [b"STAT %s %d\r\n" % (name.encode(), value) for name, value in stats.items()]
+        return b"".join(lines) + b"END\r\n"
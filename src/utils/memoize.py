@@ -0,0 +1,228 @@
+import functools
+import hashlib
+import inspect
+import logging
+import math
+import random
+import struct
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from memcache import Client
+from utils.LRU import ShardedLRU
+from utils.serializer import Serializer
+from utils.single_flight import MemcachedLease
+
+# logical expiry (epoch seconds, 0 if none) and duration of the computation in seconds,
+# before the serialized value
+HEADER = struct.Struct("!dd")
+
+
+class Entry:
+    """Memoized value, with its logical expiry and the time it took to compute"""
+
+    __slots__ = ("value", "expires", "delta")
+
+    def __init__(self, value: Any, expires: float, delta: float) -> None:
+        self.value = value
+        self.expires = expires
+        self.delta = delta
+
+
+class Memoized:
+    """Function whose results are cached in memcached, see `memcached_memoize`"""
+
+    def __init__(
+        self,
+        function: Callable,
+        client: Client,
+        ttl: int = 0,
+        namespace: str | None = None,
+        l1_size: int = 0,
+        l1_ttl: float | None = 1.0,
+        beta: float = 1.0,
+        serializer: Any = None,
+        lease: MemcachedLease | None = None,
+    ) -> None:
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.client = client
+        self.ttl = ttl
+        self.namespace = namespace or f"{function.__module__}.{function.__qualname__}"
+        self.l1 = ShardedLRU(l1_size) if l1_size else None
+        self.l1_ttl = l1_ttl
+        self.beta = beta
+        self.serializer = serializer if serializer is not None else Serializer()
+        self.lease = lease if lease is not None else MemcachedLease(client)
+        self.log = logging.getLogger("Memoized")
+        self.l1_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.__signature = inspect.signature(function)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        key = self.key(*args, **kwargs)
+        entry = self.l1.read(key) if self.l1 is not None else None
+        if entry is not None:
+            self.l1_hits += 1
+        else:
+            computed = []
+
+            def compute() -> bytes:
+                computed.append(True)
+                return self.__compute(args, kwargs)
+
+            entry = self.__decode(self.lease.get_or_compute(key, compute, self.ttl))
+            if computed:
+                self.misses += 1
+                self.__cache(key, entry)
+                return entry.value
+            self.hits += 1
+        if self.__expiring(entry):
+            entry = self.lease.flight.do(key, lambda: self.__refresh(key, args, kwargs))
+        self.__cache(key, entry)
+        return entry.value
+
+    def map(self, *iterables: Iterable) -> List[Any]:
+        """Results of the function for each item of the iterables, like `map`
+
+        The cached results are fetched with one `get_multi`, and the missing ones are
+        computed in turn and stored with one `set_multi`, without leases.
+        """
+        calls = list(zip(*iterables))
+        keys = [self.key(*args) for args in calls]
+        entries: Dict[str, Entry] = {}
+        if self.l1 is not None:
+            for key in keys:
+                entry = self.l1.read(key)
+                if entry is not None:
+                    entries[key] = entry
+            self.l1_hits += len(entries)
+        missing = [key for key in dict.fromkeys(keys) if key not in entries]
+        if missing:
+            for key, raw in self.client.get_multi(missing).items():
+                entry = self.__decode(raw)
+                if not self.__expiring(entry):
+                    entries[key] = entry
+                    self.hits += 1
+        computed: Dict[str, bytes] = {}
+        for key, args in zip(keys, calls):
+            if key not in entries:
+                computed[key] = self.__compute(args, {})
+                entries[key] = self.__decode(computed[key])
+                self.misses += 1
+        if computed:
+            self.client.set_multi(computed, time=self.ttl)
+        for key in missing:
+            self.__cache(key, entries[key])
+        return [entries[key].value for key in keys]
+
+    def key(self, *args, **kwargs) -> str:
+        """Memcached key of a call, the same however the arguments are passed"""
+        bound = self.__signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = []
+        for name, value in bound.arguments.items():
+            kind = self.__signature.parameters[name].kind
+            if kind is inspect.Parameter.VAR_KEYWORD:
+                value = sorted(value.items())
+            arguments.append((name, value))
+        digest = hashlib.blake2b(repr(arguments).encode(), digest_size=16).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def invalidate(self, *args, **kwargs) -> None:
+        """Forget the cached result of a call"""
+        key = self.key(*args, **kwargs)
+        if self.l1 is not None:
+            self.l1.delete(key)
+        self.client.delete(key)
+
+    def __compute(self, args: Tuple, kwargs: Dict) -> bytes:
+        start = time.time()
+        value = self.function(*args, **kwargs)
+        now = time.time()
+        expires = now + self.ttl if self.ttl else 0.0
+        return HEADER.pack(expires, now - start) + self.serializer.dumps(value)
+
+    def __decode(self, raw: bytes) -> Entry:
+        expires, delta = HEADER.unpack_from(raw)
+        return Entry(self.serializer.loads(raw[HEADER.size :]), expires, delta)
+
+    def __expiring(self, entry: Entry) -> bool:
+        """Whether to recompute the entry before it expires
+
+        The probability grows as the expiry nears, faster for the slow computations
+        ("optimal probabilistic cache stampede prevention", XFetch), so that one caller
+        usually refreshes a hot key before it expires for every caller at once.
+        """
+        if not entry.expires:
+            return False
+        early = -entry.delta * self.beta * math.log(1.0 - random.random())
+        return time.time() + early >= entry.expires
+
+    def __refresh(self, key: str, args: Tuple, kwargs: Dict) -> Entry:
+        self.log.debug("refresh - %s", key)
+        self.refreshes += 1
+        raw = self.__compute(args, kwargs)
+        self.client.set(key, raw, time=self.ttl)
+        return self.__decode(raw)
+
+    def __cache(self, key: str, entry: Entry) -> None:
+        if self.l1 is None:
+            return
+        ttl = self.l1_ttl
+        if entry.expires:
+            remaining = entry.expires - time.time()
+            ttl = remaining if ttl is None else min(ttl, remaining)
+        if ttl is None or ttl > 0:
+            self.l1.create(key, entry, ttl=ttl)
+
+
+def memcached_memoize(
+    client: Client,
+    ttl: int = 0,
+    namespace: str | None = None,
+    l1_size: int = 0,
+    l1_ttl: float | None = 1.0,
+    beta: float = 1.0,
+    serializer: Any = None,
+    lease: MemcachedLease | None = None,
+) -> Callable[[Callable], Memoized]:
+    """Decorator caching the results of a function in memcached
+
+    The key of a call is the namespace of the function (its module and qualified name by
+    default) and a hash of the `repr` of its arguments, bound to the parameters so that
+    `f(1, b=2)` and `f(1, 2)` share a key: the arguments must have a stable `repr`. The
+    result is stored with its logical expiry, so that a cached None is a hit.
+
+    A missing result is computed once across threads and processes (`MemcachedLease`).
+    A result expires `ttl` seconds after its computation (0 for never). Before that, it
+    is recomputed early with a probability growing as its expiry nears and with the time
+    it took to compute, `beta` scaling it ("XFetch"), so that a hot result is usually
+    refreshed by a single caller before it expires for all of them.
+
+    With `l1_size`, up to that many results are also cached in process in front of
+    memcached, for `l1_ttl` seconds (None for their ttl).
+
+    The decorated function has `map(*iterables)` for batched calls, `key(*args,
+    **kwargs)`, `invalidate(*args, **kwargs)` and the counters `l1_hits`, `hits`,
+    `misses` and `refreshes`.
+
+    Args:
+        client (Client): memcache client, or a `ClusterClient`
+        ttl (int, optional): seconds before a result expires, 0 for never. Defaults to 0.
+        namespace (str | None, optional): prefix of the keys. Defaults to the module and qualified name of the function.
+        l1_size (int, optional): results cached in process, 0 for none. Defaults to 0.
+        l1_ttl (float | None, optional): seconds a result is cached in process. Defaults to 1.
+        beta (float, optional): eagerness of the early refreshes, 0 for none. Defaults to 1.
+        serializer (optional): object with `dumps(value) -> bytes` and `loads(data)`, e.g. `pickle`. Defaults to a `Serializer`.
+        lease (MemcachedLease | None, optional): lease computing the missing results. Defaults to a `MemcachedLease` of the client.
+    """
+
+    def decorator(function: Callable) -> Memoized:
+        return Memoized(
+            function, client, ttl, namespace, l1_size, l1_ttl, beta, serializer, lease
+        )
+
+    return decorator
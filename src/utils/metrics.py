@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator
+
+from dotenv import load_dotenv
+from utils.pool import pool_metrics
+
+load_dotenv()
+# the storages are instrumented only if STORAGE_METRICS is set, e.g. in the .env file
+METRICS_ENABLED = os.getenv("STORAGE_METRICS", "").lower() in ("1", "true", "yes")
+
+# upper bounds of the latency buckets in seconds, from 1µs to 64s by powers of 2
+BOUNDS = [2**exponent / 1e6 for exponent in range(27)]
+LAST = len(BOUNDS)
+
+
+class Histogram:
+    """Latency histogram with logarithmic buckets (`BOUNDS`)
+
+    The quantiles are estimated from the buckets, within a factor 2 of the exact ones.
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float) -> None:
+        # first bucket whose upper bound is not below the latency, LAST past 64s
+        self.counts[bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket of the `q` quantile, e.g. 0.99 for the p99"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BOUNDS, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return float("inf") if self.count else 0.0
+
+
+class StorageMetrics:
+    """Counters and latency histograms of the operations of a storage
+
+    Args:
+        name (str): name of the storage in `METRICS`
+    """
+
+    COUNTERS = ("hits", "misses", "evictions", "bytes_in", "bytes_out", "errors")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.errors = 0
+        self.errors_by_operation: Dict[str, int] = {}
+        self.latencies: Dict[str, Histogram] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        return {counter: getattr(self, counter) for counter in self.COUNTERS}
+
+    def record(
+        self,
+        operation: str,
+        seconds: float,
+        hits: int = 0,
+        misses: int = 0,
+        bytes_in: int = 0,
+        bytes_out: int = 0,
+    ) -> None:
+        with self.__lock:
+            histogram = self.latencies.get(operation)
+            if histogram is None:
+                histogram = self.latencies[operation] = Histogram()
+            histogram.record(seconds)
+            self.hits += hits
+            self.misses += misses
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def error(self, operation: str) -> None:
+        with self.__lock:
+            self.errors += 1
+            errors = self.errors_by_operation
+            errors[operation] = errors.get(operation, 0) + 1
+
+    def evicted(self, count: int = 1) -> None:
+        with self.__lock:
+            self.evictions += count
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.__lock:
+            return {
+                **self.counters,
+                "hit_ratio": self.hit_ratio(),
+                "errors_by_operation": dict(self.errors_by_operation),
+                "operations": {
+                    operation: {
+                        "count": histogram.count,
+                        "seconds": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p99": histogram.quantile(0.99),
+                    }
+                    for operation, histogram in self.latencies.items()
+                },
+            }
+
+
+# metrics of every instrumented storage by name, to export them
+METRICS: Dict[str, StorageMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def _size(value: Any) -> int:
+    """Size in bytes of a bytes-like value, 0 for the other values"""
+    if isinstance(value, memoryview):
+        return value.nbytes
+    return len(value) if isinstance(value, (bytes, bytearray)) else 0
+
+
+def storage_metrics(name: str) -> StorageMetrics:
+    """Metrics of the storages named `name`, shared by all of them"""
+    with _metrics_lock:
+        metrics = METRICS.get(name)
+        if metrics is None:
+            metrics = METRICS[name] = StorageMetrics(name)
+        return metrics
+
+
+class InstrumentedStorage:
+    """Storage recording the metrics of the operations of another storage
+
+    It counts the hits and misses of the reads (a None value or a FileNotFoundError being a
+    miss), the bytes written and read (of the bytes-like values only), the errors, and the
+    latency of each operation. The evictions are counted for the storages managed by an
+    eviction policy (`lru`). The other attributes are those of the wrapped storage.
+
+    Args:
+        storage: storage to instrument
+        name (str): name of its metrics in `METRICS`
+    """
+
+    def __init__(self, storage, name: str) -> None:
+        self.storage = storage
+        self.metrics = storage_metrics(name)
+        lru = getattr(storage, "lru", None)
+        if lru is not None:
+            on_evict = lru.on_evict
+            evicted = self.metrics.evicted
+
+            def counted(key: str, value: Any) -> None:
+                evicted()
+                if on_evict is not None:
+                    on_evict(key, value)
+
+            lru.on_evict = counted
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+    def create(self, key: str, data: bytes, *args, **kwargs):
+        args = (key, data) + args
+        return self.__call("create", self.storage.create, args, kwargs, _size(data))
+
+    def read(self, key: str, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            value = self.storage.read(key, *args, **kwargs)
+        except FileNotFoundError:
+            self.metrics.record("read", time.perf_counter() - start, misses=1)
+            raise
+        except Exception:
+            self.metrics.error("read")
+            raise
+        hit = value is not None
+        self.metrics.record(
+            "read",
+            time.perf_counter() - start,
+            hits=hit,
+            misses=not hit,
+            bytes_out=_size(value),
+        )
+        return value
+
+    def delete(self, key: str, *args, **kwargs):
+        return self.__call("delete", self.storage.delete, (key,) + args, kwargs)
+
+    def create_multi(self, mapping: Dict[str, bytes], *args, **kwargs):
+        size = sum(_size(data) for data in mapping.values())
+        args = (mapping,) + args
+        method = self.storage.create_multi
+        return self.__call("create_multi", method, args, kwargs, size)
+
+    def read_multi(self, keys: Iterable[str], *args, **kwargs) -> Dict[str, bytes]:
+        keys = list(keys)
+        start = time.perf_counter()
+        try:
+            values = self.storage.read_multi(keys, *args, **kwargs)
+        except Exception:
+            self.metrics.error("read_multi")
+            raise
+        self.metrics.record(
+            "read_multi",
+            time.perf_counter() - start,
+            hits=len(values),
+            misses=len(keys) - len(values),
+            bytes_out=sum(_size(value) for value in values.values()),
+        )
+        return values
+
+    def delete_multi(self, keys: Iterable[str], *args, **kwargs):
+        args = (keys,) + args
+        return self.__call("delete_multi", self.storage.delete_multi, args, kwargs)
+
+    def __call(
+        self, operation: str, method, args: tuple, kwargs: dict, bytes_in: int = 0
+    ):
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            self.metrics.error(operation)
+            raise
+        self.metrics.record(operation, time.perf_counter() - start, bytes_in=bytes_in)
+        return result
+
+
+def instrument(storage, name: str, enabled: bool | None = None):
+    """Instrument the storage if the metrics are enabled, else return it unchanged
+
+    Args:
+        storage: storage to instrument
+        name (str): name of its metrics in `METRICS`
+        enabled (bool | None, optional): whether to instrument it. Defaults to `METRICS_ENABLED`.
+    """
+    if enabled is None:
+        enabled = METRICS_ENABLED
+    return InstrumentedStorage(storage, name) if enabled else storage
+
+
+def snapshot() -> Dict[str, Any]:
+    """Snapshot of the metrics of every instrumented storage and pool"""
+    return {
+        "storages": {name: metrics.snapshot() for name, metrics in METRICS.items()},
+        "pools": pool_metrics(),
+    }
+
+
+def prometheus() -> str:
+    """Metrics of every instrumented storage and pool in the Prometheus text format"""
+    return "".join(_prometheus_lines())
+
+
+def _prometheus_lines() -> Iterator[str]:
+    storages = list(METRICS.values())
+    for counter in StorageMetrics.COUNTERS:
+        yield f"# TYPE storage_{counter}_total counter\n"
+        for metrics in storages:
+            value = getattr(metrics, counter)
+            yield f'storage_{counter}_total{{storage="{metrics.name}"}} {value}\n'
+    yield "# TYPE storage_latency_seconds histogram\n"
+    for metrics in storages:
+        for operation, histogram in list(metrics.latencies.items()):
+            labels = f'storage="{metrics.name}",operation="{operation}"'
+            cumulative = 0
+            for bound, count in zip(BOUNDS, histogram.counts):
+                cumulative += count
+                bucket = f'{labels},le="{bound:g}"'
+                yield f"storage_latency_seconds_bucket{{{bucket}}} {cumulative}\n"
+            bucket = f'{labels},le="+Inf"'
+            yield f"storage_latency_seconds_bucket{{{bucket}}} {histogram.count}\n"
+            yield f"storage_latency_seconds_sum{{{labels}}} {histogram.sum}\n"
+            yield f"storage_latency_seconds_count{{{labels}}} {histogram.count}\n"
+    pools = pool_metrics()
+    for field in ("acquisitions", "waits", "timeouts", "wait_seconds"):
+        yield f"# TYPE pool_{field}_total counter\n"
+        for name, values in pools.items():
+            yield f'pool_{field}_total{{pool="{name}"}} {values[field]}\n'
+    for field in ("size", "in_use"):
+        yield f"# TYPE pool_{field} gauge\n"
+        for name, values in pools.items():
+            yield f'pool_{field}{{pool="{name}"}} {values[field]}\n'
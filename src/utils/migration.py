@@ -0,0 +1,466 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+
+class Placement:
+    """Tier, size and access score of a key
+
+    The score is the number of accesses, decayed exponentially since `last` (see
+    `PlacementTable`).
+    """
+
+    __slots__ = ("tier", "size", "score", "last")
+
+    def __init__(self, tier: int, size: int, score: float, last: float) -> None:
+        self.tier = tier
+        self.size = size
+        self.score = score
+        self.last = last
+
+
+class PlacementTable:
+    """Placement of the keys of a tiered storage, with their access scores
+
+    Each access adds 1 to the score of a key, and the score is halved every `half_life`
+    seconds, so that it approximates the number of accesses of the last `half_life /
+    ln(2)` seconds: a key hot long ago ends up with the score of a cold key. The table also
+    keeps the bytes used in each tier (`used`).
+
+    Args:
+        tiers (int): number of tiers, the tiers being numbered from 0
+        half_life (float, optional): seconds for a score to be halved. Defaults to 3600.
+        clock (Callable[[], float], optional): clock in seconds. Defaults to time.monotonic.
+    """
+
+    def __init__(
+        self,
+        tiers: int,
+        half_life: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.half_life = half_life
+        self.clock = clock
+        self.used = [0] * tiers
+        self.__rate = math.log(2) / half_life
+        self.__entries: Dict[str, Placement] = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__entries
+
+    def get(self, key: str) -> Placement | None:
+        return self.__entries.get(key)
+
+    def add(self, key: str, tier: int, size: int) -> Placement | None:
+        """Place a new or rewritten key with a null score, return its previous placement"""
+        with self.__lock:
+            previous = self.__entries.get(key)
+            if previous is not None:
+                self.used[previous.tier] -= previous.size
+            self.__entries[key] = Placement(tier, size, 0.0, self.clock())
+            self.used[tier] += size
+        return previous
+
+    def hit(self, key: str) -> Placement | None:
+        """Count an access to the key and return its placement"""
+        now = self.clock()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                decay = math.exp(self.__rate * (entry.last - now))
+                entry.score = entry.score * decay + 1
+                entry.last = now
+        return entry
+
+    def score(self, entry: Placement) -> float:
+        """Current score of a placement, without counting an access"""
+        return entry.score * math.exp(self.__rate * (entry.last - self.clock()))
+
+    def move(self, key: str, tier: int) -> None:
+        with self.__lock:
+            entry = self.__entries[key]
+            self.used[entry.tier] -= entry.size
+            self.used[tier] += entry.size
+            entry.tier = tier
+
+    def pop(self, key: str) -> Placement | None:
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.used[entry.tier] -= entry.size
+        return entry
+
+    def items(self) -> List[Tuple[str, Placement]]:
+        with self.__lock:
+            return list(self.__entries.items())
+
+
+class TierPlanner:
+    """Tier of the keys of a `PlacementTable`, from their access scores
+
+    Without capacities, the tier of a key is the tier of its score given by `tier`, the
+    tiers being numbered from the lowest. To keep the keys near a threshold from
+    bouncing between two tiers, a key is promoted when its score exceeds the threshold
+    by `hysteresis`, and demoted when it is below by as much.
+
+    With a capacity in bytes for some tiers, a tier without capacity being unbounded,
+    the tiers hold the keys with the highest score per byte instead: `sweep` fills the
+    highest tier, then the next ones, with the keys in decreasing order of score per
+    byte, among the keys read at least once recently (score of `MIN_SCORE`). The keys of
+    a tier get a `hysteresis` bonus to keep it. Between two sweeps, a read promotes a
+    key to a tier with enough free space if its score per byte exceeds the lowest one of
+    the tier at the last sweep.
+
+    Args:
+        placement (PlacementTable): placement of the keys
+        tier (Callable[[float], int]): tier of a score without capacities
+        capacities (List[int | None]): capacity of each tier in bytes, None if unbounded
+        hysteresis (float, optional): margin of the thresholds and bonus of the current tier. Defaults to 0.2.
+    """
+
+    # score of a key read once recently, below which it is not cached with capacities
+    MIN_SCORE = 1.0
+
+    def __init__(
+        self,
+        placement: PlacementTable,
+        tier: Callable[[float], int],
+        capacities: List[int | None],
+        hysteresis: float = 0.2,
+    ) -> None:
+        self.placement = placement
+        self.tier = tier
+        self.capacities = capacities
+        self.hysteresis = hysteresis
+        self.capacity_aware = any(capacity is not None for capacity in capacities)
+        self.log = logging.getLogger("TierPlanner")
+        # lowest score per byte of each tier at the last sweep, 0 if it was not full
+        self.__cutoffs = [0.0] * len(capacities)
+        # tiers planned by the last sweep
+        self.__planned: Dict[str, int] = {}
+
+    def target(self, entry: Placement) -> int:
+        """Tier to move a key to, its current tier if it stays there"""
+        score = self.placement.score(entry)
+        if self.capacity_aware:
+            return self.__fitting(entry, score)
+        higher = self.tier(score / (1 + self.hysteresis))
+        if higher > entry.tier:
+            return higher
+        lower = self.tier(score * (1 + self.hysteresis))
+        return min(lower, entry.tier)
+
+    def destination(self, key: str, entry: Placement) -> int | None:
+        """Tier to move a key to now, None if it stays or its tier has no room"""
+        target = self.__planned.pop(key, None)
+        if target is None:
+            target = self.target(entry)
+        capacity = self.capacities[target]
+        if target == entry.tier or (
+            target > entry.tier
+            and capacity is not None
+            and self.placement.used[target] + entry.size > capacity
+        ):
+            return None
+        return target
+
+    def sweep(self) -> List[str]:
+        """Keys to move"""
+        if self.capacity_aware:
+            return self.__plan()
+        return [
+            key
+            for key, entry in self.placement.items()
+            if entry.tier != 0 and self.target(entry) != entry.tier
+        ]
+
+    def __fitting(self, entry: Placement, score: float) -> int:
+        """Highest tier with room for the key, if it is denser than the tier's keys"""
+        if score < self.MIN_SCORE:
+            return entry.tier
+        density = score / max(entry.size, 1)
+        for tier in range(len(self.capacities) - 1, entry.tier, -1):
+            capacity = self.capacities[tier]
+            if density > self.__cutoffs[tier] * (1 + self.hysteresis) and (
+                capacity is None or self.placement.used[tier] + entry.size <= capacity
+            ):
+                return tier
+        return entry.tier
+
+    def __plan(self) -> List[str]:
+        """Plan the tier of each key, and return the keys to move, demotions first"""
+        bonus = 1 + self.hysteresis
+        entries = self.placement.items()
+        # the keys read recently, with their score per byte
+        keys = []
+        for key, entry in entries:
+            score = self.placement.score(entry)
+            if score >= self.MIN_SCORE:
+                keys.append((key, entry, score / max(entry.size, 1)))
+        planned: Dict[str, int] = {}
+        cutoffs = [0.0] * len(self.capacities)
+        for tier in range(len(self.capacities) - 1, 0, -1):
+            capacity = self.capacities[tier]
+            keys.sort(
+                key=lambda item: item[2] * (bonus if item[1].tier == tier else 1),
+                reverse=True,
+            )
+            used = 0
+            rest = []
+            for key, entry, density in keys:
+                if capacity is None or used + entry.size <= capacity:
+                    planned[key] = tier
+                    used += entry.size
+                    cutoffs[tier] = density
+                else:
+                    rest.append((key, entry, density))
+            if not rest:
+                # the tier is not full, any key read recently can be promoted to it
+                cutoffs[tier] = 0.0
+            keys = rest
+        # by tier, the demotions to a tier before the promotions to it
+        moves = sorted(
+            (planned.get(key, 0), planned.get(key, 0) > entry.tier, key)
+            for key, entry in entries
+            if planned.get(key, 0) != entry.tier
+        )
+        self.__cutoffs = cutoffs
+        self.__planned = {key: tier for tier, _, key in moves}
+        self.log.debug("plan - %s moves, cutoffs %s", len(moves), cutoffs)
+        return [key for _, _, key in moves]
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` operations per second, in bursts of up to `burst`
+
+    Args:
+        rate (float): operations per second
+        burst (float | None, optional): size of the bucket. Defaults to `rate`.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.__tokens = self.burst
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def wait(self) -> float:
+        """Seconds to wait before the next operation is allowed, taking its token if 0"""
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(
+                self.burst, self.__tokens + (now - self.__last) * self.rate
+            )
+            self.__last = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return 0.0
+            return (1 - self.__tokens) / self.rate
+
+
+class MigrationWorker(threading.Thread):
+    """Background thread migrating keys between tiers, at a bounded rate
+
+    The keys submitted with `submit` are queued once, even if submitted again before
+    their turn, and `migrate(key)` is called for each of them, at most `rate` times per
+    second. Every `sweep_interval` seconds, the keys returned by `sweep()` are submitted
+    too, e.g. the keys whose score decayed below the threshold of their tier.
+
+    Args:
+        migrate (Callable[[str], None]): moves the key to its tier, if needed
+        sweep (Callable[[], Iterable[str]] | None, optional): keys to check periodically. Defaults to None.
+        rate (float, optional): migrations per second. Defaults to 50.
+        sweep_interval (float, optional): seconds between two sweeps. Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        migrate: Callable[[str], None],
+        sweep: Callable[[], Iterable[str]] | None = None,
+        rate: float = 50.0,
+        sweep_interval: float = 60.0,
+    ) -> None:
+        super().__init__(name="tier-migration", daemon=True)
+        self.migrate = migrate
+        self.sweep = sweep
+        self.limiter = RateLimiter(rate)
+        self.sweep_interval = sweep_interval
+        self.log = logging.getLogger("MigrationWorker")
+        self.__pending: Dict[str, None] = {}
+        self.__running = False
+        self.__stopped = False
+        self.__condition = threading.Condition()
+
+    def submit(self, key: str) -> None:
+        with self.__condition:
+            if key not in self.__pending:
+                self.__pending[key] = None
+                self.__condition.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until the submitted keys are migrated, return False on timeout"""
+        with self.__condition:
+            return self.__condition.wait_for(
+                lambda: not self.__pending and not self.__running, timeout
+            )
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        self.join()
+
+    def run(self) -> None:
+        next_sweep = time.monotonic() + self.sweep_interval
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__stopped:
+                    if self.sweep is not None:
+                        timeout = next_sweep - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self.__condition.wait(timeout)
+                    else:
+                        self.__condition.wait()
+                if self.__stopped:
+                    return
+                key = next(iter(self.__pending), None)
+                if key is not None:
+                    del self.__pending[key]
+                    self.__running = True
+            if key is None:
+                next_sweep = time.monotonic() + self.sweep_interval
+                self.__sweep()
+                continue
+            self.__migrate(key)
+
+    def __sweep(self) -> None:
+        try:
+            for key in self.sweep():
+                self.submit(key)
+        except Exception as e:
+            self.log.error(e)
+
+    def __migrate(self, key: str) -> None:
+        try:
+            delay = self.limiter.wait()
+            while delay:
+                time.sleep(delay)
+                delay = self.limiter.wait()
+            self.migrate(key)
+        except Exception as e:
+            self.log.error("migrate - %s: %s", key, e)
+        finally:
+            with self.__condition:
+                self.__running = False
+                self.__condition.notify_all()
+
+
+class AsyncMigrationWorker:
+    """asyncio counterpart of `MigrationWorker`, running as a task of the event loop
+
+    The task is started by the first `submit` (or `start()`) in the running loop, and
+    migrates the submitted keys with the coroutine `migrate(key)`, at most `rate` times
+    per second, without blocking the loop. Every `sweep_interval` seconds, the keys
+    returned by `sweep()` are submitted too.
+
+    Args:
+        migrate (Callable[[str], Awaitable[None]]): moves the key to its tier, if needed
+        sweep (Callable[[], Iterable[str]] | None, optional): keys to check periodically. Defaults to None.
+        rate (float, optional): migrations per second. Defaults to 50.
+        sweep_interval (float, optional): seconds between two sweeps. Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        migrate: Callable[[str], Awaitable[None]],
+        sweep: Callable[[], Iterable[str]] | None = None,
+        rate: float = 50.0,
+        sweep_interval: float = 60.0,
+    ) -> None:
+        self.migrate = migrate
+        self.sweep = sweep
+        self.limiter = RateLimiter(rate)
+        self.sweep_interval = sweep_interval
+        self.log = logging.getLogger("AsyncMigrationWorker")
+        self.__pending: Dict[str, None] = {}
+        self.__task: asyncio.Task | None = None
+        # set when keys are submitted, and when the worker is stopped
+        self.__wakeup: asyncio.Event | None = None
+        # set when no key is pending nor being migrated
+        self.__idle: asyncio.Event | None = None
+
+    def start(self) -> None:
+        if self.__task is None or self.__task.done():
+            self.__wakeup = asyncio.Event()
+            self.__idle = asyncio.Event()
+            self.__task = asyncio.get_running_loop().create_task(self.run())
+
+    def submit(self, key: str) -> None:
+        self.start()
+        if key not in self.__pending:
+            self.__pending[key] = None
+            self.__idle.clear()
+            self.__wakeup.set()
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """Wait until the submitted keys are migrated, return False on timeout"""
+        if self.__task is None or self.__task.done():
+            return True
+        try:
+            await asyncio.wait_for(self.__idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self) -> None:
+        if self.__task is None:
+            return
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self) -> None:
+        next_sweep = time.monotonic() + self.sweep_interval
+        while True:
+            if not self.__pending:
+                self.__idle.set()
+                timeout = None
+                if self.sweep is not None:
+                    timeout = max(next_sweep - time.monotonic(), 0)
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    next_sweep = time.monotonic() + self.sweep_interval
+                    self.__sweep()
+                self.__wakeup.clear()
+                continue
+            key = next(iter(self.__pending))
+            delay = self.limiter.wait()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            del self.__pending[key]
+            try:
+                await self.migrate(key)
+            except Exception as e:
+                self.log.error("migrate - %s: %s", key, e)
+
+    def __sweep(self) -> None:
+        try:
+            for key in self.sweep():
+                if key not in self.__pending:
+                    self.__pending[key] = None
+                    self.__idle.clear()
+        except Exception as e:
+            self.log.error(e)
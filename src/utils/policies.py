@@ -0,0 +1,379 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List
+
+from utils.LRU import LRU, EvictionPolicy, ShardedLRU
+
+
+class ARC(EvictionPolicy):
+    """Adaptive Replacement Cache
+
+    Items seen once live in `T1`, items seen at least twice in `T2`. The keys recently
+    evicted from each list are remembered in the ghost lists `B1` and `B2`, and a hit in a
+    ghost list moves the target size `p` of `T1`. A scan only goes through `T1` and
+    therefore does not flush the frequently used items of `T2`.
+
+    Args:
+        capacity (int, optional): maximum number of items. Defaults to 10.
+        on_evict (Callable[[str, Any], None] | None, optional): called for each evicted item. Defaults to None.
+    """
+
+    def __init__(
+        self, capacity: int = 10, on_evict: Callable[[str, Any], None] | None = None
+    ) -> None:
+        assert capacity > 0, "capacity must be greater than 0"
+        self.on_evict = on_evict
+        self.__capacity = capacity
+        self.__p = 0.0
+        self.__t1: OrderedDict[str, Any] = OrderedDict()
+        self.__t2: OrderedDict[str, Any] = OrderedDict()
+        self.__b1: OrderedDict[str, None] = OrderedDict()
+        self.__b2: OrderedDict[str, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__t1) + len(self.__t2)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__t1 or key in self.__t2
+
+    def create(
+        self, key: str, value: Any, size: int | None = None, ttl: float | None = None
+    ) -> Any | None:
+        if ttl is not None:
+            raise ValueError(f"{self.__class__.__name__} does not support ttl")
+        t1, t2, b1, b2 = self.__t1, self.__t2, self.__b1, self.__b2
+        if key in t1:
+            del t1[key]
+            t2[key] = value
+            return
+        if key in t2:
+            t2[key] = value
+            t2.move_to_end(key)
+            return
+
+        capacity = self.__capacity
+        evicted = None
+        if key in b1:
+            self.__p = min(capacity, self.__p + max(len(b2) / len(b1), 1))
+            evicted = self.__replace(key)
+            del b1[key]
+            t2[key] = value
+            return evicted
+        if key in b2:
+            self.__p = max(0, self.__p - max(len(b1) / len(b2), 1))
+            evicted = self.__replace(key)
+            del b2[key]
+            t2[key] = value
+            return evicted
+
+        l1 = len(t1) + len(b1)
+        total = l1 + len(t2) + len(b2)
+        if l1 >= capacity:
+            if len(t1) < capacity:
+                b1.popitem(last=False)
+                evicted = self.__replace(key)
+            else:
+                evicted = self.__evict(*t1.popitem(last=False))
+        elif total >= capacity:
+            if total >= 2 * capacity:
+                b2.popitem(last=False)
+            evicted = self.__replace(key)
+        t1[key] = value
+        return evicted
+
+    def read(self, key: str):
+        t1, t2 = self.__t1, self.__t2
+        if key in t2:
+            t2.move_to_end(key)
+            return t2[key]
+        if key in t1:
+            value = t1.pop(key)
+            t2[key] = value
+            return value
+
+    def peek(self, key: str):
+        value = self.__t1.get(key)
+        if value is None:
+            value = self.__t2.get(key)
+        return value
+
+    def delete(self, key: str):
+        for entries in (self.__t1, self.__t2, self.__b1, self.__b2):
+            entries.pop(key, None)
+
+    def keys(self) -> Iterator[str]:
+        yield from reversed(self.__t2)
+        yield from reversed(self.__t1)
+
+    def __replace(self, key: str) -> Any | None:
+        t1, t2 = self.__t1, self.__t2
+        if len(t1) + len(t2) < self.__capacity:
+            return
+        if t1 and (len(t1) > self.__p or (key in self.__b2 and len(t1) == self.__p)):
+            old_key, value = t1.popitem(last=False)
+            self.__b1[old_key] = None
+        else:
+            old_key, value = t2.popitem(last=False)
+            self.__b2[old_key] = None
+        return self.__evict(old_key, value)
+
+    def __evict(self, key: str, value: Any) -> Any:
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return value
+
+
+class TwoQueue(EvictionPolicy):
+    """2Q cache
+
+    New items enter the FIFO queue `A1in`. An item enters the main LRU queue `Am` when it is
+    read again while in `A1in`, or re-created while its key is in the ghost queue `A1out`
+    that remembers the keys evicted from `A1in`. Items touched once by a scan therefore
+    never reach `Am`.
+
+    Args:
+        capacity (int, optional): maximum number of items. Defaults to 10.
+        on_evict (Callable[[str, Any], None] | None, optional): called for each evicted item. Defaults to None.
+        in_ratio (float, optional): share of the capacity for `A1in`. Defaults to 0.25.
+        out_ratio (float, optional): number of ghost keys in `A1out`, relative to the capacity. Defaults to 0.5.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10,
+        on_evict: Callable[[str, Any], None] | None = None,
+        in_ratio: float = 0.25,
+        out_ratio: float = 0.5,
+    ) -> None:
+        assert capacity > 0, "capacity must be greater than 0"
+        self.on_evict = on_evict
+        self.__capacity = capacity
+        self.__in_capacity = max(1, int(capacity * in_ratio))
+        self.__out_capacity = max(1, int(capacity * out_ratio))
+        self.__a1in: OrderedDict[str, Any] = OrderedDict()
+        self.__a1out: OrderedDict[str, None] = OrderedDict()
+        self.__am: OrderedDict[str, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__a1in) + len(self.__am)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__a1in or key in self.__am
+
+    def create(
+        self, key: str, value: Any, size: int | None = None, ttl: float | None = None
+    ) -> Any | None:
+        if ttl is not None:
+            raise ValueError(f"{self.__class__.__name__} does not support ttl")
+        if key in self.__am:
+            self.__am[key] = value
+            self.__am.move_to_end(key)
+            return
+        if key in self.__a1in:
+            self.__a1in[key] = value
+            return
+        evicted = self.__reclaim()
+        if key in self.__a1out:
+            del self.__a1out[key]
+            self.__am[key] = value
+        else:
+            self.__a1in[key] = value
+        return evicted
+
+    def read(self, key: str):
+        if key in self.__am:
+            self.__am.move_to_end(key)
+            return self.__am[key]
+        if key in self.__a1in:
+            value = self.__a1in.pop(key)
+            self.__am[key] = value
+            return value
+
+    def peek(self, key: str):
+        value = self.__am.get(key)
+        if value is None:
+            value = self.__a1in.get(key)
+        return value
+
+    def delete(self, key: str):
+        for entries in (self.__a1in, self.__a1out, self.__am):
+            entries.pop(key, None)
+
+    def keys(self) -> Iterator[str]:
+        yield from reversed(self.__am)
+        yield from reversed(self.__a1in)
+
+    def __reclaim(self) -> Any | None:
+        if len(self) < self.__capacity:
+            return
+        if len(self.__a1in) > self.__in_capacity or not self.__am:
+            key, value = self.__a1in.popitem(last=False)
+            self.__a1out[key] = None
+            if len(self.__a1out) > self.__out_capacity:
+                self.__a1out.popitem(last=False)
+        else:
+            key, value = self.__am.popitem(last=False)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return value
+
+
+class CountMinSketch:
+    """Count-min sketch of 4-bit counters with periodic aging
+
+    The counters saturate at 15 and are all halved every `sample_size` increments, so the
+    estimated frequencies follow the recent popularity of the keys.
+
+    Args:
+        width (int): minimum number of counters per row, rounded up to a power of 2
+        depth (int, optional): number of rows. Defaults to 4.
+        sample_size (int | None, optional): increments between two agings. Defaults to 10 * width.
+    """
+
+    def __init__(self, width: int, depth: int = 4, sample_size: int | None = None) -> None:
+        width = 1 << max(width - 1, 1).bit_length()
+        self.__mask = width - 1
+        self.__rows: List[bytearray] = [bytearray(width) for _ in range(depth)]
+        self.__sample_size = sample_size if sample_size is not None else 10 * width
+        self.__additions = 0
+
+    def __indexes(self, key: str) -> Iterator[int]:
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        mask = self.__mask
+        for i in range(len(self.__rows)):
+            yield (h1 + i * h2) & mask
+
+    def increment(self, key: str) -> None:
+        for row, index in zip(self.__rows, self.__indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.__additions += 1
+        if self.__additions >= self.__sample_size:
+            self.__reset()
+
+    def estimate(self, key: str) -> int:
+        return min(row[index] for row, index in zip(self.__rows, self.__indexes(key)))
+
+    def __reset(self) -> None:
+        self.__additions //= 2
+        self.__rows = [bytearray(count >> 1 for count in row) for row in self.__rows]
+
+
+class WTinyLFU(EvictionPolicy):
+    """Window TinyLFU cache
+
+    New items enter a small LRU window (`window_ratio` of the capacity). An item leaving
+    the window is admitted into the main segmented LRU only if its estimated frequency,
+    given by a `CountMinSketch`, is higher than the one of the main victim. The main LRU is
+    split between a probation segment and a protected segment for the items read again.
+
+    Args:
+        capacity (int, optional): maximum number of items. Defaults to 10.
+        on_evict (Callable[[str, Any], None] | None, optional): called for each evicted item. Defaults to None.
+        window_ratio (float, optional): share of the capacity for the window. Defaults to 0.01.
+        protected_ratio (float, optional): share of the main LRU for the protected segment. Defaults to 0.8.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10,
+        on_evict: Callable[[str, Any], None] | None = None,
+        window_ratio: float = 0.01,
+        protected_ratio: float = 0.8,
+    ) -> None:
+        assert capacity > 1, "capacity must be greater than 1"
+        self.on_evict = on_evict
+        self.__window_capacity = max(1, int(capacity * window_ratio))
+        self.__main_capacity = capacity - self.__window_capacity
+        self.__protected_capacity = max(1, int(self.__main_capacity * protected_ratio))
+        self.__sketch = CountMinSketch(16 * capacity, sample_size=10 * capacity)
+        self.__window: OrderedDict[str, Any] = OrderedDict()
+        self.__probation: OrderedDict[str, Any] = OrderedDict()
+        self.__protected: OrderedDict[str, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__window) + len(self.__probation) + len(self.__protected)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__window or key in self.__probation or key in self.__protected
+
+    def create(
+        self, key: str, value: Any, size: int | None = None, ttl: float | None = None
+    ) -> Any | None:
+        if ttl is not None:
+            raise ValueError(f"{self.__class__.__name__} does not support ttl")
+        self.__sketch.increment(key)
+        for segment in (self.__window, self.__probation, self.__protected):
+            if key in segment:
+                segment[key] = value
+                self.__hit(key)
+                return
+        self.__window[key] = value
+        if len(self.__window) <= self.__window_capacity:
+            return
+        return self.__admit(*self.__window.popitem(last=False))
+
+    def read(self, key: str):
+        if key not in self:
+            return
+        self.__sketch.increment(key)
+        return self.__hit(key)
+
+    def peek(self, key: str):
+        for segment in (self.__window, self.__probation, self.__protected):
+            if key in segment:
+                return segment[key]
+
+    def delete(self, key: str):
+        for segment in (self.__window, self.__probation, self.__protected):
+            segment.pop(key, None)
+
+    def keys(self) -> Iterator[str]:
+        yield from reversed(self.__window)
+        yield from reversed(self.__protected)
+        yield from reversed(self.__probation)
+
+    def __hit(self, key: str) -> Any:
+        if key in self.__window:
+            self.__window.move_to_end(key)
+            return self.__window[key]
+        if key in self.__protected:
+            self.__protected.move_to_end(key)
+            return self.__protected[key]
+        value = self.__probation.pop(key)
+        self.__protected[key] = value
+        if len(self.__protected) > self.__protected_capacity:
+            old_key, old_value = self.__protected.popitem(last=False)
+            self.__probation[old_key] = old_value
+        return value
+
+    def __admit(self, key: str, value: Any) -> Any | None:
+        if len(self.__probation) + len(self.__protected) < self.__main_capacity:
+            self.__probation[key] = value
+            return
+        victims = self.__probation if self.__probation else self.__protected
+        victim_key = next(iter(victims))
+        if self.__sketch.estimate(key) > self.__sketch.estimate(victim_key):
+            victim_value = victims.pop(victim_key)
+            self.__probation[key] = value
+            key, value = victim_key, victim_value
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return value
+
+
+POLICIES: Dict[str, Callable[[int], EvictionPolicy]] = {
+    "lru": LRU,
+    "sharded_lru": ShardedLRU,
+    "arc": ARC,
+    "2q": TwoQueue,
+    "w-tinylfu": WTinyLFU,
+}
+
+
+def make_policy(name: str, capacity: int) -> EvictionPolicy:
+    """Build the eviction policy registered under `name` with the given capacity"""
+    if name not in POLICIES:
+        raise ValueError(f"Unknown eviction policy {name}, expected one of {list(POLICIES)}")
+    return POLICIES[name](capacity)
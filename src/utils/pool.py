@@ -0,0 +1,283 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from pymemcache import serde
+from pymemcache.client.base import Client as PymemcacheBaseClient
+
+
+class PoolMetrics:
+    """Wait-time metrics of a pool
+
+    Args:
+        name (str): name of the pool
+        size (int): maximum number of connections of the pool
+    """
+
+    def __init__(self, name: str, size: int) -> None:
+        self.name = name
+        self.size = size
+        self.acquisitions = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.__lock = threading.Lock()
+
+    def record(self, wait: float, waited: bool) -> None:
+        with self.__lock:
+            self.acquisitions += 1
+            self.in_use += 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def release(self) -> None:
+        with self.__lock:
+            self.in_use -= 1
+
+    def timeout(self) -> None:
+        with self.__lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.__lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "acquisitions": self.acquisitions,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "mean_wait_seconds": self.wait_seconds / self.acquisitions
+                if self.acquisitions
+                else 0.0,
+            }
+
+
+# methods of the memcache clients forwarded by a `ClientPool`
+CLIENT_METHODS = {
+    "get",
+    "set",
+    "add",
+    "delete",
+    "touch",
+    "get_multi",
+    "set_multi",
+    "delete_multi",
+    "get_stats",
+    "flush_all",
+}
+
+# metrics of every pool by name, to export them
+POOL_METRICS: Dict[str, PoolMetrics] = {}
+
+
+def pool_metrics() -> Dict[str, Dict[str, float]]:
+    """Snapshot of the metrics of every pool"""
+    return {name: metrics.snapshot() for name, metrics in POOL_METRICS.items()}
+
+
+class Slots:
+    """Bounded number of concurrent requests, with wait-time metrics
+
+    Args:
+        name (str): name of the pool in `POOL_METRICS`
+        size (int): maximum number of concurrent requests
+        timeout (float | None, optional): maximum wait for a slot. Defaults to None.
+    """
+
+    def __init__(self, name: str, size: int, timeout: float | None = None) -> None:
+        self.timeout = timeout
+        self.metrics = POOL_METRICS[name] = PoolMetrics(name, size)
+        self.__semaphore = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        start = time.perf_counter()
+        waited = not self.__semaphore.acquire(blocking=False)
+        if waited and not self.__semaphore.acquire(timeout=self.timeout):
+            self.metrics.timeout()
+            raise TimeoutError(f"no free slot in {self.metrics.name}")
+        self.metrics.record(time.perf_counter() - start, waited)
+        try:
+            yield
+        finally:
+            self.metrics.release()
+            self.__semaphore.release()
+
+
+class ClientPool:
+    """Bounded pool of memcached connections, with wait-time metrics
+
+    The clients are created on demand by `factory`, up to `size`, and each call borrows
+    one client for its duration. The pool has the same methods as its clients, so it can
+    be given to `Mem` or `Mem_LRU` instead of a single shared `memcache.Client`.
+
+    A client whose call raised may have a half-read response on its connection: it is
+    disconnected and dropped instead of going back to the pool, and the next caller
+    creates a new client in its place.
+
+    Args:
+        factory (Callable[[], Any]): creates a client
+        size (int, optional): maximum number of clients. Defaults to 8.
+        timeout (float | None, optional): maximum wait for a client. Defaults to None.
+        name (str, optional): name of the pool in `POOL_METRICS`. Defaults to "memcached".
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        size: int = 8,
+        timeout: float | None = None,
+        name: str = "memcached",
+    ) -> None:
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.metrics = POOL_METRICS[name] = PoolMetrics(name, size)
+        self.log = logging.getLogger("ClientPool")
+        self.__idle: queue.LifoQueue = queue.LifoQueue()
+        self.__created = 0
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        start = time.perf_counter()
+        client, waited = self.__get()
+        if client is None:
+            self.metrics.timeout()
+            raise TimeoutError(f"no free client in {self.metrics.name}")
+        self.metrics.record(time.perf_counter() - start, waited)
+        broken = False
+        try:
+            yield client
+        except BaseException:
+            broken = True
+            raise
+        finally:
+            self.metrics.release()
+            if broken:
+                self.__discard(client)
+            else:
+                self.__idle.put(client)
+
+    def __get(self) -> Tuple[Any, bool]:
+        """Return an idle client or a new one, or wait for a client to be released
+
+        The idle queue holds None in place of the clients that were dropped or could not
+        be created, so that a waiting caller creates a new client in their slot.
+        """
+        try:
+            client, waited = self.__idle.get_nowait(), False
+        except queue.Empty:
+            with self.__lock:
+                create = self.__created < self.size
+                if create:
+                    self.__created += 1
+                    self.log.debug(
+                        "acquire - new client %s/%s", self.__created, self.size
+                    )
+            if create:
+                return self.__create(), False
+            try:
+                client, waited = self.__idle.get(timeout=self.timeout), True
+            except queue.Empty:
+                return None, True
+        if client is None:
+            return self.__create(), waited
+        return client, waited
+
+    def __create(self) -> Any:
+        try:
+            return self.factory()
+        except Exception:
+            # give the slot back, the pool would lose it for good otherwise
+            self.__idle.put(None)
+            raise
+
+    def __discard(self, client: Any) -> None:
+        self.log.warning("release - dropping a client whose call failed")
+        try:
+            if hasattr(client, "disconnect_all"):
+                client.disconnect_all()
+        except Exception as e:
+            self.log.error("release - disconnect failed: %s", e)
+        self.__idle.put(None)
+
+    def __getattr__(self, name: str):
+        if name not in CLIENT_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            with self.acquire() as client:
+                return getattr(client, name)(*args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+class PymemcacheClient:
+    """pymemcache client with the interface of `memcache.Client` used by the storages
+
+    It connects to one server and (de)serializes the values with pickle like
+    python-memcached, with compatible flags.
+
+    Args:
+        server (str): memcached server, "host:port"
+        **kwargs: arguments of `pymemcache.client.base.Client`
+    """
+
+    def __init__(self, server: str, **kwargs) -> None:
+        host, _, port = server.partition(":")
+        self.server = server
+        self.client = PymemcacheBaseClient(
+            (host, int(port or 11211)), serde=serde.pickle_serde, **kwargs
+        )
+
+    def get(self, key: str):
+        return self.client.get(key)
+
+    def set(self, key: str, value, time: int = 0) -> bool:
+        return self.client.set(key, value, expire=time, noreply=False)
+
+    def add(self, key: str, value, time: int = 0) -> bool:
+        return self.client.add(key, value, expire=time, noreply=False)
+
+    def delete(self, key: str) -> bool:
+        return self.client.delete(key, noreply=False)
+
+    def get_multi(self, keys: List[str]) -> Dict[str, Any]:
+        return self.client.get_many(keys)
+
+    def set_multi(self, mapping: Dict[str, Any], time: int = 0) -> List[str]:
+        return self.client.set_many(mapping, expire=time, noreply=False)
+
+    def delete_multi(self, keys: List[str]) -> bool:
+        return self.client.delete_many(keys, noreply=False)
+
+    def flush_all(self) -> bool:
+        return self.client.flush_all(noreply=False)
+
+    def get_stats(self) -> List:
+        stats = {
+            (name.decode() if isinstance(name, bytes) else name): value
+            for name, value in self.client.stats().items()
+        }
+        return [(self.server, stats)]
+
+    def disconnect_all(self) -> None:
+        self.client.close()
+
+
+def memcached_pool(
+    server: str = "localhost:11211", size: int = 8, timeout: float | None = None
+) -> ClientPool:
+    """Pool of `size` pymemcache connections to a memcached server"""
+    return ClientPool(lambda: PymemcacheClient(server), size, timeout)
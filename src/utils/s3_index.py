@@ -0,0 +1,93 @@
+import logging
+import threading
+from typing import Dict, Iterator, Set, Tuple
+
+
+class S3Index:
+    """Local index of the keys, sizes and ETags of a bucket
+
+    The index is filled by listing the bucket page by page: each `refresh` call lists up to
+    `max_pages` pages from where the previous call stopped, and the end of a full pass
+    removes the keys that were not listed anymore. The writes and deletes of the storage
+    update the index as they happen, so it stays current between the passes.
+
+    Until a first full pass is `complete`, a key missing from the index may exist in the
+    bucket, and `exists` and `size` return None for it.
+
+    Args:
+        aws: storage listing the bucket, with `list_objects(prefix, page_size)` pages
+        prefix (str, optional): prefix of the indexed keys. Defaults to "".
+        page_size (int, optional): number of keys per listing request. Defaults to 1000.
+    """
+
+    def __init__(self, aws, prefix: str = "", page_size: int = 1000) -> None:
+        self.aws = aws
+        self.prefix = prefix
+        self.page_size = page_size
+        self.complete = False
+        self.log = logging.getLogger("S3Index")
+        self.__entries: Dict[str, Tuple[int, str]] = {}
+        self.__seen: Set[str] = set()
+        self.__pages: Iterator | None = None
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__entries
+
+    def add(self, key: str, size: int, etag: str) -> None:
+        if not key.startswith(self.prefix):
+            return
+        with self.__lock:
+            self.__entries[key] = (size, etag)
+            self.__seen.add(key)
+
+    def discard(self, key: str) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__seen.discard(key)
+
+    def exists(self, key: str) -> bool | None:
+        """Whether the key exists, None if the index cannot tell"""
+        if key in self.__entries:
+            return True
+        return False if self.complete and key.startswith(self.prefix) else None
+
+    def size(self, key: str) -> int | None:
+        entry = self.__entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def etag(self, key: str) -> str | None:
+        entry = self.__entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def keys(self, prefix: str = "") -> Iterator[str]:
+        return (key for key in list(self.__entries) if key.startswith(prefix))
+
+    def refresh(self, max_pages: int | None = None) -> bool:
+        """List up to `max_pages` pages, and return whether a full pass ended"""
+        if self.__pages is None:
+            with self.__lock:
+                self.__seen = set()
+            self.__pages = self.aws.list_objects(self.prefix, page_size=self.page_size)
+        pages = 0
+        for page in self.__pages:
+            with self.__lock:
+                for obj in page:
+                    self.__entries[obj["Key"]] = (obj["Size"], obj["ETag"])
+                    self.__seen.add(obj["Key"])
+            pages += 1
+            if max_pages is not None and pages >= max_pages:
+                return False
+        with self.__lock:
+            removed = [key for key in self.__entries if key not in self.__seen]
+            for key in removed:
+                del self.__entries[key]
+            self.__pages = None
+            self.complete = True
+        self.log.debug(
+            "refresh - pass done, %s keys, %s removed", len(self.__entries), len(removed)
+        )
+        return True
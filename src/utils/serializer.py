@@ -0,0 +1,124 @@
+import logging
+import pickle
+import struct
+from typing import Any, List
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# header of the serialized values: 2 magic bytes and the type flag
+MAGIC = b"\xc8\x5e"
+HEADER_SIZE = len(MAGIC) + 1
+RAW = 0
+STR = 1
+PICKLE = 2
+PICKLE_OOB = 3
+MSGPACK = 4
+
+RAW_HEADER, STR_HEADER, PICKLE_HEADER, PICKLE_OOB_HEADER, MSGPACK_HEADER = (
+    MAGIC + bytes((flag,)) for flag in (RAW, STR, PICKLE, PICKLE_OOB, MSGPACK)
+)
+
+# number of out-of-band buffers, then the size of the pickle and of each buffer
+COUNT = struct.Struct("!I")
+SIZE = struct.Struct("!Q")
+
+
+class Serializer:
+    """Serializer of the values of the memcached tier, without the client's pickling
+
+    The bytes-like values (bytes, bytearray, memoryview) are stored as they are, without
+    a header, and read back as bytes. The other values, and the bytes starting with the
+    magic bytes (`MAGIC`), are prefixed with a header of 3 bytes, the magic bytes and a
+    type flag, so that the decoding is a lookup of the flag:
+
+    - `str` values are encoded in UTF-8,
+    - with `use_msgpack` and msgpack installed, the values msgpack supports are packed
+      with it, the tuples being read back as lists,
+    - the other values are pickled with protocol 5, the buffers of `oob_threshold` bytes
+      or more (`pickle.PickleBuffer`, e.g. of numpy arrays) being out-of-band: they are
+      appended to the pickle as they are, and read back as views of the value read,
+      without copies. The arrays read back from such views are read-only.
+
+    The values without header are read as they are, e.g. the ones pickled by the client.
+
+    Args:
+        use_msgpack (bool, optional): pack the values with msgpack if it is installed. Defaults to False.
+        oob_threshold (int, optional): minimum size of the out-of-band buffers. Defaults to 64KB.
+    """
+
+    def __init__(
+        self, use_msgpack: bool = False, oob_threshold: int = 64 * 1024
+    ) -> None:
+        self.use_msgpack = use_msgpack and msgpack is not None
+        self.oob_threshold = oob_threshold
+        self.log = logging.getLogger("Serializer")
+        self.__decoders = {
+            RAW: bytes,
+            STR: lambda body: str(body, "utf-8"),
+            PICKLE: pickle.loads,
+            PICKLE_OOB: self.__unpickle,
+            MSGPACK: self.__unpack,
+        }
+
+    def dumps(self, value: Any) -> bytes:
+        if type(value) is not bytes and isinstance(value, (bytearray, memoryview)):
+            value = bytes(value)
+        if type(value) is bytes:
+            return RAW_HEADER + value if value.startswith(MAGIC) else value
+        if type(value) is str:
+            return STR_HEADER + value.encode("utf-8")
+        if self.use_msgpack:
+            try:
+                return MSGPACK_HEADER + msgpack.packb(value, use_bin_type=True)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return self.__pickle(value)
+
+    def loads(self, data: Any) -> Any:
+        if type(data) is not bytes or not data.startswith(MAGIC):
+            return data
+        decoder = self.__decoders.get(data[2])
+        if decoder is None:
+            self.log.error("loads - unknown type flag %s", data[2])
+            return None
+        return decoder(memoryview(data)[HEADER_SIZE:])
+
+    def __pickle(self, value: Any) -> bytes:
+        buffers: List[pickle.PickleBuffer] = []
+
+        def out_of_band(buffer: pickle.PickleBuffer) -> bool:
+            # a false value makes the buffer out-of-band
+            if buffer.raw().nbytes < self.oob_threshold:
+                return True
+            buffers.append(buffer)
+            return False
+
+        data = pickle.dumps(value, protocol=5, buffer_callback=out_of_band)
+        if not buffers:
+            return PICKLE_HEADER + data
+        views = [buffer.raw() for buffer in buffers]
+        sizes = [SIZE.pack(len(data))] + [SIZE.pack(view.nbytes) for view in views]
+        count = COUNT.pack(len(views))
+        return b"".join([PICKLE_OOB_HEADER, count, *sizes, data, *views])
+
+    def __unpickle(self, body: memoryview) -> Any:
+        (count,) = COUNT.unpack_from(body)
+        offset = COUNT.size
+        sizes = []
+        for _ in range(count + 1):
+            sizes.append(SIZE.unpack_from(body, offset)[0])
+            offset += SIZE.size
+        views = []
+        for size in sizes:
+            views.append(body[offset : offset + size])
+            offset += size
+        return pickle.loads(views[0], buffers=views[1:])
+
+    def __unpack(self, body: memoryview) -> Any:
+        if msgpack is None:
+            self.log.error("loads - msgpack is not installed")
+            return None
+        return msgpack.unpackb(body, raw=False)
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+from memcache import Client
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, sharing its result with concurrent callers
+
+    The first caller of `do` for a key runs the function, and the callers arriving for the
+    same key while it runs wait for its result, or its exception, instead of running it
+    again. Used on cache misses so that a hot key is fetched once, not by every caller.
+    """
+
+    def __init__(self) -> None:
+        self.shared = 0
+        self.__calls: Dict[str, Future] = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key: str, function: Callable[[], Any]) -> Any:
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+        try:
+            value = function()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(value)
+            return value
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+
+
+class MemcachedLease:
+    """Compute a value missing from memcached once across processes
+
+    A process missing a key takes a lease with `add`, which only one client can win, then
+    computes the value and stores it. The other processes poll the key every `poll`
+    seconds until it is stored. A lease expires after `lease_ttl` seconds, so that another
+    process takes over if its holder died. Within a process, a `SingleFlight` keeps the
+    threads missing the same key from polling memcached on their own.
+
+    A process polling for more than `lease_ttl` seconds computes the value itself, and so
+    does a process finding memcached unreachable (neither the lease nor the value can be
+    stored nor read), without storing it.
+
+    Args:
+        client (Client): memcache client, or a `ClusterClient` taking the lease on the primary node
+        lease_ttl (int, optional): seconds before a lease expires. Defaults to 30.
+        poll (float, optional): seconds between two polls of a leased key. Defaults to 0.05.
+    """
+
+    def __init__(self, client: Client, lease_ttl: int = 30, poll: float = 0.05) -> None:
+        self.client = client
+        self.lease_ttl = lease_ttl
+        self.poll = poll
+        self.log = logging.getLogger("MemcachedLease")
+        self.flight = SingleFlight()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 0) -> Any:
+        """Value of the key, computed by `compute` and stored for `ttl` seconds if missing"""
+        value = self.client.get(key)
+        if value is not None:
+            return value
+        return self.flight.do(key, lambda: self.__lease(key, compute, ttl))
+
+    def __lease(self, key: str, compute: Callable[[], Any], ttl: int) -> Any:
+        lease_key = f"{key}:lease"
+        token = os.urandom(8).hex()
+        deadline = time.monotonic() + self.lease_ttl
+        while True:
+            acquired = self.__acquire(lease_key, token)
+            if acquired:
+                break
+            if acquired is None:
+                self.log.warning("lease - memcached unreachable, computing %s", key)
+                return compute()
+            if time.monotonic() >= deadline:
+                self.log.warning("lease - %s leased for %ss, computing it", key, self.lease_ttl)
+                return self.__compute(key, compute, ttl)
+            time.sleep(self.poll)
+            value = self.client.get(key)
+            if value is not None:
+                self.log.debug("lease - %s computed by another process", key)
+                return value
+        try:
+            # the value may have been stored between the miss and the lease
+            value = self.client.get(key)
+            if value is None:
+                value = self.__compute(key, compute, ttl)
+            return value
+        finally:
+            if self.client.get(lease_key) == token:
+                self.client.delete(lease_key)
+
+    def __acquire(self, lease_key: str, token: str) -> bool | None:
+        """Take the lease: True if taken, False if held by another client, None if
+        memcached is unreachable"""
+        if self.client.add(lease_key, token, time=self.lease_ttl):
+            return True
+        if self.client.get(lease_key) is not None:
+            return False
+        # the lease was released meanwhile, or no server answers
+        return True if self.client.add(lease_key, token, time=self.lease_ttl) else None
+
+    def __compute(self, key: str, compute: Callable[[], Any], ttl: int) -> Any:
+        self.log.debug("lease - computing %s", key)
+        value = compute()
+        if value is not None:
+            self.client.set(key, value, time=ttl)
+        return value
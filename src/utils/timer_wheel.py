@@ -0,0 +1,150 @@
+import logging
+import math
+import threading
+from typing import Dict, Iterable, List, Protocol
+
+
+class TimerWheel:
+    """Hierarchical timing wheel
+
+    Keys are scheduled at a deadline and returned by `advance` once the deadline has
+    passed, with a precision of `resolution` seconds. Each level has `slots` slots, and a
+    slot of the level `n` covers `slots ** n` ticks. The entries of a slot of an upper
+    level are cascaded to the lower levels when the time reaches the slot, so scheduling
+    and expiring a key cost O(1) amortized.
+
+    A key has at most one deadline: scheduling it again replaces its entry, and `cancel`
+    removes it, so the wheel holds one entry per scheduled key whatever the write rate.
+
+    Args:
+        resolution (float, optional): duration of a tick in seconds. Defaults to 1.0.
+        slots (int, optional): number of slots per level, a power of 2. Defaults to 64.
+        levels (int, optional): number of levels. Defaults to 4.
+        now (float, optional): current time. Defaults to 0.0.
+    """
+
+    def __init__(
+        self, resolution: float = 1.0, slots: int = 64, levels: int = 4, now: float = 0.0
+    ) -> None:
+        assert slots > 1 and slots & (slots - 1) == 0, "slots must be a power of 2"
+        self.__resolution = resolution
+        self.__bits = slots.bit_length() - 1
+        self.__mask = slots - 1
+        self.__levels = levels
+        # the slots map their keys to their deadline tick
+        self.__wheels: List[List[Dict[str, int]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        self.__overflow: Dict[str, int] = {}
+        # slot of each scheduled key, to cancel it in O(1)
+        self.__slots: Dict[str, Dict[str, int]] = {}
+        self.__tick = int(now / resolution)
+
+    def __len__(self) -> int:
+        return len(self.__slots)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots
+
+    def schedule(self, key: str, deadline: float) -> None:
+        """Schedule the key at the deadline, replacing its previous deadline if any"""
+        self.cancel(key)
+        tick = max(math.ceil(deadline / self.__resolution), self.__tick + 1)
+        self.__place(key, tick)
+
+    def cancel(self, key: str) -> None:
+        slot = self.__slots.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def advance(self, now: float) -> List[str]:
+        """Move the wheel to `now` and return the keys whose deadline has passed"""
+        target = int(now / self.__resolution)
+        expired: List[str] = []
+        bits, mask = self.__bits, self.__mask
+        while self.__tick < target:
+            if not self.__slots:
+                self.__tick = target
+                break
+            self.__tick += 1
+            tick = self.__tick
+            for level in range(1, self.__levels):
+                if tick & ((1 << (bits * level)) - 1):
+                    break
+                self.__cascade(self.__wheels[level], (tick >> (bits * level)) & mask, expired)
+            if not tick & ((1 << (bits * self.__levels)) - 1):
+                overflow, self.__overflow = self.__overflow, {}
+                for key, entry_tick in overflow.items():
+                    self.__place(key, entry_tick)
+            wheel = self.__wheels[0]
+            slot = wheel[tick & mask]
+            if slot:
+                wheel[tick & mask] = {}
+                for key in slot:
+                    del self.__slots[key]
+                expired.extend(slot)
+        return expired
+
+    def __place(self, key: str, tick: int) -> None:
+        bits = self.__bits
+        diff = tick ^ self.__tick
+        slot = self.__overflow
+        for level in range(self.__levels):
+            # the deadline is in the same block of `slots ** (level + 1)` ticks as now
+            if not diff >> (bits * (level + 1)):
+                slot = self.__wheels[level][(tick >> (bits * level)) & self.__mask]
+                break
+        slot[key] = tick
+        self.__slots[key] = slot
+
+    def __cascade(
+        self, wheel: List[Dict[str, int]], index: int, expired: List[str]
+    ) -> None:
+        entries = wheel[index]
+        if not entries:
+            return
+        wheel[index] = {}
+        for key, tick in entries.items():
+            if tick <= self.__tick:
+                del self.__slots[key]
+                expired.append(key)
+            else:
+                self.__place(key, tick)
+
+
+class Expirable(Protocol):
+    def expire(self) -> int:
+        ...
+
+
+class ExpiryReaper(threading.Thread):
+    """Background thread reclaiming the expired entries of caches in bulk
+
+    It calls `expire()` on each target every `interval` seconds. The targets must be safe
+    to use from another thread, e.g. storages backed by a `ShardedLRU`.
+
+    Args:
+        targets (Iterable[Expirable]): caches or storages with an `expire` method
+        interval (float, optional): seconds between two reclamations. Defaults to 1.0.
+    """
+
+    def __init__(self, targets: Iterable[Expirable], interval: float = 1.0) -> None:
+        super().__init__(name="expiry-reaper", daemon=True)
+        self.targets = list(targets)
+        self.interval = interval
+        self.log = logging.getLogger("ExpiryReaper")
+        self.__stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.__stopped.wait(self.interval):
+            for target in self.targets:
+                try:
+                    count = target.expire()
+                    if count:
+                        self.log.debug("run - %s expired entries", count)
+                except Exception as e:
+                    self.log.error(e)
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        self.join()
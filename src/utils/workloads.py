@@ -0,0 +1,201 @@
+import bisect
+import itertools
+import math
+import random
+from typing import Dict, Iterator, List, Tuple
+
+READ = "read"
+WRITE = "write"
+
+
+class Uniform:
+    """Keys accessed with the same probability"""
+
+    def __init__(self, keys: int) -> None:
+        self.keys = keys
+
+    def sample(self, rng: random.Random, step: int) -> int:
+        return rng.randrange(self.keys)
+
+    def probability(self, index: int) -> float:
+        return 1 / self.keys
+
+
+class Zipf:
+    """Key of rank `i` (from 0) accessed with a probability proportional to `1 / (i+1)^s`
+
+    Args:
+        keys (int): number of keys
+        s (float, optional): skew, 0 being uniform. Defaults to 0.99.
+    """
+
+    def __init__(self, keys: int, s: float = 0.99) -> None:
+        self.keys = keys
+        self.s = s
+        weights = [1 / (rank + 1) ** s for rank in range(keys)]
+        self.__total = sum(weights)
+        self.__cdf = list(itertools.accumulate(weights))
+
+    def sample(self, rng: random.Random, step: int) -> int:
+        index = bisect.bisect_left(self.__cdf, rng.random() * self.__total)
+        return min(index, self.keys - 1)
+
+    def probability(self, index: int) -> float:
+        return 1 / (index + 1) ** self.s / self.__total
+
+
+class Scan:
+    """Keys accessed in order, over and over, e.g. by a batch job"""
+
+    def __init__(self, keys: int) -> None:
+        self.keys = keys
+
+    def sample(self, rng: random.Random, step: int) -> int:
+        return step % self.keys
+
+    def probability(self, index: int) -> float:
+        return 1 / self.keys
+
+
+class Fixed:
+    """Values of `size` bytes"""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def sample(self, rng: random.Random) -> int:
+        return self.size
+
+
+class UniformSize:
+    """Values of `low` to `high` bytes, uniformly"""
+
+    def __init__(self, low: int, high: int) -> None:
+        self.low = low
+        self.high = high
+
+    def sample(self, rng: random.Random) -> int:
+        return rng.randint(self.low, self.high)
+
+
+class LogNormal:
+    """Values of `median` bytes, spread by `sigma` like object sizes usually are
+
+    Args:
+        median (int): median size in bytes
+        sigma (float, optional): standard deviation of the log of the sizes. Defaults to 1.
+        high (int | None, optional): maximum size in bytes. Defaults to None.
+    """
+
+    def __init__(
+        self, median: int, sigma: float = 1.0, high: int | None = None
+    ) -> None:
+        self.median = median
+        self.sigma = sigma
+        self.high = high
+
+    def sample(self, rng: random.Random) -> int:
+        size = max(1, int(rng.lognormvariate(math.log(self.median), self.sigma)))
+        return min(size, self.high) if self.high is not None else size
+
+
+DISTRIBUTIONS = {"uniform": Uniform, "zipf": Zipf, "scan": Scan}
+
+
+def parse_sizes(spec: str):
+    """Size distribution of a spec like `fixed:4096`, `uniform:1024:65536` or `lognormal:16384:1.0`"""
+    name, *args = spec.split(":")
+    if name == "fixed" and len(args) == 1:
+        return Fixed(int(args[0]))
+    if name == "uniform" and len(args) == 2:
+        return UniformSize(int(args[0]), int(args[1]))
+    if name == "lognormal" and len(args) in (1, 2, 3):
+        high = int(args[2]) if len(args) == 3 else None
+        sigma = float(args[1]) if len(args) > 1 else 1.0
+        return LogNormal(int(args[0]), sigma, high)
+    raise ValueError(f"Unknown size distribution {spec}")
+
+
+class Workload:
+    """Reproducible sequence of reads and writes of a set of keys
+
+    The keys are accessed following `distribution` (`Uniform`, `Zipf` or `Scan`), each
+    operation being a read with probability `read_ratio`, else a write. The size of the
+    value of each key is drawn once from `sizes`, so that the writes of a key keep its
+    size. The same seed gives the same operations, sizes and values.
+
+    Args:
+        name (str): name of the workload in the results
+        distribution: key popularity, with `sample(rng, step)` and `probability(index)`
+        sizes: size distribution of the values, with `sample(rng)`
+        operations (int, optional): number of operations. Defaults to 10000.
+        read_ratio (float, optional): share of reads. Defaults to 0.9.
+        seed (int, optional): seed of the random generators. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        distribution,
+        sizes,
+        operations: int = 10000,
+        read_ratio: float = 0.9,
+        seed: int = 0,
+    ) -> None:
+        self.name = name
+        self.distribution = distribution
+        self.operations = operations
+        self.read_ratio = read_ratio
+        self.seed = seed
+        rng = random.Random(seed)
+        self.keys = [f"key-{index:06d}" for index in range(distribution.keys)]
+        self.sizes = [sizes.sample(rng) for _ in self.keys]
+        # the values are slices of one random buffer, at an offset depending on the key
+        self.__buffer = rng.randbytes(2 * max(self.sizes))
+
+    def value(self, index: int) -> bytes:
+        offset = index * 7919 % (len(self.__buffer) // 2)
+        return self.__buffer[offset : offset + self.sizes[index]]
+
+    def rate(self, index: int) -> float:
+        """Expected accesses of the key per 10000 operations, its cost in `Tiering`"""
+        return self.distribution.probability(index) * 10000
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        """Operations and indexes of their keys"""
+        rng = random.Random(self.seed + 1)
+        for step in range(self.operations):
+            operation = READ if rng.random() < self.read_ratio else WRITE
+            yield operation, self.distribution.sample(rng, step)
+
+    def config(self) -> Dict:
+        return {
+            "name": self.name,
+            "distribution": type(self.distribution).__name__.lower(),
+            "sizes": {"min": min(self.sizes), "max": max(self.sizes)},
+            "keys": len(self.keys),
+            "operations": self.operations,
+            "read_ratio": self.read_ratio,
+            "seed": self.seed,
+            "bytes": sum(self.sizes),
+        }
+
+
+def presets(keys: int, operations: int, seed: int = 0) -> List[Workload]:
+    """Workloads run by default by the benchmark"""
+    return [
+        Workload("zipf-read-heavy", Zipf(keys), Fixed(4096), operations, 0.95, seed),
+        Workload("uniform-mixed", Uniform(keys), Fixed(4096), operations, 0.5, seed),
+        Workload("scan", Scan(keys), Fixed(4096), operations, 1.0, seed),
+        Workload(
+            "write-heavy", Zipf(keys), UniformSize(1024, 65536), operations, 0.1, seed
+        ),
+        Workload(
+            "lognormal-sizes",
+            Zipf(keys),
+            LogNormal(16384, 1.0, 1024 * 1024),
+            operations,
+            0.9,
+            seed,
+        ),
+    ]
@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+import weakref
+from typing import Dict, Tuple
+
+CREATE = "create"
+DELETE = "delete"
+
+Operation = Tuple[str, bytes | None]
+
+
+class WriteBehindQueue:
+    """Bounded queue of writes applied to a storage by background workers
+
+    `create` and `delete` return as soon as the operation is queued, and `workers` threads
+    apply the operations to the `target` storage. A key has at most one pending operation:
+    a new write of a key still waiting in the queue replaces the previous one, and a key is
+    never written by two workers at once, so the last write of a key always lands last.
+
+    When `max_pending` keys are waiting, the writers block (up to `timeout`, then
+    TimeoutError) until the workers catch up. A failed operation is retried `retries` times
+    with an exponential backoff from `backoff` seconds, then kept in `failed`, until a new
+    write of the key replaces it.
+
+    `flush()` is a durability barrier: it returns once every operation queued before it is
+    applied, and raises IOError if some of them failed. `close()` flushes and stops the
+    workers. It is also called when the queue is garbage collected, and at the exit of the
+    interpreter for the queues still open: the workers only reference the operations of
+    the queue (`_Operations`), not the queue itself, so a queue dropped without `close()`
+    does not stay alive until the exit.
+
+    Args:
+        target: storage the operations are applied to, with `create` and `delete` methods
+        max_pending (int, optional): number of queued keys blocking the writers. Defaults to 1024.
+        workers (int, optional): number of worker threads. Defaults to 4.
+        retries (int, optional): retries of a failed operation. Defaults to 5.
+        backoff (float, optional): seconds before the first retry. Defaults to 0.1.
+        timeout (float | None, optional): seconds a writer waits for room in the queue. Defaults to None.
+        name (str, optional): name of the queue, for the threads and logs. Defaults to "write-behind".
+    """
+
+    def __init__(
+        self,
+        target,
+        max_pending: int = 1024,
+        workers: int = 4,
+        retries: int = 5,
+        backoff: float = 0.1,
+        timeout: float | None = None,
+        name: str = "write-behind",
+    ) -> None:
+        self.__operations = _Operations(
+            target, max_pending, workers, retries, backoff, timeout, name
+        )
+        # runs once: on `close()`, on garbage collection or at the exit
+        self.__close = weakref.finalize(self, self.__operations.close)
+
+    def __getattr__(self, name: str):
+        return getattr(self.__operations, name)
+
+    def __len__(self) -> int:
+        return len(self.__operations)
+
+    def close(self) -> None:
+        """Flush the queue and stop the workers"""
+        self.__close()
+
+
+class _Operations:
+    """Pending operations and workers of a `WriteBehindQueue`"""
+
+    def __init__(
+        self,
+        target,
+        max_pending: int,
+        workers: int,
+        retries: int,
+        backoff: float,
+        timeout: float | None,
+        name: str,
+    ) -> None:
+        self.target = target
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.name = name
+        self.failed: Dict[str, Exception] = {}
+        self.coalesced = 0
+        self.log = logging.getLogger("WriteBehindQueue")
+        self.__pending: Dict[str, Operation] = {}
+        self.__running: Dict[str, Operation] = {}
+        self.__errors: Dict[str, Exception] = {}
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__threads = [
+            threading.Thread(target=self.__work, name=f"{name}-{index}", daemon=True)
+            for index in range(workers)
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def __len__(self) -> int:
+        with self.__condition:
+            return len(self.__pending) + len(self.__running)
+
+    def create(self, key: str, data: bytes) -> None:
+        self.__put(key, (CREATE, data))
+
+    def delete(self, key: str) -> None:
+        self.__put(key, (DELETE, None))
+
+    def get(self, key: str) -> Operation | None:
+        """Last operation of the key not applied yet, None if there is none"""
+        with self.__condition:
+            return self.__pending.get(key) or self.__running.get(key)
+
+    def peek(self, key: str) -> bytes | None:
+        """Value of the key waiting to be written, None if no write of the key is waiting
+
+        Raises:
+            FileNotFoundError: if the key waits to be deleted
+        """
+        operation = self.get(key)
+        if operation is None:
+            return None
+        kind, data = operation
+        if kind == DELETE:
+            raise FileNotFoundError(key)
+        return data
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Wait until the operations queued so far are applied
+
+        Raises:
+            TimeoutError: if they are not applied within `timeout` seconds
+            IOError: if some of them failed after all their retries
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(
+                lambda: not self.__pending and not self.__running, timeout
+            ):
+                raise TimeoutError(f"{self.name}: {len(self)} operations pending")
+            errors, self.__errors = self.__errors, {}
+        if errors:
+            raise IOError(
+                f"{self.name}: {len(errors)} operations failed: {list(errors)}"
+            )
+
+    def close(self) -> None:
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+        if self.failed:
+            self.log.error(
+                "close - %s operations lost: %s", len(self.failed), list(self.failed)
+            )
+
+    def __put(self, key: str, operation: Operation) -> None:
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError(f"{self.name} is closed")
+            if key in self.__pending:
+                self.coalesced += 1
+            elif not self.__condition.wait_for(
+                lambda: len(self.__pending) < self.max_pending, self.timeout
+            ):
+                raise TimeoutError(
+                    f"{self.name}: {self.max_pending} operations pending"
+                )
+            self.__pending[key] = operation
+            self.failed.pop(key, None)
+            self.__condition.notify_all()
+
+    def __take(self) -> Tuple[str, Operation] | None:
+        with self.__condition:
+            while True:
+                # the oldest key that no other worker is writing
+                key = next(
+                    (key for key in self.__pending if key not in self.__running), None
+                )
+                if key is not None:
+                    operation = self.__pending.pop(key)
+                    self.__running[key] = operation
+                    self.__condition.notify_all()
+                    return key, operation
+                if self.__closed and not self.__pending:
+                    return None
+                self.__condition.wait()
+
+    def __work(self) -> None:
+        while True:
+            item = self.__take()
+            if item is None:
+                return
+            key, operation = item
+            error = self.__apply(key, operation)
+            with self.__condition:
+                del self.__running[key]
+                if error is not None:
+                    self.__errors[key] = error
+                    if key not in self.__pending:
+                        self.failed[key] = error
+                self.__condition.notify_all()
+
+    def __apply(self, key: str, operation: Operation) -> Exception | None:
+        kind, data = operation
+        for attempt in range(self.retries + 1):
+            try:
+                if kind == CREATE:
+                    self.target.create(key, data)
+                else:
+                    self.target.delete(key)
+                return None
+            except Exception as e:
+                if attempt == self.retries:
+                    self.log.error("apply - %s %s failed: %s", kind, key, e)
+                    return e
+                self.log.warning(
+                    "apply - %s %s, retry %s: %s", kind, key, attempt + 1, e
+                )
+                time.sleep(self.backoff * 2**attempt)
+        return None
@@ -1,11 +1,14 @@
 import os
+import random
 import sys
+import threading
 import unittest
 
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
 )
-from utils.LRU import LRU
+from utils.LRU import LRU, ShardedLRU
+from utils.timer_wheel import TimerWheel
 
 
 class TestLRU(unittest.TestCase):
@@ -34,6 +37,152 @@ class TestLRU(unittest.TestCase):
 
         lru.delete("A")
         self.assertEqual(lru.read("A"), None)
+        lru._check_invariants()
+
+    def test_lru_max_bytes(self):
+        evicted = []
+        lru = LRU(None, 10, on_evict=lambda key, value: evicted.append(key))
+        lru.create("K", b"12345")
+        lru.create("A", b"1234")
+        self.assertEqual(lru.size, 9)
+        self.assertEqual(lru.read("K"), b"12345")
+
+        del_value = lru.create("B", b"123")
+        self.assertEqual(del_value, b"1234")
+        self.assertEqual(evicted, ["A"])
+        self.assertEqual(list(lru.keys()), ["B", "K"])
+        self.assertEqual(lru.size, 8)
+
+        lru.create("K", b"1", size=1)
+        self.assertEqual(lru.size, 4)
+
+        lru.create("C", b"", size=20)
+        self.assertEqual(evicted, ["A", "B", "K", "C"])
+        self.assertEqual(len(lru), 0)
+        lru._check_invariants()
+
+    def test_lru_ttl(self):
+        now = [0.0]
+        expired = []
+        lru = LRU(10, clock=lambda: now[0])
+        lru.on_evict = lambda key, value: expired.append(key)
+        lru.create("K", 1, ttl=5)
+        lru.create("A", 2, ttl=100)
+        lru.create("B", 3)
+        now[0] = 4.0
+        self.assertEqual(lru.read("K"), 1)
+        now[0] = 6.0
+        self.assertEqual(lru.peek("K"), None)
+        self.assertEqual(lru.read("K"), None)
+        self.assertEqual(expired, ["K"])
+
+        lru.create("C", 4, ttl=10)
+        lru.create("C", 5, ttl=1000)
+        now[0] = 200.0
+        self.assertEqual(lru.expire(), 1)
+        self.assertEqual(expired, ["K", "A"])
+        self.assertEqual(lru.read("C"), 5)
+        self.assertEqual(lru.read("B"), 3)
+        lru._check_invariants()
+
+    def test_lru_load(self):
+        evicted = []
+        lru = LRU(3, on_evict=lambda key, value: evicted.append(key))
+        lru.create("B", 0)
+        lru.load([("A", 1, 1, None), ("B", 2, 1, None), ("C", 3, 1, 10), ("D", 4, 1, None)])
+        self.assertEqual(list(lru.keys()), ["D", "C", "B"])
+        self.assertEqual(evicted, ["A"])
+        self.assertEqual(lru.read("B"), 2)
+        lru._check_invariants()
+
+
+class TestTimerWheel(unittest.TestCase):
+    def test_timer_wheel(self):
+        wheel = TimerWheel(resolution=1.0, slots=4, levels=2)
+        deadlines = {f"key-{i}": i * 1.5 for i in range(1, 30)}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+        self.assertEqual(len(wheel), 29)
+
+        fired = {}
+        for now in range(0, 60):
+            for key in wheel.advance(now):
+                fired[key] = now
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(set(fired), set(deadlines))
+        for key, deadline in deadlines.items():
+            self.assertGreaterEqual(fired[key], deadline)
+            self.assertLess(fired[key], deadline + 1)
+
+    def test_cancel(self):
+        wheel = TimerWheel(resolution=1.0, slots=4, levels=2)
+        for i in range(100):
+            wheel.schedule("K", 10.0 + i)
+        wheel.schedule("A", 5.0)
+        wheel.schedule("B", 50.0)
+        self.assertEqual(len(wheel), 3)
+        wheel.cancel("B")
+        wheel.cancel("missing")
+        self.assertEqual(len(wheel), 2)
+        self.assertEqual(wheel.advance(20.0), ["A"])
+        self.assertEqual(wheel.advance(200.0), ["K"])
+        self.assertEqual(len(wheel), 0)
+
+        now = [0.0]
+        lru = LRU(2, clock=lambda: now[0])
+        for i in range(1000):
+            lru.create(f"key-{i}", i, ttl=100)
+            lru.create("K", i, ttl=100)
+        lru.create("K", 0)
+        lru.delete("key-999")
+        # the overwritten, evicted and deleted keys leave nothing in the wheel
+        self.assertEqual(len(lru._LRU__wheel), 0)
+
+
+class TestShardedLRU(unittest.TestCase):
+    def test_sharded_lru(self):
+        lru = ShardedLRU(4, shards=2, buffer_size=1)
+        self.assertEqual(lru.read("K"), None)
+        lru.create("K", 1)
+        self.assertEqual(lru.read("K"), 1)
+        self.assertTrue("K" in lru)
+        lru.delete("K")
+        self.assertEqual(lru.read("K"), None)
+        lru._check_invariants()
+
+    def test_sharded_lru_stress(self):
+        evicted = []
+        lru = ShardedLRU(64, shards=4, buffer_size=8)
+        lru.on_evict = lambda key, value: evicted.append(key)
+        errors = []
+
+        def worker(seed: int):
+            rng = random.Random(seed)
+            try:
+                for _ in range(5000):
+                    key = f"key-{rng.randrange(200)}"
+                    op = rng.random()
+                    if op < 0.3:
+                        lru.create(key, key)
+                    elif op < 0.9:
+                        value = lru.read(key)
+                        assert value is None or value == key
+                    else:
+                        lru.delete(key)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        lru._check_invariants()
+        self.assertLessEqual(len(lru), 64)
+        self.assertEqual(len(list(lru.keys())), len(lru))
+        self.assertTrue(evicted)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from memcache import Client
+from utils.aio_memcached import AsyncClient
+from utils.memcached_server import MemcachedServer
+
+
+class TestAsyncClient(unittest.TestCase):
+    def setUp(self):
+        self.servers = [MemcachedServer().start() for _ in range(2)]
+        for server in self.servers:
+            self.addCleanup(server.stop)
+        self.addresses = [server.address for server in self.servers]
+
+    def test_python_memcached_values(self):
+        client = Client(self.addresses)
+        values = {f"key-{i}": value for i, value in enumerate([b"bytes", "text", 42])}
+        values["object"] = {"a": [1, 2]}
+        client.set_multi(values)
+        aio = AsyncClient(self.addresses)
+
+        async def run():
+            self.assertEqual(await aio.get_multi(list(values) + ["missing"]), values)
+            self.assertIsNone(await aio.get("missing"))
+            self.assertEqual(await aio.set_multi({"async": ("a", 1), "n": 7}), [])
+            self.assertFalse(await aio.add("n", 8))
+            self.assertTrue(await aio.delete_multi(["key-0", "missing"]))
+
+        asyncio.run(run())
+        # the same keys on the same servers
+        self.assertEqual(client.get("async"), ("a", 1))
+        self.assertEqual(client.get("n"), 7)
+        self.assertIsNone(client.get("key-0"))
+        counts = [len(server.items) for server in self.servers]
+        self.assertEqual(sum(counts), 5)
+        self.assertNotIn(0, counts)
+
+    def test_invalid(self):
+        aio = AsyncClient(self.addresses)
+
+        async def run():
+            with self.assertRaises(ValueError):
+                await aio.get("with space")
+            with self.assertRaises(ValueError):
+                await aio.set("k" * 251, b"value")
+            # not stored, as with python-memcached
+            self.assertEqual(await aio.set_multi({"large": b"x" * 2_000_000}), ["large"])
+
+        asyncio.run(run())
+
+    def test_dead_server(self):
+        aio = AsyncClient(self.addresses[:1], dead_retry=0.2, socket_timeout=0.5)
+
+        async def run():
+            self.assertTrue(await aio.set("K", b"value"))
+            self.servers[0].stop()
+            start = time.monotonic()
+            self.assertIsNone(await aio.get("K"))
+            self.assertFalse(await aio.set("K", b"value"))
+            self.assertFalse(await aio.delete("K"))
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertFalse(aio.servers[0].alive)
+            await asyncio.sleep(0.25)
+            self.assertTrue(aio.servers[0].alive)
+
+        asyncio.run(run())
+
+    def test_pool_size(self):
+        server = MemcachedServer(latency=0.1).start()
+        self.addCleanup(server.stop)
+        aio = AsyncClient([server.address], pool_size=2)
+
+        async def run():
+            start = time.monotonic()
+            await asyncio.gather(*(aio.get(f"{i}") for i in range(4)))
+            return time.monotonic() - start
+
+        # the 4 requests on 2 connections, in another loop each time
+        for _ in range(2):
+            elapsed = asyncio.run(run())
+            self.assertGreaterEqual(elapsed, 0.2)
+            self.assertLess(elapsed, 0.35)
+
+
+if __name__ == "__main__":
+    unittest.main()
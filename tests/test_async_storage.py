@@ -0,0 +1,267 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from memcache import Client
+from test_local_storage import DictStorage
+from utils.aio_memcached import AsyncClient
+from utils.async_storage import (
+    AsyncAdapter,
+    AsyncAuto_tiering,
+    AsyncAWSS3,
+    AsyncFileSystem,
+    AsyncMem,
+    AsyncReplica,
+    AsyncTwoLevelCaching,
+)
+from utils.base_storage import MB, Mem
+from utils.codec import Codec
+from utils.fake_s3 import AsyncFakeS3Client
+from utils.memcached_server import MemcachedServer
+from utils.serializer import Serializer
+
+
+class SlowStorage(DictStorage):
+    """DictStorage taking `delay` seconds per operation"""
+
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+
+    def create(self, key: str, data: bytes):
+        time.sleep(self.delay)
+        super().create(key, data)
+
+    def read(self, key: str) -> bytes:
+        time.sleep(self.delay)
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        return super().read(key)
+
+
+class TestAsyncStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.server = MemcachedServer().start()
+        self.addCleanup(self.server.stop)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_replica_parallel(self):
+        fs = AsyncAdapter(SlowStorage(0.1))
+        aws = AsyncAdapter(SlowStorage(0.1))
+        replica = AsyncReplica(fs, aws)
+
+        async def run():
+            start = time.perf_counter()
+            await replica.create("K", b"value")
+            elapsed = time.perf_counter() - start
+            del fs.storage.objects["K"]
+            self.assertEqual(await replica.read("K"), b"value")
+            self.assertEqual(fs.storage.objects["K"], b"value")
+            return elapsed
+
+        self.assertLess(asyncio.run(run()), 0.18)
+
+    def test_limit(self):
+        storage = AsyncAdapter(SlowStorage(0.05), limit=2)
+
+        async def run():
+            start = time.perf_counter()
+            await asyncio.gather(*(storage.create(f"{i}", b"") for i in range(6)))
+            return time.perf_counter() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.15)
+
+    def test_backends(self):
+        fs = AsyncFileSystem()
+        mem = AsyncMem(AsyncClient([self.server.address]))
+
+        async def run():
+            await fs.create_multi({self.path("A"): b"a", self.path("B"): b"b"})
+            self.assertEqual(await fs.read(self.path("A")), b"a")
+            values = await fs.read_multi([self.path("A"), self.path("C")])
+            self.assertEqual(values, {self.path("A"): b"a"})
+            with self.assertRaises(FileNotFoundError):
+                await fs.read(self.path("C"))
+
+            await mem.create("K", b"x" * 3_000_000)
+            self.assertEqual(await mem.read("K"), b"x" * 3_000_000)
+            self.assertEqual(await mem.read_multi(["K", "L"]), {"K": b"x" * 3_000_000})
+            await mem.delete("K")
+            self.assertIsNone(await mem.read("K"))
+            # the chunks are deleted with the value
+            self.assertEqual(len(self.server.items), 0)
+
+        asyncio.run(run())
+
+    def test_file_system_options(self):
+        fs = AsyncFileSystem(mmap_threshold=1, root=self.directory.name)
+
+        async def run():
+            await fs.create("K", b"value")
+            self.assertEqual(bytes(await fs.read("K")), b"value")
+
+        asyncio.run(run())
+        self.assertEqual(list(fs.storage.keys()), ["K"])
+        self.assertIsInstance(fs.storage.read("K"), memoryview)
+
+    def test_aws(self):
+        client = AsyncFakeS3Client(latency=0.05)
+        aws = AsyncAWSS3(
+            limit=4, client=client, multipart_threshold=12 * MB, part_size=5 * MB
+        )
+        data = os.urandom(1024) * (13 * 1024)
+
+        async def run():
+            await aws.create_multi({"small": b"value", "empty": b"", "large": data})
+            self.assertEqual(client.calls["UploadPart"], 3)
+            self.assertEqual(client.buckets["ensta"]["large"][0], data)
+            self.assertEqual(await aws.read("small"), b"value")
+            self.assertEqual(await aws.read("empty"), b"")
+            large = await aws.read("large")
+            self.assertEqual(large, data)
+            self.assertIsInstance(large, bytearray)
+            values = await aws.read_multi(["small", "missing"])
+            self.assertEqual(values, {"small": b"value"})
+            await aws.delete_multi([f"{i}" for i in range(1500)] + ["small", "large"])
+            self.assertEqual(client.calls["DeleteObjects"], 2)
+            self.assertEqual(list(client.buckets["ensta"]), ["empty"])
+
+            # the requests overlap on the loop, at most `limit` at once
+            start = time.monotonic()
+            await aws.create_multi({f"{i}": b"value" for i in range(8)})
+            self.assertLess(time.monotonic() - start, 0.15)
+            self.assertEqual(client.peak, 4)
+
+        asyncio.run(run())
+
+    def test_mem_shared_with_sync(self):
+        codec, serializer = Codec(threshold=16), Serializer()
+        sync = Mem(Client([self.server.address]), 1000, codec, serializer)
+        mem = AsyncMem(AsyncClient([self.server.address]), 1000, codec, serializer)
+        values = {"text": "é" * 1000, "object": {"a": [1, 2]}, "raw": os.urandom(5000)}
+
+        async def run():
+            await mem.create_multi(values)
+            self.assertEqual({key: sync.read(key) for key in values}, values)
+            sync.create("sync", os.urandom(3000))
+            self.assertEqual(await mem.read("sync"), sync.read("sync"))
+            await mem.delete_multi(list(values) + ["sync"])
+            self.assertEqual(sync.read_multi(list(values) + ["sync"]), {})
+
+        asyncio.run(run())
+
+    def test_auto_tiering(self):
+        fs, aws, mem = (AsyncAdapter(DictStorage()) for _ in range(3))
+        tiering = AsyncAuto_tiering(fs, aws, mem)
+
+        async def run():
+            await tiering.create("K", b"value")
+            self.assertIn("K", aws.storage.objects)
+            # within the hysteresis of the threshold of the filesystem
+            for _ in range(110):
+                self.assertEqual(await tiering.read("K"), b"value")
+            self.assertTrue(await tiering.flush())
+            self.assertIs(tiering.storage("K"), aws)
+            for _ in range(40):
+                self.assertEqual(await tiering.read("K"), b"value")
+            self.assertTrue(await tiering.flush())
+            self.assertIs(tiering.storage("K"), fs)
+            self.assertNotIn("K", aws.storage.objects)
+            self.assertIn("K", fs.storage.objects)
+            await tiering.delete("K")
+            self.assertNotIn("K", fs.storage.objects)
+            with self.assertRaises(FileNotFoundError):
+                await tiering.delete("K")
+            await tiering.close()
+
+        asyncio.run(run())
+
+    def test_auto_tiering_capacities(self):
+        fs, aws, mem = (AsyncAdapter(DictStorage()) for _ in range(3))
+        tiering = AsyncAuto_tiering(
+            fs, aws, mem, sweep_interval=0.05, fs_capacity=300, mem_capacity=100
+        )
+        # the scores do not decay during the test
+        tiering.placement.clock = lambda: 0.0
+        sizes = {"A": 100, "B": 100, "C": 50, "D": 50, "E": 300}
+
+        async def run():
+            for key, size in sizes.items():
+                await tiering.create(key, key.encode() * size)
+            # scores per byte: C 0.2 > D 0.1 > B 0.05 > A 0.01 > E 0.0067
+            for key, reads in {"A": 1, "B": 5, "C": 10, "D": 5, "E": 2}.items():
+                for _ in range(reads):
+                    await tiering.read(key)
+            deadline = time.monotonic() + 5
+            while tiering.storage("C") is not mem and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            self.assertTrue(await tiering.flush(timeout=5))
+            await tiering.close()
+
+        asyncio.run(run())
+        tiers = {key: tiering.storage(key) for key in sizes}
+        self.assertEqual(tiers, {"A": fs, "B": fs, "C": mem, "D": mem, "E": aws})
+        self.assertEqual(tiering.placement.used, [300, 200, 100])
+
+    def test_auto_tiering_slow_move(self):
+        fs = AsyncAdapter(SlowStorage(0.2))
+        aws, mem = AsyncAdapter(DictStorage()), AsyncAdapter(DictStorage())
+        tiering = AsyncAuto_tiering(fs, aws, mem)
+
+        async def run():
+            await tiering.create("K", b"value")
+            start = time.perf_counter()
+            # the reads above the hysteresis start the move without waiting for it
+            for _ in range(130):
+                self.assertEqual(await tiering.read("K"), b"value")
+            await asyncio.sleep(0)
+            # and the reads during the copy still find the file in aws
+            self.assertEqual(await tiering.read("K"), b"value")
+            self.assertLess(time.perf_counter() - start, 0.15)
+            self.assertIn("K", aws.storage.objects)
+            await tiering.flush()
+            self.assertEqual(list(fs.storage.objects), ["K"])
+            self.assertNotIn("K", aws.storage.objects)
+            self.assertEqual(await tiering.read("K"), b"value")
+            await tiering.close()
+
+        asyncio.run(run())
+
+    def test_two_level_caching(self):
+        aws = AsyncAdapter(DictStorage())
+        cache = AsyncTwoLevelCaching(
+            AsyncClient([self.server.address]), 4, 2, shards=1, aws=aws
+        )
+        keys = [self.path(f"{i}") for i in range(8)]
+
+        async def run():
+            await asyncio.gather(*(cache.create(key, key.encode()) for key in keys))
+            self.assertEqual(len(aws.storage.objects), 8)
+            self.assertEqual(len(os.listdir(self.directory.name)), 4)
+            # the values evicted from the memcached tier are deleted from memcached
+            self.assertEqual(len(self.server.items), 2)
+            values = await asyncio.gather(*(cache.read(key) for key in keys))
+            self.assertEqual(values, [key.encode() for key in keys])
+            self.assertEqual(
+                await cache.read_multi(keys), {key: key.encode() for key in keys}
+            )
+            self.assertEqual(len(self.server.items), 2)
+            await cache.delete_multi(keys[-2:])
+            self.assertEqual(len(aws.storage.objects), 6)
+            # the evicted files are not on the disk anymore
+            await cache.delete(keys[0])
+            await cache.delete_multi(keys[1:3])
+            self.assertEqual(len(aws.storage.objects), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from benchmark import STORAGES, benchmark, compare
+from utils.workloads import READ, Fixed, LogNormal, Scan, Workload, Zipf, parse_sizes
+
+
+class TestWorkloads(unittest.TestCase):
+    def test_reproducible(self):
+        def workload(seed: int) -> Workload:
+            return Workload("w", Zipf(100), LogNormal(1000), 1000, 0.8, seed)
+
+        first, second = workload(1), workload(1)
+        self.assertEqual(list(first), list(second))
+        self.assertEqual(first.sizes, second.sizes)
+        self.assertEqual(first.value(3), second.value(3))
+        self.assertEqual(len(first.value(3)), first.sizes[3])
+        self.assertNotEqual(list(first), list(workload(2)))
+
+        operations = list(first)
+        reads = sum(operation == READ for operation, _ in operations)
+        self.assertAlmostEqual(reads / 1000, 0.8, delta=0.05)
+        # the most popular key is accessed far more than the least popular one
+        hot = sum(index == 0 for _, index in operations)
+        cold = sum(index == 99 for _, index in operations)
+        self.assertGreater(hot, 10 * max(cold, 1))
+        self.assertAlmostEqual(sum(map(first.rate, range(100))), 10000)
+
+    def test_scan(self):
+        workload = Workload("scan", Scan(3), Fixed(10), 7, 1.0)
+        self.assertEqual([index for _, index in workload], [0, 1, 2, 0, 1, 2, 0])
+
+    def test_parse_sizes(self):
+        self.assertEqual(parse_sizes("fixed:10").size, 10)
+        sizes = parse_sizes("lognormal:1000:0.5:2000")
+        self.assertEqual((sizes.median, sizes.sigma, sizes.high), (1000, 0.5, 2000))
+        with self.assertRaises(ValueError):
+            parse_sizes("pareto:10")
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        workload = Workload("zipf", Zipf(20), Fixed(100), 200, 0.9)
+        report = benchmark(STORAGES, [workload], s3_latency=0.0)
+        report = json.loads(json.dumps(report))
+        self.assertEqual(report["config"]["workloads"][0]["keys"], 20)
+        results = {result["storage"]: result for result in report["results"]}
+        self.assertEqual(list(results), list(STORAGES))
+        for result in results.values():
+            self.assertEqual(result["errors"], 0)
+            self.assertGreater(result["throughput"], 0)
+            latency = result["latency"]["read"]
+            self.assertLessEqual(latency["p50"], latency["p99"])
+            writes = result["latency"]["write"]["count"]
+            self.assertEqual(latency["count"] + writes, 200)
+        self.assertEqual(results["mem"]["tiers"]["mem"]["hit_ratio"], 1.0)
+        # every write is copied to S3
+        replica = results["replica"]
+        self.assertEqual(replica["bytes_moved"], replica["bytes_written"])
+
+        lines = compare(report, report)
+        self.assertEqual(len(lines), len(STORAGES))
+        self.assertIn("throughput +0.0%", lines[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from memcache import Client
+from utils.base_storage import Mem
+from utils.cluster import ClusterClient, HashRing
+from utils.memcached_server import MemcachedServer
+from utils.pool import memcached_pool
+
+
+class TestHashRing(unittest.TestCase):
+    def test_remapping(self):
+        nodes = [f"10.0.0.{i}:11211" for i in range(5)]
+        ring = HashRing(nodes)
+        keys = [f"image-{i}.jpg" for i in range(5000)]
+        before = {key: ring.get_nodes(key)[0] for key in keys}
+        counts = [list(before.values()).count(node) for node in nodes]
+        self.assertLess(max(counts) / min(counts), 1.6)
+
+        ring.remove(nodes[2])
+        after = {key: ring.get_nodes(key)[0] for key in keys}
+        moved = [key for key in keys if before[key] != after[key]]
+        self.assertTrue(all(before[key] == nodes[2] for key in moved))
+        self.assertEqual(len(moved), counts[2])
+
+        ring.add(nodes[2])
+        self.assertEqual({key: ring.get_nodes(key)[0] for key in keys}, before)
+        self.assertEqual(len(set(ring.get_nodes("K", 3))), 3)
+
+
+class TestClusterClient(unittest.TestCase):
+    def setUp(self):
+        self.servers = [MemcachedServer().start() for _ in range(3)]
+        self.client = ClusterClient([server.address for server in self.servers], 2)
+        self.addCleanup(self.client.disconnect_all)
+
+    def tearDown(self):
+        for server in self.servers:
+            try:
+                server.stop()
+            except OSError:
+                pass
+
+    def test_replicas(self):
+        mem = Mem(self.client)
+        mem.create("K", b"value")
+        owners = [s for s in self.servers if b"K" in s.items]
+        self.assertEqual(len(owners), 2)
+        self.assertEqual(mem.read("K"), b"value")
+
+        mem.create_multi({f"key-{i}": b"%d" % i for i in range(50)})
+        self.assertEqual(sum(len(server.items) for server in self.servers), 102)
+        values = mem.read_multi([f"key-{i}" for i in range(50)])
+        self.assertEqual(values, {f"key-{i}": b"%d" % i for i in range(50)})
+
+        mem.delete("K")
+        self.assertEqual(mem.read("K"), None)
+
+    def test_dead_node(self):
+        mem = Mem(self.client)
+        mem.create_multi({f"key-{i}": b"%d" % i for i in range(50)})
+        dead = self.servers[0]
+        dead.stop()
+
+        for i in range(50):
+            self.assertEqual(mem.read(f"key-{i}"), b"%d" % i)
+        self.assertNotIn(dead.address, self.client.ring.nodes)
+        self.assertEqual(len(self.client.ring.nodes), 2)
+
+        mem.create("K", b"value")
+        self.assertEqual(mem.read("K"), b"value")
+        self.client.mark_alive(dead.address)
+        # the node is still down: it cannot be flushed and stays out of the ring
+        self.assertNotIn(dead.address, self.client.ring.nodes)
+
+    def test_revived_node(self):
+        self.check_revival(self.client)
+
+    def test_revived_pooled_node(self):
+        client = ClusterClient(
+            [server.address for server in self.servers],
+            2,
+            client_factory=lambda node: memcached_pool(node, size=2),
+        )
+        self.addCleanup(client.disconnect_all)
+        self.check_revival(client)
+
+    def test_flush_outside_lock(self):
+        flushing = threading.Event()
+        release = threading.Event()
+
+        class SlowFlushClient(Client):
+            def flush_all(self):
+                flushing.set()
+                release.wait(5)
+                return super().flush_all()
+
+        nodes = [server.address for server in self.servers]
+        client = ClusterClient(nodes, 2, lambda node: SlowFlushClient([node]))
+        self.addCleanup(client.disconnect_all)
+        client.mark_dead(nodes[0])
+        reviver = threading.Thread(target=client.mark_alive, args=(nodes[0],))
+        reviver.start()
+        self.assertTrue(flushing.wait(5))
+        # another node dies while the first one is being flushed
+        client.mark_dead(nodes[1])
+        self.assertEqual(client.ring.nodes, [nodes[2]])
+        release.set()
+        reviver.join()
+        self.assertEqual(sorted(client.ring.nodes), sorted(nodes[::2]))
+
+    def check_revival(self, client: ClusterClient):
+        mem = Mem(client)
+        keys = [f"key-{i}" for i in range(50)]
+        mem.create_multi({key: b"old" for key in keys})
+        node = self.servers[0].address
+        client.mark_dead(node)
+        self.assertEqual(client.delete_multi(keys[:25]), 1)
+        mem.create_multi({key: b"new" for key in keys[25:]})
+
+        client.mark_alive(node)
+        self.assertIn(node, client.ring.nodes)
+        self.assertEqual(len(self.servers[0].items), 0)
+        # neither the deleted nor the overwritten values come back
+        self.assertEqual(mem.read_multi(keys[:25]), {})
+        self.assertEqual(mem.read_multi(keys[25:]), {key: b"new" for key in keys[25:]})
+
+
+if __name__ == "__main__":
+    unittest.main()
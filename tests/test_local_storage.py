@@ -0,0 +1,779 @@
+import gc
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+from typing import Dict, Iterable
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from utils.base_storage import FileSystem, Mem, Storage
+from utils.chunking import parse_manifest
+from utils.codec import MAGIC, RAW, Codec
+from utils.complex_storage import Auto_tiering, Replica, Tiering, TwoLevelCaching
+from utils.cost_model import CostModel, LatencyModel
+from utils.LRU_storage import FileSystem_LRU
+from utils.migration import RateLimiter
+
+
+class DictClient(dict):
+    """In-memory stand-in for a memcache client"""
+
+    def set(self, key, value, time=0):
+        self[key] = value
+        return True
+
+    def get(self, key):
+        return super().get(key)
+
+    def delete(self, key):
+        self.pop(key, None)
+        return 1
+
+    def set_multi(self, mapping, time=0):
+        self.update(mapping)
+        return []
+
+    def get_multi(self, keys):
+        return {key: self[key] for key in keys if key in self}
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.pop(key, None)
+        return 1
+
+
+class DictStorage(Storage):
+    """In-memory stand-in for AWSS3 recording the batched reads"""
+
+    def __init__(self) -> None:
+        self.objects: Dict[str, bytes] = {}
+        self.batches = []
+
+    def create(self, key: str, data: bytes):
+        self.objects[key] = data
+
+    def read(self, key: str) -> bytes:
+        return self.objects[key]
+
+    def delete(self, key: str):
+        del self.objects[key]
+
+    def delete_multi(self, keys: Iterable[str]):
+        for key in keys:
+            self.objects.pop(key, None)
+
+    def read_multi(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(keys)
+        self.batches.append(keys)
+        return {key: self.objects[key] for key in keys if key in self.objects}
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_filesystem_read_multi(self):
+        fs = FileSystem()
+        fs.create_multi({self.path("A"): b"a" * 10, self.path("B"): b""})
+        values = fs.read_multi([self.path("A"), self.path("B"), self.path("C")])
+        self.assertEqual(values, {self.path("A"): b"a" * 10, self.path("B"): b""})
+
+    def test_two_level_caching_read_multi(self):
+        client = DictClient()
+        cache = TwoLevelCaching(client, 10, 5, aws=DictStorage())
+        keys = [self.path(f"key-{i}") for i in range(8)]
+        for i, key in enumerate(keys):
+            cache.aws.create(key, bytes([i]) * 100)
+
+        cache.mem_lru.create(keys[0], cache.aws.objects[keys[0]])
+        cache.fs_lru.create(keys[1], cache.aws.objects[keys[1]])
+        values = cache.read_multi(keys[:4] + [self.path("missing")])
+        self.assertEqual(values, {key: cache.aws.objects[key] for key in keys[:4]})
+        self.assertEqual(cache.aws.batches, [keys[2:4] + [self.path("missing")]])
+        for key in keys[1:4]:
+            self.assertEqual(client[key], cache.aws.objects[key])
+
+        self.assertEqual(cache.read_multi(keys[:4]), values)
+        self.assertEqual(len(cache.aws.batches), 1)
+
+        cache.delete_multi(keys[1:4])
+        self.assertEqual(cache.read_multi(keys[1:4]), {})
+
+
+class TestChunking(unittest.TestCase):
+    def test_mem_chunks(self):
+        client = DictClient()
+        mem = Mem(client, chunk_size=10)
+        value = bytes(range(35))
+        mem.create("K", value)
+        mem.create("A", b"small")
+        # the manifest, its copy, 4 chunks and the small value
+        self.assertEqual(len(client), 7)
+        self.assertEqual(mem.read("K"), value)
+        self.assertEqual(mem.read_multi(["K", "A", "B"]), {"K": value, "A": b"small"})
+
+        mem.create("K", value[::-1])
+        self.assertEqual(mem.read("K"), value[::-1])
+        gets = []
+        client.get = lambda key: gets.append(key) or dict.get(client, key)
+        mem.delete("K")
+        del client.get
+        # only the copy of the manifest is fetched, with the chunks of the last write
+        self.assertEqual(gets, ["K:manifest"])
+        self.assertEqual(mem.read("K"), None)
+        # the small value and the chunks of the overwritten value, left to memcached
+        self.assertEqual(len(client), 5)
+
+        mem.create("K", value)
+        del client[parse_manifest(client["K"]).chunk_keys("K")[1]]
+        self.assertEqual(mem.read("K"), None)
+        self.assertEqual(mem.read_multi(["K", "A"]), {"A": b"small"})
+
+        mem.create_multi({"K": value, "B": value[:20]})
+        self.assertEqual(mem.read_multi(["K", "B"]), {"K": value, "B": value[:20]})
+        mem.delete_multi(["K", "B", "A"])
+        self.assertEqual(mem.read_multi(["K", "B", "A"]), {})
+        self.assertFalse(any(key.startswith("B") for key in client))
+
+
+class TestCodec(unittest.TestCase):
+    def test_codec(self):
+        codec = Codec(threshold=100, sample_size=1000)
+        text = b"memcached " * 1000
+        noise = b"\x00" + os.urandom(5000)
+        encoded = codec.encode("text", text)
+        self.assertLess(len(encoded), len(text) // 10)
+        self.assertEqual(codec.decode("text", encoded), text)
+        # the raw values are stored as they are
+        self.assertIs(codec.encode("noise", noise), noise)
+        self.assertEqual(codec.encode("small", b"small"), b"small")
+        escaped = codec.encode("magic", MAGIC + b"small")
+        self.assertEqual(escaped[len(MAGIC)], RAW)
+        self.assertEqual(codec.decode("magic", escaped), MAGIC + b"small")
+        self.assertEqual(codec.decode("int", 42), 42)
+        self.assertEqual(codec.stats("text").bytes_in, len(text))
+        self.assertGreater(codec.stats("text").bytes_saved, 0)
+        self.assertEqual(codec.stats("noise").bytes_saved, 0)
+
+    def test_mem_codec(self):
+        client = DictClient()
+        mem = Mem(client, chunk_size=100, codec=Codec(threshold=100))
+        text = b"memcached " * 1000
+        noise = os.urandom(500)
+        mem.create_multi({"text": text, "noise": noise})
+        self.assertLess(sum(len(value) for value in client.values()), 1000)
+        self.assertEqual(mem.read("text"), text)
+        self.assertEqual(mem.read_multi(["text", "noise"]), {"text": text, "noise": noise})
+
+
+class TestStreams(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "F")
+        self.data = os.urandom(2_500_000)
+
+    def test_filesystem(self):
+        fs = FileSystem(mmap_threshold=1_000_000)
+        fs.write_stream(self.path, [self.data[:10], self.data[10:]])
+        value = fs.read(self.path)
+        self.assertIsInstance(value, memoryview)
+        self.assertTrue(value.readonly)
+        self.assertEqual(value, self.data)
+        fs.create(self.path + "-small", b"small")
+        self.assertEqual(fs.read(self.path + "-small"), b"small")
+
+        chunks = [bytes(chunk) for chunk in fs.read_stream(self.path, 1_000_000)]
+        self.assertEqual([len(chunk) for chunk in chunks], [1_000_000, 1_000_000, 500_000])
+        self.assertEqual(b"".join(chunks), self.data)
+
+    def test_mem(self):
+        client = DictClient()
+        mem = Mem(client)
+        FileSystem().create(self.path, self.data)
+        mem.write_stream("K", FileSystem().read_stream(self.path, 300_000))
+        self.assertEqual(len(client), 5)
+        self.assertEqual(mem.read("K"), self.data)
+        self.assertEqual(b"".join(mem.read_stream("K")), self.data)
+
+        mem.write_stream("small", [b"a", b"b"])
+        self.assertEqual(client["small"], b"ab")
+        self.assertEqual(b"".join(mem.read_stream("small")), b"ab")
+        mem.create("view", memoryview(b"value"))
+        self.assertEqual(mem.read("view"), b"value")
+
+        del client[parse_manifest(client["K"]).chunk_keys("K")[1]]
+        with self.assertRaises(FileNotFoundError):
+            b"".join(mem.read_stream("K"))
+
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = os.path.join(self.directory.name, "cache")
+
+    def test_sharded_root(self):
+        fs = FileSystem(root=self.root, fsync_every=4)
+        keys = ["image.jpg", "dir/image.jpg", "..", "%41", "x" * 300]
+        for key in keys:
+            fs.create(key, key.encode())
+        for key in keys:
+            path = fs.path(key)
+            self.assertTrue(path.startswith(self.root + os.sep))
+            self.assertEqual(len(os.path.relpath(path, self.root).split(os.sep)), 3)
+            self.assertEqual(fs.read(key), key.encode())
+        self.assertEqual(sorted(fs.keys()), sorted(keys[:-1]))
+        self.assertEqual(fs.read_multi(["%41", "missing"]), {"%41": b"%41"})
+        fs.sync()
+
+        fs.delete("..")
+        with self.assertRaises(FileNotFoundError):
+            fs.read("..")
+
+    def test_atomic_write(self):
+        fs = FileSystem(root=self.root)
+        fs.create("K", b"old")
+
+        def chunks():
+            yield b"new"
+            raise IOError("interrupted")
+
+        with self.assertRaises(IOError):
+            fs.write_stream("K", chunks())
+        self.assertEqual(fs.read("K"), b"old")
+        self.assertEqual(len(list(fs.layout.files())), 1)
+
+        with open(os.path.join(os.path.dirname(fs.path("K")), "%%tmp-left"), "wb"):
+            pass
+        self.assertEqual(FileSystem(root=self.root).layout.clean(), 0)
+        self.assertEqual(list(fs.keys()), ["K"])
+
+    def test_lru_root(self):
+        lru = FileSystem_LRU(2, root=self.root)
+        for key in "ABC":
+            lru.create(key, key.encode())
+        self.assertEqual(sorted(lru.fs.keys()), ["B", "C"])
+        self.assertIsNone(lru.read("A"))
+        lru.write_stream("D", [b"d", b"d"])
+        self.assertEqual(lru.read("D"), b"dd")
+        self.assertEqual(b"".join(lru.read_stream("D")), b"dd")
+        self.assertEqual(sorted(lru.fs.keys()), ["C", "D"])
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = os.path.join(self.directory.name, "cache")
+
+    def reopen(self, cache: FileSystem_LRU, capacity: int = 3) -> FileSystem_LRU:
+        cache.close()
+        return FileSystem_LRU(capacity, root=self.root, persistent=True)
+
+    def test_restart(self):
+        cache = FileSystem_LRU(3, root=self.root, persistent=True)
+        for key in "ABCD":
+            cache.create(key, key.encode() * 2)
+        cache.create("T", b"t", ttl=0.05)
+        self.assertEqual(cache.read("C"), b"CC")
+
+        cache = self.reopen(cache)
+        time.sleep(0.06)
+        cache = self.reopen(cache)
+        self.assertEqual(list(cache.lru.keys()), ["C", "D"])
+        self.assertEqual(cache.lru.size, 4)
+        self.assertEqual(cache.read("D"), b"DD")
+        self.assertEqual(sorted(cache.fs.keys()), ["C", "D"])
+
+        cache.create("E", b"E")
+        cache.create("F", b"F")
+        self.assertIsNone(cache.read("C"))
+        os.remove(cache.fs.path("D"))
+        cache = self.reopen(cache, 2)
+        self.assertIsNone(cache.read("D"))
+        self.assertEqual(list(cache.lru.keys()), ["F", "E"])
+
+    def test_torn_journal_and_scan(self):
+        cache = FileSystem_LRU(10, root=self.root, persistent=True)
+        for key in "ABC":
+            cache.create(key, b"x")
+            time.sleep(0.01)
+        cache.close()
+        with open(cache.journal.path, "ab") as file:
+            file.write(b"C\x00\x05")
+        cache = self.reopen(cache, 10)
+        self.assertEqual(list(cache.lru.keys()), ["C", "B", "A"])
+
+        cache.close()
+        os.remove(cache.journal.path)
+        cache = self.reopen(cache, 2)
+        self.assertEqual(list(cache.lru.keys()), ["C", "B"])
+        self.assertEqual(sorted(cache.fs.keys()), ["B", "C"])
+
+    def test_compaction(self):
+        cache = FileSystem_LRU(5, root=self.root, persistent=True)
+        cache.journal.min_records = 10
+        for i in range(50):
+            cache.create(f"{i % 7}", b"x")
+            cache.read(f"{i % 7}")
+        self.assertLess(os.path.getsize(cache.journal.path), 300)
+        keys = list(cache.lru.keys())
+        self.assertEqual(list(self.reopen(cache, 5).lru.keys()), keys)
+
+
+class GatedStorage(DictStorage):
+    """DictStorage whose writes wait for a gate and fail `failures` times first"""
+
+    def __init__(self, failures: int = 0) -> None:
+        super().__init__()
+        self.gate = threading.Event()
+        self.failures = failures
+        self.writes = 0
+
+    def create(self, key: str, data: bytes):
+        self.gate.wait()
+        self.writes += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("unreachable")
+        super().create(key, data)
+
+    def delete(self, key: str):
+        # deleting a missing object succeeds on S3
+        self.objects.pop(key, None)
+
+
+class TestReplica(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.fs = FileSystem(root=self.directory.name)
+
+    def test_concurrent(self):
+        aws = DictStorage()
+        replica = Replica(self.fs, aws, mode="concurrent")
+        self.addCleanup(replica.close)
+        replica.create("A", b"a")
+        replica.create_multi({"B": b"b", "C": b"c"})
+        self.assertEqual(aws.objects, {"A": b"a", "B": b"b", "C": b"c"})
+        self.assertEqual(sorted(self.fs.keys()), ["A", "B", "C"])
+        replica.delete_multi(["A", "B"])
+        self.assertEqual(aws.objects, {"C": b"c"})
+        with self.assertRaises(ValueError):
+            Replica(self.fs, aws, mode="eventual")
+
+        # the aws writes of concurrent callers run in parallel
+        barrier = threading.Barrier(4, timeout=5)
+        aws.create = lambda key, data: barrier.wait()
+        threads = [
+            threading.Thread(target=replica.create, args=(f"key-{i}", b"v"))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(barrier.broken)
+
+    def test_write_behind(self):
+        aws = GatedStorage()
+        replica = Replica(self.fs, aws, mode="write-behind", workers=1)
+        self.addCleanup(replica.close)
+        self.addCleanup(aws.gate.set)
+        # the worker waits on "X", the other writes stay queued
+        replica.create("X", b"x")
+        replica.create("A", b"a1")
+        replica.create("B", b"b")
+        replica.create("A", b"a2")
+        self.assertEqual(aws.objects, {})
+        self.assertEqual(replica.queue.coalesced, 1)
+
+        self.fs.delete("A")
+        self.assertEqual(replica.read("A"), b"a2")
+        replica.delete("B")
+        with self.assertRaises(FileNotFoundError):
+            replica.read("B")
+        self.assertEqual(replica.read_multi(["A", "B"]), {"A": b"a2"})
+
+        aws.gate.set()
+        replica.flush()
+        self.assertEqual(aws.objects, {"X": b"x", "A": b"a2"})
+        self.assertEqual(aws.writes, 2)
+
+        # the delete reaches aws even though "A" is gone from the filesystem
+        replica.delete("A")
+        replica.flush()
+        self.assertEqual(aws.objects, {"X": b"x"})
+
+    def test_write_behind_retries(self):
+        aws = GatedStorage(failures=2)
+        aws.gate.set()
+        replica = Replica(
+            self.fs, aws, mode="write-behind", retries=1, backoff=0.001
+        )
+        replica.create("A", b"a")
+        with self.assertRaises(IOError):
+            replica.flush()
+        self.assertIn("A", replica.queue.failed)
+
+        replica.create("A", b"a")
+        replica.close()
+        self.assertEqual(aws.objects, {"A": b"a"})
+        self.assertEqual(replica.queue.failed, {})
+        with self.assertRaises(RuntimeError):
+            replica.create("B", b"b")
+
+
+    def test_write_behind_collected(self):
+        aws = DictStorage()
+        replica = Replica(self.fs, aws, mode="write-behind", workers=2)
+        replica.create("A", b"a")
+        queue = weakref.ref(replica.queue)
+        threads = [
+            thread
+            for thread in threading.enumerate()
+            if thread.name.startswith("replica-write-behind")
+        ]
+        del replica
+        gc.collect()
+        # a queue dropped without close() is flushed, and its workers stopped
+        self.assertIsNone(queue())
+        self.assertEqual(aws.objects, {"A": b"a"})
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+
+class TestWritePolicies(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.client = DictClient()
+        self.aws = DictStorage()
+
+    def cache(self, **kwargs) -> TwoLevelCaching:
+        cache = TwoLevelCaching(
+            self.client, 4, 2, fs_root=self.directory.name, aws=self.aws, **kwargs
+        )
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_write_around(self):
+        cache = self.cache(write_policy="write-around")
+        cache.create("A", b"a")
+        self.assertEqual(self.aws.objects, {"A": b"a"})
+        self.assertEqual((len(cache.mem_lru.lru), len(cache.fs_lru.lru)), (0, 0))
+        self.assertEqual(cache.read("A"), b"a")
+        self.assertIn("A", cache.fs_lru.lru)
+
+        cache.create("A", b"b")
+        self.assertNotIn("A", cache.mem_lru.lru)
+        self.assertNotIn("A", cache.fs_lru.lru)
+        self.assertEqual(cache.read_multi(["A"]), {"A": b"b"})
+
+    def test_write_back(self):
+        self.aws = GatedStorage()
+        cache = self.cache(write_policy="write-back", write_back_workers=1)
+        self.addCleanup(self.aws.gate.set)
+        cache.create_multi({"A": b"a", "B": b"b", "C": b"c"})
+        self.assertEqual(self.aws.objects, {})
+        self.assertEqual(cache.read("A"), b"a")
+        # evicted from both tiers before reaching aws
+        cache.delete_multi(["C"])
+        for key in "DEFG":
+            cache.create(key, key.encode())
+        self.assertEqual(cache.read("B"), b"b")
+        self.assertEqual(cache.read_multi(["A", "C"]), {"A": b"a"})
+
+        self.aws.gate.set()
+        cache.flush()
+        self.assertEqual(sorted(self.aws.objects), list("ABDEFG"))
+
+    def test_write_back_options(self):
+        with self.assertRaises(TypeError):
+            self.cache(write_back_workers=1)
+        with self.assertRaises(TypeError):
+            self.cache(write_policy="write-around", write_back_retries=1)
+        with self.assertRaises(TypeError):
+            self.cache(write_policy="write-back", workers=1)
+        cache = self.cache(write_policy="write-back", write_back_max_pending=2)
+        self.assertEqual(cache.queue.max_pending, 2)
+
+    def test_exclusive(self):
+        cache = self.cache(exclusive=True)
+        for key in "ABCD":
+            cache.create(key, key.encode())
+        self.assertEqual(list(cache.mem_lru.lru.keys()), ["D", "C"])
+        self.assertEqual(list(cache.fs_lru.lru.keys()), ["B", "A"])
+
+        self.assertEqual(cache.read("A"), b"A")
+        self.assertEqual(list(cache.mem_lru.lru.keys()), ["A", "D"])
+        self.assertEqual(list(cache.fs_lru.lru.keys()), ["C", "B"])
+        self.assertEqual(sorted(cache.fs_lru.fs.keys()), ["B", "C"])
+
+        self.assertEqual(cache.read_multi(["B", "E"]), {"B": b"B"})
+        self.assertEqual(list(cache.mem_lru.lru.keys()), ["B", "A"])
+        self.assertEqual(list(cache.fs_lru.lru.keys()), ["D", "C"])
+        self.assertEqual(len(self.client), 2)
+
+        cache.delete("C")
+        self.assertEqual(sorted(cache.fs_lru.fs.keys()), ["D"])
+        self.assertEqual(sorted(self.aws.objects), ["A", "B", "D"])
+
+
+class TestAutoTiering(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.aws = DictStorage()
+        self.tiering = Auto_tiering(
+            FileSystem(root=self.directory.name),
+            self.aws,
+            Mem(DictClient()),
+            half_life=60,
+            sweep_interval=0.05,
+        )
+        self.addCleanup(self.tiering.close)
+        self.now = 0.0
+        self.tiering.placement.clock = lambda: self.now
+
+    def read(self, filename: str, count: int) -> None:
+        for _ in range(count):
+            self.assertEqual(self.tiering.read(filename)[:1], filename.encode())
+
+    def wait_for(self, condition) -> None:
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.tiering.flush()
+
+    def test_promotion_and_demotion(self):
+        tiering = self.tiering
+        for filename in "AB":
+            tiering.create(filename, filename.encode())
+        self.read("A", 150)
+        # within the hysteresis of the threshold
+        self.read("B", 110)
+        tiering.flush()
+        self.assertIs(tiering.storage("A"), tiering.fs)
+        self.assertIs(tiering.storage("B"), tiering.aws)
+        self.assertEqual(list(self.aws.objects), ["B"])
+
+        self.read("A", 1100)
+        tiering.flush()
+        self.assertIs(tiering.storage("A"), tiering.mem)
+        self.assertEqual(list(tiering.fs.keys()), [])
+
+        # 78 after 4 half-lives, under the threshold of the filesystem and its hysteresis
+        self.now += 240
+        self.wait_for(lambda: tiering.storage("A") is tiering.aws)
+        self.assertIs(tiering.storage("A"), tiering.aws)
+        self.assertEqual(self.aws.objects["A"], b"A")
+        self.assertEqual(tiering.moves, 3)
+
+        tiering.delete("A")
+        self.assertNotIn("A", self.aws.objects)
+        with self.assertRaises(FileNotFoundError):
+            tiering.read("A")
+
+    def test_capacities(self):
+        self.tiering.close()
+        tiering = self.tiering = Auto_tiering(
+            FileSystem(root=self.directory.name),
+            self.aws,
+            Mem(DictClient()),
+            half_life=60,
+            sweep_interval=0.05,
+            fs_capacity=300,
+            mem_capacity=100,
+        )
+        self.addCleanup(tiering.close)
+        tiering.placement.clock = lambda: self.now
+        sizes = {"A": 100, "B": 100, "C": 50, "D": 50, "E": 300}
+        for filename, size in sizes.items():
+            tiering.create(filename, filename.encode() * size)
+        self.assertEqual(tiering.placement.used, [600, 0, 0])
+
+        # the first reads fill memcached, which has room
+        self.read("A", 1)
+        tiering.flush()
+        self.assertIs(tiering.storage("A"), tiering.mem)
+
+        # scores per byte: C 0.2 > D 0.1 > B 0.05 > A 0.01 > E 0.0067
+        for filename, reads in {"B": 5, "C": 10, "D": 5, "E": 2}.items():
+            self.read(filename, reads)
+        self.wait_for(lambda: tiering.storage("C") is tiering.mem)
+        placement = {filename: tiering.storage(filename) for filename in sizes}
+        self.assertEqual(
+            placement,
+            {
+                "A": tiering.fs,
+                "B": tiering.fs,
+                "C": tiering.mem,
+                "D": tiering.mem,
+                "E": tiering.aws,
+            },
+        )
+        self.assertEqual(tiering.placement.used, [300, 200, 100])
+        self.assertEqual(sorted(tiering.fs.keys()), ["A", "B"])
+
+    def test_rate_limit(self):
+        limiter = RateLimiter(10, burst=2)
+        self.assertEqual([limiter.wait(), limiter.wait()], [0.0, 0.0])
+        self.assertAlmostEqual(limiter.wait(), 0.1, places=2)
+
+
+class TestCostModel(unittest.TestCase):
+    def test_latency_model(self):
+        model = LatencyModel(1.0, 1.0, min_samples=5)
+        for size in range(1000, 5000, 1000):
+            model.observe(size, 0.01 + size / 1e6)
+        self.assertEqual(model.fit(), (1.0, 1.0))
+        for size in range(1000, 100000, 1000):
+            model.observe(size, 0.01 + size / 1e6)
+        latency, per_byte = model.fit()
+        self.assertAlmostEqual(latency, 0.01)
+        self.assertAlmostEqual(per_byte, 1e-6)
+        self.assertAlmostEqual(model.snapshot()["throughput"], 1e6)
+
+        # a single size: the prior throughput is kept and the latency fitted
+        model = LatencyModel(1.0, 1e6, min_samples=5)
+        for _ in range(10):
+            model.observe(1000, 0.002)
+        self.assertAlmostEqual(model.estimate(1000), 0.002)
+        self.assertAlmostEqual(model.estimate(2000), 0.003)
+
+    def test_placement(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        aws = DictStorage()
+        # the priors are kept, so that the placement does not depend on the machine
+        model = CostModel({"fs": 20, "mem": 10}, min_samples=10**9)
+        tiering = Tiering(
+            FileSystem(root=directory.name), aws, Mem(DictClient()), model
+        )
+        self.addCleanup(tiering.close)
+
+        tiering.create("A", b"A" * 4, 100)
+        self.assertEqual(tiering.explain("A")["tier"], "mem")
+        self.assertTrue(
+            tiering.explain("A")["reason"].startswith("mem: cheapest tier with room")
+        )
+
+        # memcached has no room, and "A" saves more per byte
+        tiering.create("B", b"B" * 8, 1)
+        explanation = tiering.explain("B")
+        self.assertEqual(explanation["tier"], "fs")
+        self.assertIn("cheaper tiers full: mem", explanation["reason"])
+        self.assertLess(explanation["costs"]["mem"], explanation["costs"]["fs"])
+
+        # "C" saves more per byte than "A", moved to the filesystem
+        tiering.create("C", b"C" * 8, 1000)
+        self.assertEqual(tiering.explain("C")["tier"], "mem")
+        self.assertEqual(
+            tiering.explain("A")["reason"], "fs: moved out of the tier by C"
+        )
+        self.assertEqual(sorted(tiering.fs.keys()), ["A", "B"])
+        self.assertEqual(tiering.mem.read("A"), None)
+        self.assertEqual(tiering.read("A"), b"A" * 4)
+
+        # too large for memcached and the filesystem, whatever its access rate
+        tiering.create("D", b"D" * 30, 5000)
+        self.assertEqual(tiering.explain("D")["tier"], "aws")
+        self.assertEqual(model.used, {"aws": 30, "fs": 12, "mem": 8})
+
+        values = tiering.read_multi("ABCD")
+        sizes = {"A": 4, "B": 8, "C": 8, "D": 30}
+        self.assertEqual(values, {key: key.encode() * sizes[key] for key in sizes})
+        tiering.delete("C")
+        with self.assertRaises(FileNotFoundError):
+            tiering.explain("C")
+        with self.assertRaises(FileNotFoundError):
+            tiering.read("C")
+        self.assertEqual(model.used["mem"], 0)
+        self.assertGreater(model.models["mem"].samples, 0)
+
+    def test_measured_rate(self):
+        now = [0.0]
+        model = CostModel(
+            {"fs": 100, "mem": 8}, min_samples=10**9, clock=lambda: now[0]
+        )
+        tiering = Tiering(DictStorage(), DictStorage(), Mem(DictClient()), model)
+        self.addCleanup(tiering.close)
+        tiering.create("A", b"A" * 8, 100)
+        tiering.create("B", b"B" * 8, 1)
+        self.assertEqual(tiering.explain("B")["tier"], "fs")
+
+        # read more often than "A" after all, "B" takes its place in memcached
+        for _ in range(250):
+            self.assertEqual(tiering.read("B"), b"B" * 8)
+        self.assertTrue(tiering.flush(timeout=5))
+        explanation = tiering.explain("B")
+        self.assertEqual(explanation["tier"], "mem")
+        self.assertGreater(explanation["rate"], 100)
+        self.assertEqual(
+            tiering.explain("A")["reason"], "fs: moved out of the tier by B"
+        )
+        self.assertEqual(tiering.fs.objects, {"A": b"A" * 8})
+        self.assertEqual(model.used, {"aws": 0, "fs": 8, "mem": 8})
+
+        # the reads decay with their half-life
+        now[0] += model.half_life
+        rate = tiering.explain("B")["current_rate"]
+        self.assertAlmostEqual(rate, explanation["current_rate"] / 2)
+
+    def test_partial_placement(self):
+        class FailingStorage(DictStorage):
+            def create(self, key: str, data: bytes):
+                if key == "A":
+                    raise IOError(key)
+                super().create(key, data)
+
+        model = CostModel({"fs": 100, "mem": 8}, min_samples=10**9)
+        tiering = Tiering(FailingStorage(), DictStorage(), Mem(DictClient()), model)
+        self.addCleanup(tiering.close)
+        tiering.create("A", b"A" * 4, 100)
+        tiering.create("X", b"X" * 4, 50)
+
+        # "X" is moved out of memcached first, then copying "A" fails
+        with self.assertRaises(IOError):
+            tiering.create("C", b"C" * 8, 1000)
+        self.assertEqual(tiering.explain("X")["tier"], "fs")
+        self.assertEqual(tiering.fs.objects, {"X": b"X" * 4})
+        self.assertEqual(tiering.mem.read("X"), None)
+        self.assertEqual(tiering.explain("A")["tier"], "mem")
+        self.assertEqual(tiering.read("A"), b"A" * 4)
+        self.assertNotIn("C", model)
+        self.assertEqual(model.used, {"aws": 0, "fs": 4, "mem": 4})
+
+    def test_thresholds(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        aws = DictStorage()
+        tiering = Tiering(FileSystem(root=directory.name), aws, Mem(DictClient()))
+        tiering.create("K", b"value", 1)
+        self.assertEqual(aws.objects, {"K": b"value"})
+        self.assertEqual(tiering.read("K", 1), b"value")
+        tiering.create("K", b"value", 1001)
+        self.assertEqual(tiering.read("K", 1001), b"value")
+        self.assertIsNone(tiering.cost_model)
+
+        # the tier is given by the cost only
+        for operation in (tiering.read, tiering.delete, tiering.explain):
+            with self.assertRaises(ValueError):
+                operation("K")
+        self.assertEqual(aws.objects, {"K": b"value"})
+        tiering.delete("K", 1)
+        self.assertEqual(aws.objects, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from memcache import Client
+from test_single_flight import herd
+from utils.memcached_server import MemcachedServer
+from utils.memoize import memcached_memoize
+
+
+class JsonSerializer:
+    def dumps(self, value) -> bytes:
+        return json.dumps(value).encode()
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self):
+        self.server = MemcachedServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = Client([self.server.address])
+        self.calls = []
+
+    def memoize(self, **kwargs):
+        def square(x, y=1, **options):
+            self.calls.append(x)
+            return None if x == 0 else x * x * y
+
+        return memcached_memoize(self.client, **kwargs)(square)
+
+    def test_unreachable(self):
+        self.client = Client(["127.0.0.1:1"])
+        square = self.memoize()
+        self.assertEqual([square(3), square(3)], [9, 9])
+        self.assertEqual(self.calls, [3, 3])
+
+    def test_keys(self):
+        square = self.memoize()
+        self.assertEqual(square.key(2), square.key(2, 1))
+        self.assertEqual(square.key(x=2, y=1), square.key(2, y=1))
+        self.assertEqual(square.key(2, a=1, b=2), square.key(2, b=2, a=1))
+        self.assertNotEqual(square.key(2), square.key(3))
+        other = memcached_memoize(self.client)(lambda x: x)
+        self.assertNotEqual(square.key(2), other.key(2))
+        self.assertEqual(square.__name__, "square")
+
+    def test_cache(self):
+        square = self.memoize()
+        self.assertEqual([square(2), square(2, 1), square(x=2)], [4, 4, 4])
+        self.assertEqual([square(0), square(0)], [None, None])
+        self.assertEqual(self.calls, [2, 0])
+        self.assertEqual((square.hits, square.misses), (3, 2))
+
+        # another process sharing the memcached server
+        other = self.memoize()
+        self.assertEqual(other(2), 4)
+        self.assertEqual(other.hits, 1)
+
+        square.invalidate(2)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(self.calls, [2, 0, 2])
+
+    def test_stampede(self):
+        def slow(x):
+            self.calls.append(x)
+            time.sleep(0.1)
+            return x
+
+        memoized = memcached_memoize(self.client)(slow)
+        self.assertEqual(herd(lambda: memoized(1)), [1] * 16)
+        self.assertEqual(self.calls, [1])
+
+    def test_early_refresh(self):
+        def slow(x):
+            self.calls.append(x)
+            time.sleep(0.02)
+            return x
+
+        # -log(0.5) * 0.02s * beta: 0 with beta=0, 1.4s with beta=100, beyond the ttl
+        with mock.patch("utils.memoize.random.random", return_value=0.5):
+            lazy = memcached_memoize(self.client, ttl=1, beta=0)(slow)
+            self.assertEqual([lazy(1), lazy(1)], [1, 1])
+            self.assertEqual((self.calls, lazy.refreshes), ([1], 0))
+            eager = memcached_memoize(self.client, ttl=1, beta=100)(slow)
+            self.assertEqual([eager(2), eager(2)], [2, 2])
+            self.assertEqual((self.calls, eager.refreshes), ([1, 2, 2], 1))
+
+    def test_l1(self):
+        square = self.memoize(l1_size=10)
+        square(3)
+        self.client.delete(square.key(3))
+        self.assertEqual(square(3), 9)
+        self.assertEqual((square.l1_hits, square.misses), (1, 1))
+
+    def test_map(self):
+        square = self.memoize(serializer=JsonSerializer())
+        square(2)
+        self.assertEqual(square.map([1, 2, 3, 0, 1]), [1, 4, 9, None, 1])
+        self.assertEqual(self.calls, [2, 1, 3, 0])
+        self.assertEqual(square.map([1, 2], [2, 2]), [2, 8])
+        self.assertEqual(square.map([3, 0]), [9, None])
+        self.assertEqual(self.calls, [2, 1, 3, 0, 1, 2])
+        self.assertEqual(square(3), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
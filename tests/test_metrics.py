@@ -0,0 +1,110 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from test_local_storage import DictClient, DictStorage, GatedStorage
+from utils import metrics
+from utils.base_storage import Mem
+from utils.complex_storage import TwoLevelCaching
+from utils.LRU_storage import Mem_LRU
+from utils.metrics import Histogram, InstrumentedStorage, instrument
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.METRICS.clear()
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for _ in range(98):
+            histogram.record(0.0001)
+        histogram.record(0.5)
+        histogram.record(100)
+        self.assertEqual(histogram.quantile(0.5), 128e-6)
+        self.assertEqual(histogram.quantile(0.99), 0.524288)
+        self.assertEqual(histogram.quantile(1), float("inf"))
+        self.assertEqual(Histogram().quantile(0.99), 0.0)
+
+        # a latency equal to a bound falls in the bucket of that bound
+        for exponent, bound in enumerate(metrics.BOUNDS):
+            histogram = Histogram()
+            histogram.record(bound)
+            self.assertEqual(histogram.counts[exponent], 1)
+            self.assertEqual(histogram.quantile(1), bound)
+
+    def test_instrumented_storage(self):
+        storage = Mem_LRU(DictClient(), capacity=2)
+        self.assertIs(instrument(storage, "mem", enabled=False), storage)
+        mem = instrument(storage, "mem", enabled=True)
+        for key in "ABC":
+            mem.create(key, b"12345")
+        self.assertEqual(mem.read("C"), b"12345")
+        self.assertIsNone(mem.read("A"))
+        values = mem.read_multi(["B", "C", "D"])
+        self.assertEqual(values, {"B": b"12345", "C": b"12345"})
+        aws = GatedStorage(failures=1)
+        aws.gate.set()
+        with self.assertRaises(ConnectionError):
+            instrument(aws, "aws", enabled=True).create("K", b"")
+
+        snapshot = metrics.snapshot()["storages"]
+        self.assertEqual(
+            {key: snapshot["mem"][key] for key in metrics.StorageMetrics.COUNTERS},
+            {
+                "hits": 3,
+                "misses": 2,
+                "evictions": 1,
+                "bytes_in": 15,
+                "bytes_out": 15,
+                "errors": 0,
+            },
+        )
+        self.assertEqual(snapshot["mem"]["operations"]["create"]["count"], 3)
+        self.assertEqual(snapshot["aws"]["errors_by_operation"], {"create": 1})
+        self.assertEqual(mem.lru, storage.lru)
+
+        # values that are not bytes are not counted as bytes
+        objects = instrument(Mem(DictClient()), "objects", enabled=True)
+        objects.create("K", 42)
+        self.assertEqual(objects.read("K"), 42)
+        self.assertEqual(objects.read_multi(["K"]), {"K": 42})
+        counters = metrics.snapshot()["storages"]["objects"]
+        self.assertEqual((counters["hits"], counters["bytes_out"]), (2, 0))
+
+        text = metrics.prometheus()
+        self.assertIn('storage_hits_total{storage="mem"} 3\n', text)
+        self.assertIn(
+            'storage_latency_seconds_count{storage="mem",operation="read"} 2\n', text
+        )
+        self.assertIn(
+            'storage_latency_seconds_bucket{storage="mem",operation="read",le="+Inf"} 2\n',
+            text,
+        )
+
+    def test_two_level_caching(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with mock.patch.object(metrics, "METRICS_ENABLED", True):
+            cache = TwoLevelCaching(
+                DictClient(), 4, 2, fs_root=directory.name, aws=DictStorage()
+            )
+        self.assertIsInstance(cache.mem_lru, InstrumentedStorage)
+        cache.aws.create("A", b"a")
+        for _ in range(3):
+            cache.read("A")
+        ratios = {
+            name: values["hit_ratio"]
+            for name, values in metrics.snapshot()["storages"].items()
+        }
+        self.assertEqual(
+            ratios, {"2level.aws": 1.0, "2level.fs": 0.0, "2level.mem": 2 / 3}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
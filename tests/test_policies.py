@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from memcache import Client
+from test_local_storage import DictClient, DictStorage
+from utils.base_storage import RELATIVE_EXPIRY_LIMIT, expiry
+from utils.complex_storage import TwoLevelCaching
+from utils.LRU import LRU
+from utils.LRU_storage import FileSystem_LRU, Mem_LRU
+from utils.memcached_server import MemcachedServer
+from utils.policies import ARC, CountMinSketch, TwoQueue, WTinyLFU, make_policy
+
+
+class TestPolicies(unittest.TestCase):
+    def test_contract(self):
+        for name in ("lru", "arc", "2q", "w-tinylfu"):
+            with self.subTest(policy=name):
+                evicted = []
+                policy = make_policy(name, 4)
+                policy.on_evict = lambda key, value: evicted.append(key)
+                self.assertEqual(policy.read("K"), None)
+                policy.create("K", 1)
+                self.assertEqual(policy.read("K"), 1)
+                policy.create("K", 2)
+                self.assertEqual(policy.peek("K"), 2)
+                for i in range(10):
+                    policy.create(f"key-{i}", i)
+                self.assertLessEqual(len(policy), 4)
+                self.assertEqual(len(evicted), 11 - len(policy))
+                self.assertEqual(sorted(policy.keys()), sorted(set(policy.keys())))
+                for key in list(policy.keys()):
+                    policy.delete(key)
+                self.assertEqual(len(policy), 0)
+
+        with self.assertRaises(ValueError):
+            make_policy("mru", 4)
+
+    def test_ttl(self):
+        client = DictClient()
+        with self.assertRaises(ValueError):
+            Mem_LRU(client, lru=ARC(4), ttl=10)
+        with tempfile.TemporaryDirectory() as root:
+            with self.assertRaises(ValueError):
+                FileSystem_LRU(lru=TwoQueue(4), root=root, ttl=10)
+            cache = FileSystem_LRU(lru=WTinyLFU(4), root=root)
+            with self.assertRaises(ValueError):
+                cache.create("K", b"k", ttl=10)
+            self.assertEqual(os.listdir(root), [])
+        cache = Mem_LRU(client, lru=ARC(4))
+        with self.assertRaises(ValueError):
+            cache.create("K", b"k", ttl=10)
+        self.assertEqual(client.get("K"), None)
+        cache = Mem_LRU(client, ttl=10)
+        cache.create("K", b"k")
+        self.assertEqual(cache.read("K"), b"k")
+
+    def test_two_level_caching(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = TwoLevelCaching(
+                DictClient(), 4, 2, mem_policy="arc", fs_root=root, aws=DictStorage()
+            )
+            cache.create("K", b"k")
+            self.assertEqual(cache.read("K"), b"k")
+            # the policies other than lru are neither sharded nor bounded in bytes
+            for options in ({"shards": 4}, {"mem_lru_max_bytes": 100}):
+                with self.subTest(**options), self.assertRaises(ValueError):
+                    TwoLevelCaching(
+                        DictClient(), 4, 2, mem_policy="2q", aws=DictStorage(), **options
+                    )
+
+    def test_long_ttl(self):
+        self.assertEqual(expiry(None), 0)
+        self.assertEqual(expiry(1.5), 2)
+        self.assertEqual(expiry(RELATIVE_EXPIRY_LIMIT), RELATIVE_EXPIRY_LIMIT)
+        # memcached reads the ttls above 30 days as unix timestamps
+        with MemcachedServer() as server:
+            cache = Mem_LRU(Client([server.address]), ttl=31 * 24 * 3600)
+            cache.create("K", b"k")
+            cache.mem.create_multi({"A": b"a"}, ttl=31 * 24 * 3600)
+            cache.mem.write_stream("S", [b"s"], ttl=31 * 24 * 3600)
+            self.assertEqual(cache.read("K"), b"k")
+            self.assertEqual(cache.mem.read_multi(["A", "S"]), {"A": b"a", "S": b"s"})
+
+    def test_scan_resistance(self):
+        hot = [f"hot-{i}" for i in range(20)]
+        for policy in (ARC(100), TwoQueue(100), WTinyLFU(100)):
+            with self.subTest(policy=policy.__class__.__name__):
+                for _ in range(5):
+                    for key in hot:
+                        if policy.read(key) is None:
+                            policy.create(key, key)
+                for i in range(1000):
+                    key = f"scan-{i}"
+                    if policy.read(key) is None:
+                        policy.create(key, key)
+                self.assertTrue(all(key in policy for key in hot))
+
+        lru = LRU(100)
+        for key in hot:
+            lru.create(key, key)
+        for i in range(1000):
+            lru.create(f"scan-{i}", i)
+        self.assertFalse(any(key in lru for key in hot))
+
+    def test_count_min_sketch(self):
+        sketch = CountMinSketch(16, sample_size=1000)
+        for _ in range(5):
+            sketch.increment("A")
+        sketch.increment("B")
+        self.assertGreaterEqual(sketch.estimate("A"), 5)
+        self.assertLess(sketch.estimate("B"), sketch.estimate("A"))
+        for _ in range(20):
+            sketch.increment("A")
+        self.assertEqual(sketch.estimate("A"), 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
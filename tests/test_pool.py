@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from utils.base_storage import Mem
+from utils.memcached_server import MemcachedServer
+from utils.pool import ClientPool, PymemcacheClient, Slots, pool_metrics
+
+
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        self.server = MemcachedServer(latency=0.002).start()
+        self.addCleanup(self.server.stop)
+
+    def test_concurrent_mem(self):
+        pool = ClientPool(lambda: PymemcacheClient(self.server.address), 2, name="test")
+        mem = Mem(pool)
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(20):
+                    key = f"key-{n}-{i}"
+                    mem.create(key, b"%d" % i)
+                    self.assertEqual(mem.read(key), b"%d" % i)
+                self.assertEqual(
+                    mem.read_multi([f"key-{n}-{i}" for i in range(3)]),
+                    {f"key-{n}-{i}": b"%d" % i for i in range(3)},
+                )
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.items), 120)
+
+        metrics = pool_metrics()["test"]
+        self.assertEqual(metrics["in_use"], 0)
+        self.assertEqual(metrics["acquisitions"], 6 * 41)
+        self.assertGreater(metrics["waits"], 0)
+        self.assertGreater(metrics["max_wait_seconds"], 0)
+        with pool.acquire() as client:
+            self.assertEqual(client.get_stats()[0][1]["curr_items"], 120)
+
+    def test_factory_error(self):
+        attempts = []
+
+        def factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ConnectionRefusedError("memcached is down")
+            return PymemcacheClient(self.server.address)
+
+        pool = ClientPool(factory, 1, timeout=0.1, name="test-factory")
+        with self.assertRaises(ConnectionRefusedError):
+            pool.get("K")
+        # the slot of the failed client is free again
+        self.assertEqual(pool.set("K", b"value"), True)
+        self.assertEqual(pool.get("K"), b"value")
+        self.assertEqual(len(attempts), 2)
+
+    def test_broken_client(self):
+        clients = []
+
+        class FlakyClient:
+            def __init__(self):
+                self.closed = False
+                clients.append(self)
+
+            def get(self, key):
+                if len(clients) == 1:
+                    raise ConnectionResetError("connection reset mid-response")
+                return b"value"
+
+            def disconnect_all(self):
+                self.closed = True
+
+        pool = ClientPool(FlakyClient, 1, timeout=0.1, name="test-broken")
+        with self.assertRaises(ConnectionResetError):
+            pool.get("K")
+        # the client of the failed call is not reused
+        self.assertEqual(pool.get("K"), b"value")
+        self.assertEqual(len(clients), 2)
+        self.assertTrue(clients[0].closed)
+        self.assertEqual(pool_metrics()["test-broken"]["in_use"], 0)
+
+    def test_timeout(self):
+        slots = Slots("test-slots", 1, timeout=0.01)
+        with slots.slot():
+            with self.assertRaises(TimeoutError):
+                with slots.slot():
+                    pass
+        self.assertEqual(pool_metrics()["test-slots"]["timeouts"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
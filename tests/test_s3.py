@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from utils.base_storage import AWSS3, MB, S3_MAX_CONNECTIONS
+from utils.fake_s3 import FakeS3Client
+
+
+class TestAWSS3(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeS3Client()
+        self.aws = AWSS3(client=self.client, multipart_threshold=12 * MB, part_size=5 * MB)
+
+    def test_small(self):
+        self.aws.create("small", b"value")
+        self.aws.create("empty", b"")
+        self.assertEqual(self.aws.read("small"), b"value")
+        self.assertEqual(self.aws.read("empty"), b"")
+        # the same type as the large objects
+        self.assertIsInstance(self.aws.read("small"), bytearray)
+        self.assertIsInstance(self.aws.read("empty"), bytearray)
+        self.assertEqual(self.client.calls["PutObject"], 2)
+        self.assertNotIn("UploadPart", self.client.calls)
+        self.assertEqual(self.aws.read_multi(["small", "missing"]), {"small": b"value"})
+
+    def test_multipart(self):
+        data = os.urandom(1024) * (13 * 1024)
+        self.aws.create("large", data)
+        self.assertEqual(self.client.calls["UploadPart"], 3)
+        self.assertNotIn("PutObject", self.client.calls)
+        self.assertEqual(self.client.buckets["ensta"]["large"][0], data)
+
+        large = self.aws.read("large")
+        self.assertEqual(large, data)
+        # the buffer the ranges were read into, without a copy
+        self.assertIsInstance(large, bytearray)
+        self.assertEqual(self.client.calls["GetObject"], 3)
+
+        self.aws.create("medium", data[: 6 * MB])
+        self.assertEqual(self.aws.read("medium"), data[: 6 * MB])
+        self.assertEqual(self.client.calls["PutObject"], 1)
+        self.assertEqual(self.client.calls["GetObject"], 5)
+
+    def test_shared_threads(self):
+        data = os.urandom(1024) * (13 * 1024)
+        self.aws.create("large", data)
+        storages = [
+            AWSS3(client=self.client, part_size=5 * MB, concurrency=8) for _ in range(40)
+        ]
+        for aws in storages:
+            self.assertEqual(aws.read("large"), data)
+        # the storages share the threads of the part requests
+        threads = [
+            thread
+            for thread in threading.enumerate()
+            if thread.name.startswith("s3-parts")
+        ]
+        self.assertLessEqual(len(threads), S3_MAX_CONNECTIONS)
+
+    def test_write_stream(self):
+        data = os.urandom(1024) * (13 * 1024)
+        self.aws.write_stream("large", (data[i : i + MB] for i in range(0, len(data), MB)))
+        self.assertEqual(self.client.calls["UploadPart"], 3)
+        self.assertEqual(b"".join(self.aws.read_stream("large", MB)), data)
+        self.aws.write_stream("small", [b"a", b"b"])
+        self.assertEqual(self.aws.read("small"), b"ab")
+
+    def test_multipart_abort(self):
+        self.aws.part_size = 1 * MB
+        with self.assertRaises(Exception):
+            self.aws.create("large", bytes(13 * MB))
+        self.assertEqual(self.client.calls["AbortMultipartUpload"], 1)
+        self.assertNotIn("large", self.client.buckets.get("ensta", {}))
+
+
+class TestList(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeS3Client()
+        self.aws = AWSS3(client=self.client, index=True)
+        for i in range(25):
+            self.aws.create(f"images/{i:02}.jpg", b"x" * i)
+        self.aws.create("thumbs/a.jpg", b"")
+        self.aws.create("readme", b"")
+
+    def test_pages(self):
+        keys = self.aws.list(page_size=10)
+        self.assertEqual(next(keys), "images/00.jpg")
+        self.assertEqual(self.client.calls["ListObjectsV2"], 1)
+        self.assertEqual(len(list(keys)), 26)
+        self.assertEqual(self.client.calls["ListObjectsV2"], 3)
+
+        self.assertEqual(len(list(self.aws.list("images/1", page_size=4))), 10)
+        self.assertEqual(
+            list(self.aws.list(delimiter="/", page_size=1)),
+            ["images/", "readme", "thumbs/"],
+        )
+
+    def test_index(self):
+        index = self.aws.index
+        self.assertIsNone(index.exists("other"))
+        index.page_size = 10
+        self.assertFalse(index.refresh(max_pages=2))
+        self.client.buckets["ensta"].pop("thumbs/a.jpg")
+        self.assertTrue(index.refresh())
+        self.assertEqual(len(index), 26)
+
+        calls = dict(self.client.calls)
+        self.assertTrue(self.aws.exists("images/03.jpg"))
+        self.assertFalse(self.aws.exists("thumbs/a.jpg"))
+        self.assertEqual(self.aws.size("images/07.jpg"), 7)
+        self.assertIsNone(self.aws.size("other"))
+        self.aws.create("other", b"abc")
+        self.assertEqual(self.aws.size("other"), 3)
+        self.aws.delete_multi(["other", "readme"])
+        self.assertFalse(self.aws.exists("readme"))
+        self.assertNotIn("HeadObject", self.client.calls)
+        self.assertEqual(self.client.calls["ListObjectsV2"], calls["ListObjectsV2"])
+
+        self.aws.index = None
+        self.assertTrue(self.aws.exists("images/03.jpg"))
+        self.assertIsNone(self.aws.size("readme"))
+        self.assertEqual(self.client.calls["HeadObject"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from benchmark import serializers
+from test_local_storage import DictClient
+from utils.base_storage import Mem
+from utils.codec import Codec
+from utils.serializer import (
+    MAGIC,
+    PICKLE,
+    PICKLE_OOB,
+    RAW,
+    STR,
+    Serializer,
+    msgpack,
+)
+
+
+class Blob(bytearray):
+    """bytearray pickled out-of-band with protocol 5, like a numpy array"""
+
+    def __reduce_ex__(self, protocol):
+        return type(self), (pickle.PickleBuffer(self),)
+
+
+class TestSerializer(unittest.TestCase):
+    def test_round_trip(self):
+        serializer = Serializer()
+        values = [
+            "héllo",
+            42,
+            None,
+            (1, "2", 3.0),
+            {"a": [1, 2], "b": {"c": None}},
+            MAGIC + b"bytes with the magic bytes",
+            b"",
+        ]
+        for value in values:
+            self.assertEqual(serializer.loads(serializer.dumps(value)), value)
+
+    def test_type_flags(self):
+        serializer = Serializer()
+        data = os.urandom(100).replace(MAGIC[:1], b"")
+        # the bytes are stored as they are
+        self.assertIs(serializer.dumps(data), data)
+        self.assertEqual(serializer.dumps(memoryview(data)), data)
+        self.assertEqual(serializer.dumps(MAGIC)[2], RAW)
+        self.assertEqual(serializer.dumps("text")[2], STR)
+        self.assertEqual(serializer.dumps([1])[2], PICKLE)
+        # values pickled by the client, or unknown flags, are returned as they are
+        self.assertEqual(serializer.loads(42), 42)
+        self.assertIsNone(serializer.loads(MAGIC + b"\xff"))
+
+    def test_out_of_band(self):
+        serializer = Serializer(oob_threshold=1024)
+        payload = Blob(os.urandom(4096))
+        value = {"id": 1, "small": Blob(b"small"), "payload": payload}
+        data = serializer.dumps(value)
+        self.assertEqual(data[2], PICKLE_OOB)
+        # the buffer is appended once, after the pickle of the rest of the value
+        self.assertTrue(data.endswith(payload))
+        self.assertLess(len(data), len(payload) + 200)
+        self.assertEqual(serializer.loads(data), value)
+
+        self.assertEqual(Serializer(oob_threshold=8192).dumps(value)[2], PICKLE)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        serializer = Serializer(use_msgpack=True)
+        value = {"a": [1, 2.5, "c", b"d"]}
+        self.assertEqual(serializer.loads(serializer.dumps(value)), value)
+        # not supported by msgpack: pickled
+        self.assertEqual(serializer.dumps({1, 2})[2], PICKLE)
+
+    def test_mem(self):
+        mem = Mem(DictClient(), 1024, Codec(threshold=100), Serializer())
+        records = [{"id": index, "name": f"item-{index}"} for index in range(200)]
+        mem.create("records", records)
+        mem.create("text", "text")
+        mem.create("bytes", b"bytes")
+        self.assertEqual(mem.read("records"), records)
+        self.assertEqual(
+            mem.read_multi(["records", "text", "bytes", "missing"]),
+            {"records": records, "text": "text", "bytes": b"bytes"},
+        )
+        self.assertEqual(mem.client["bytes"], b"bytes")
+        self.assertNotIsInstance(mem.client["records"], list)
+
+        # streamed bytes starting like a serialized value are read back unchanged
+        mem = Mem(DictClient(), 4, serializer=Serializer())
+        value = MAGIC + b"\x00streamed"
+        mem.write_stream("stream", [value[:3], value[3:]])
+        self.assertEqual(mem.read("stream"), value)
+
+    def test_benchmark(self):
+        report = serializers([1024], min_seconds=0)
+        results = report["results"]
+        kinds = {(result["serializer"], result["payload"]) for result in results}
+        self.assertIn(("client-pickle", "records"), kinds)
+        self.assertIn(("serializer", "binary-record"), kinds)
+        binary = {
+            result["serializer"]: result["bytes"]
+            for result in report["results"]
+            if result["payload"] == "binary-record"
+        }
+        # protocol 0 escapes the binary data
+        self.assertLess(binary["serializer"], binary["client-pickle"])
+        self.assertEqual(pickle.loads(pickle.dumps(report)), report)
+
+
+if __name__ == "__main__":
+    unittest.main()
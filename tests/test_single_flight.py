@@ -0,0 +1,140 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+)
+from memcache import Client
+from test_local_storage import DictClient, DictStorage
+from utils.base_storage import FileSystem
+from utils.complex_storage import Replica, TwoLevelCaching
+from utils.memcached_server import MemcachedServer
+from utils.single_flight import MemcachedLease, SingleFlight
+
+
+class SlowStorage(DictStorage):
+    """DictStorage counting the reads, which take `delay` seconds"""
+
+    def __init__(self, delay: float = 0.05) -> None:
+        super().__init__()
+        self.delay = delay
+        self.reads = 0
+
+    def read(self, key: str) -> bytes:
+        self.reads += 1
+        time.sleep(self.delay)
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        return self.objects[key]
+
+
+def herd(function, callers: int = 16):
+    barrier = threading.Barrier(callers)
+
+    def call():
+        barrier.wait()
+        return function()
+
+    with ThreadPoolExecutor(callers) as executor:
+        futures = [executor.submit(call) for _ in range(callers)]
+    return [future.result() for future in futures]
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do(self):
+        flight = SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return b"value"
+
+        self.assertEqual(herd(lambda: flight.do("K", compute)), [b"value"] * 16)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.shared, 15)
+
+        def fail():
+            time.sleep(0.05)
+            raise FileNotFoundError("K")
+
+        with self.assertRaises(FileNotFoundError):
+            herd(lambda: flight.do("K", fail))
+        self.assertEqual(flight.do("K", compute), b"value")
+
+    def test_replica(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        aws = SlowStorage()
+        aws.objects["K"] = b"value"
+        replica = Replica(FileSystem(root=directory.name), aws)
+        self.assertEqual(herd(lambda: replica.read("K")), [b"value"] * 16)
+        self.assertEqual(aws.reads, 1)
+
+    def test_two_level_caching(self):
+        cache = TwoLevelCaching(DictClient(), 10, 5, aws=SlowStorage())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        key = os.path.join(directory.name, "K")
+        cache.aws.objects[key] = b"value"
+        self.assertEqual(herd(lambda: cache.read(key)), [b"value"] * 16)
+        self.assertEqual(cache.aws.reads, 1)
+
+
+class TestMemcachedLease(unittest.TestCase):
+    def setUp(self):
+        self.server = MemcachedServer().start()
+        self.addCleanup(self.server.stop)
+
+    def test_lease(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 42
+
+        # one lease per client, as if each caller was a process of its own
+        leases = [
+            MemcachedLease(Client([self.server.address]), poll=0.01) for _ in range(8)
+        ]
+        index = iter(range(8))
+        results = herd(
+            lambda: leases[next(index)].get_or_compute("f-6", compute), callers=8
+        )
+        self.assertEqual(results, [42] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(leases[0].client.get("f-6:lease"), None)
+
+    def test_expired_lease(self):
+        client = Client([self.server.address])
+        client.add("K:lease", "dead process", time=1)
+        lease = MemcachedLease(client, poll=0.05)
+        start = time.monotonic()
+        self.assertEqual(lease.get_or_compute("K", lambda: "value"), "value")
+        self.assertGreater(time.monotonic() - start, 0.5)
+        self.assertEqual(client.get("K"), "value")
+
+    def test_stuck_lease(self):
+        client = Client([self.server.address])
+        client.add("K:lease", "stuck process", time=60)
+        lease = MemcachedLease(client, lease_ttl=1, poll=0.05)
+        start = time.monotonic()
+        self.assertEqual(lease.get_or_compute("K", lambda: "value"), "value")
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(client.get("K:lease"), "stuck process")
+
+    def test_unreachable(self):
+        lease = MemcachedLease(Client(["127.0.0.1:1"]), poll=0.05)
+        start = time.monotonic()
+        self.assertEqual(lease.get_or_compute("K", lambda: "value"), "value")
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
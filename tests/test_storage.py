@@ -137,6 +137,7 @@ class TestStorage(unittest.TestCase):
         for i in range(200):
             content_auto_tiering = auto_tiering.read(auto_tiering_filename)
             assert content == content_auto_tiering
+        auto_tiering.flush()
         self.__assertStorage(
             auto_tiering_filename, content, aws=False, fs=True, mem=False
         )
@@ -145,6 +146,7 @@ class TestStorage(unittest.TestCase):
         for i in range(2000):
             content_auto_tiering = auto_tiering.read(auto_tiering_filename)
             assert content == content_auto_tiering
+        auto_tiering.flush()
         self.__assertStorage(
             auto_tiering_filename, content, aws=False, fs=False, mem=True
         )